@@ -1,4 +1,4 @@
-import sqlite3
+from db_pool import get_connection
 
 def get_ai_response(user_question, user_medications=""):
     """AI response function"""
@@ -23,10 +23,8 @@ For medication information, consult your pharmacist or search online."""
 def get_medication_list_for_ai():
     """Get formatted medication list"""
     try:
-        conn = sqlite3.connect('data/dosebuddy.db')
-        cursor = conn.execute('SELECT name, dosage, frequency FROM medications')
-        meds = cursor.fetchall()
-        conn.close()
+        with get_connection() as conn:
+            meds = conn.execute('SELECT name, dosage, frequency FROM medications').fetchall()
         
         if not meds:
             return "No medications currently tracked"
@@ -1,12 +1,16 @@
+import asyncio
 import streamlit as st
 from database import *
+from async_db import get_async_database
 from scheduler import start_scheduler, load_all_schedules
+from scheduler_service import get_scheduler_status
+from templates import LOCALES
 from ai_assistant import get_ai_response, get_medication_list_for_ai
 from analytics import create_pie_chart, create_bar_chart, calculate_adherence_score
 from PIL import Image
 import os
-import sqlite3
-from datetime import datetime, time as dt_time
+from datetime import time as dt_time
+import clock
 
 # Page configuration
 st.set_page_config(
@@ -208,11 +212,12 @@ apply_theme_css()
 # Initialize database
 init_database()
 
-# Start scheduler in background
-if 'scheduler_started' not in st.session_state:
-    start_scheduler()
-    load_all_schedules()
-    st.session_state.scheduler_started = True
+# Start scheduler in background, once per server process (shared by every session)
+@st.cache_resource
+def get_scheduler():
+    return start_scheduler()
+
+get_scheduler()
 
 # Sidebar with theme toggle
 st.sidebar.title("💊 DoseBuddy")
@@ -228,17 +233,24 @@ if st.sidebar.button(f"{theme_icon} {theme_text}", key="theme_toggle"):
 
 st.sidebar.markdown("---")
 
-# Check low stock for notification badge
-meds = get_all_medications()
-low_stock_count = len([m for m in meds if m[6] <= 10])
+db = get_async_database()
+
+
+async def load_sidebar_data():
+    # Independent reads run side by side on the reader pool
+    return await asyncio.gather(db.get_medication_summaries(), db.get_guardian_info())
+
+
+# Check low stock for notification badge (reused by the pages below)
+meds, guardian = asyncio.run(load_sidebar_data())
+low_stock_count = len([m for m in meds if m.remaining_count <= 10])
 
 if low_stock_count > 0:
     st.sidebar.warning(f"🔔 {low_stock_count} Low Stock Alert(s)!")
 
 # Check if guardian is configured
-guardian = get_guardian_info()
 if guardian:
-    st.sidebar.success(f"👨‍👩‍👧 Guardian: {guardian[2]}")
+    st.sidebar.success(f"👨‍👩‍👧 Guardian: {guardian.guardian_name}")
 
 page = st.sidebar.radio("Navigate", [
     "🏠 Dashboard", 
@@ -294,7 +306,7 @@ if page == "🏠 Dashboard":
         st.metric("Active Medications", len(meds))
     
     with col3:
-        low_stock = [m for m in meds if m[6] <= 10]
+        low_stock = [m for m in meds if m.remaining_count <= 10]
         st.metric("Low Stock Alerts", len(low_stock), delta="Critical" if len(low_stock) > 0 else None)
     
     if low_stock:
@@ -304,45 +316,71 @@ if page == "🏠 Dashboard":
         """, unsafe_allow_html=True)
         
         for med in low_stock:
-            med_type_icon = get_med_type_icon(med[8] if len(med) > 8 else "Tablet")
+            med_type_icon = get_med_type_icon(med.med_type)
             st.markdown(f"""
             <div class="low-stock-item">
-                {med_type_icon} <strong>{med[1]}</strong> ({med[2]}) - Only <strong>{med[6]}</strong> remaining
+                {med_type_icon} <strong>{med.name}</strong> ({med.dosage}) - Only <strong>{med.remaining_count}</strong> remaining
             </div>
             """, unsafe_allow_html=True)
         
         st.markdown("</div>", unsafe_allow_html=True)
     
     st.subheader("📅 Today's Schedule")
-    medications = get_all_medications()
+    medications = meds
     if medications:
+        # Today's dose instances with their logged status, in one indexed lookup
+        today_doses = {}
+        for instance in get_dose_instances_for_day():
+            today_doses.setdefault(instance.medication_id, []).append(instance)
+        
+        status_icons = {'Taken': "✅", 'Missed': "❌", 'Delayed': "⏰", None: "⏳"}
+        
+        def next_dose_time(med, open_statuses):
+            """Time of the medication's earliest dose today still in open_statuses, else 'Manual'"""
+            for instance in today_doses.get(med.id, []):
+                if instance.status in open_statuses:
+                    return instance.scheduled_time
+            return "Manual"
+        
+        if st.button("✅ Mark All Taken", key="mark_all_taken"):
+            # Only medications with a dose still open today; the rest have nothing to take
+            due = [(med, next_dose_time(med, (None, 'Missed', 'Delayed'))) for med in medications]
+            due = [(med, dose_time) for med, dose_time in due if dose_time != "Manual"]
+            if due:
+                log_medications_bulk([(med.id, dose_time, "Taken") for med, dose_time in due])
+                update_tablet_counts([(med.id, max(0, med.remaining_count - 1)) for med, _ in due])
+                st.success(f"Logged {len(due)} medication(s) as taken!")
+            else:
+                st.info("No doses due today")
+            st.rerun()
+        
         for med in medications:
-            times_list = med[4].split(',')
-            formatted_times = [format_time_12hr(t) for t in times_list]
-            med_type_icon = get_med_type_icon(med[8] if len(med) > 8 else "Tablet")
+            doses_today = [f"{format_time_12hr(instance.scheduled_time)} {status_icons.get(instance.status, '')}"
+                           for instance in today_doses.get(med.id, [])]
+            med_type_icon = get_med_type_icon(med.med_type)
             
-            with st.expander(f"{med_type_icon} {med[1]} - {med[2]}"):
+            with st.expander(f"{med_type_icon} {med.name} - {med.dosage}"):
                 col1, col2 = st.columns([2, 1])
                 with col1:
-                    st.write(f"**Type:** {med[8] if len(med) > 8 else 'Tablet'}")
-                    st.write(f"**Times:** {', '.join(formatted_times)}")
+                    st.write(f"**Type:** {med.med_type}")
+                    st.write(f"**Today:** {', '.join(doses_today) or 'No doses scheduled'}")
                 with col2:
-                    st.write(f"**Remaining:** {med[6]}")
-                    if med[6] <= 10:
+                    st.write(f"**Remaining:** {med.remaining_count}")
+                    if med.remaining_count <= 10:
                         st.error("⚠️ Low!")
                 
                 col1, col2 = st.columns(2)
                 with col1:
-                    if st.button(f"✅ Taken", key=f"taken_{med[0]}"):
-                        log_medication_taken(med[0], "Manual", "Taken")
-                        new_count = med[6] - 1
-                        update_tablet_count(med[0], new_count)
+                    if st.button(f"✅ Taken", key=f"taken_{med.id}"):
+                        log_medication_taken(med.id, next_dose_time(med, (None, 'Missed', 'Delayed')), "Taken")
+                        new_count = max(0, med.remaining_count - 1)
+                        update_tablet_count(med.id, new_count)
                         st.success("Logged as taken!")
                         st.rerun()
                 
                 with col2:
-                    if st.button(f"❌ Missed", key=f"missed_{med[0]}"):
-                        log_medication_taken(med[0], "Manual", "Missed")
+                    if st.button(f"❌ Missed", key=f"missed_{med.id}"):
+                        log_medication_taken(med.id, next_dose_time(med, (None,)), "Missed")
                         st.warning("Logged as missed")
                         st.rerun()
     else:
@@ -457,8 +495,8 @@ elif page == "💊 My Medications":
             if submitted:
                 if med_name and med_dosage and len(times) == med_frequency:
                     times_str = ",".join(times)
-                    add_medication_with_type(med_name, med_dosage, med_frequency, times_str, med_count, med_type)
-                    load_all_schedules()
+                    med_id = add_medication_with_type(med_name, med_dosage, med_frequency, times_str, med_count, med_type)
+                    load_all_schedules(med_id)
                     st.success(f"✅ {med_name} added successfully!")
                     st.balloons()
                     st.session_state.temp_frequency = 1
@@ -471,42 +509,42 @@ elif page == "💊 My Medications":
         medications = get_all_medications()
         
         if medications:
+            dose_times = get_dose_times_by_medication()
+            
             for med in medications:
-                med_type_icon = get_med_type_icon(med[8] if len(med) > 8 else "Tablet")
-                with st.expander(f"{med_type_icon} {med[1]} - {med[2]}"):
-                    times_list = med[4].split(',')
+                med_type_icon = get_med_type_icon(med.med_type)
+                with st.expander(f"{med_type_icon} {med.name} - {med.dosage}"):
+                    times_list = dose_times.get(med.id, [])
                     formatted_times = [format_time_12hr(t) for t in times_list]
                     
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.write(f"**Type:** {med[8] if len(med) > 8 else 'Tablet'}")
-                        st.write(f"**Frequency:** {med[3]}x daily")
+                        st.write(f"**Type:** {med.med_type}")
+                        st.write(f"**Frequency:** {med.frequency}x daily")
                         st.write(f"**Times:** {', '.join(formatted_times)}")
-                        st.write(f"**Added on:** {med[7]}")
+                        st.write(f"**Added on:** {med.added_date}")
                     with col2:
-                        unit = "units"
-                        if len(med) > 8:
-                            if med[8] in ["Syrup", "Drops", "Cream/Ointment"]:
-                                unit = "ml/grams"
-                            elif med[8] == "Injection":
-                                unit = "syringes"
-                            elif med[8] == "Inhaler":
-                                unit = "puffs"
-                            else:
-                                unit = "tablets"
+                        if med.med_type in ["Syrup", "Drops", "Cream/Ointment"]:
+                            unit = "ml/grams"
+                        elif med.med_type == "Injection":
+                            unit = "syringes"
+                        elif med.med_type == "Inhaler":
+                            unit = "puffs"
+                        else:
+                            unit = "tablets"
                         
-                        st.write(f"**Total:** {med[5]} {unit}")
-                        st.write(f"**Remaining:** {med[6]} {unit}")
+                        st.write(f"**Total:** {med.total_count} {unit}")
+                        st.write(f"**Remaining:** {med.remaining_count} {unit}")
                         
-                        if med[6] <= 10:
+                        if med.remaining_count <= 10:
                             st.error("⚠️ Low stock!")
-                        elif med[6] <= 20:
+                        elif med.remaining_count <= 20:
                             st.warning("⚠️ Running low")
                     
-                    if st.button(f"🗑️ Delete {med[1]}", key=f"delete_{med[0]}"):
-                        delete_medication(med[0])
-                        load_all_schedules()
-                        st.success(f"✅ Deleted {med[1]}")
+                    if st.button(f"🗑️ Delete {med.name}", key=f"delete_{med.id}"):
+                        delete_medication(med.id)
+                        load_all_schedules(med.id)
+                        st.success(f"✅ Deleted {med.name}")
                         st.rerun()
         else:
             st.info("No medications added yet")
@@ -515,7 +553,7 @@ elif page == "💊 My Medications":
 elif page == "📊 Analytics":
     st.title("📊 Analytics Dashboard")
     
-    low_stock = [m for m in meds if m[6] <= 10]
+    low_stock = [m for m in meds if m.remaining_count <= 10]
     if low_stock:
         st.markdown("""
         <div class="low-stock-alert">
@@ -523,11 +561,11 @@ elif page == "📊 Analytics":
         """, unsafe_allow_html=True)
         
         for med in low_stock:
-            med_type_icon = get_med_type_icon(med[8] if len(med) > 8 else "Tablet")
-            percentage = (med[6] / med[5]) * 100
+            med_type_icon = get_med_type_icon(med.med_type)
+            percentage = (med.remaining_count / med.total_count) * 100
             st.markdown(f"""
             <div class="low-stock-item">
-                {med_type_icon} <strong>{med[1]}</strong> - {med[6]}/{med[5]} remaining ({percentage:.0f}%)
+                {med_type_icon} <strong>{med.name}</strong> - {med.remaining_count}/{med.total_count} remaining ({percentage:.0f}%)
             </div>
             """, unsafe_allow_html=True)
         
@@ -560,22 +598,13 @@ elif page == "📊 Analytics":
     with col1:
         st.metric("Adherence Score (30 days)", f"{score}%")
     
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT 
-            SUM(CASE WHEN status='Taken' THEN 1 ELSE 0 END) as taken,
-            SUM(CASE WHEN status='Missed' THEN 1 ELSE 0 END) as missed
-        FROM schedule_log
-        WHERE date >= date('now', '-30 days')
-    ''')
-    stats = cursor.fetchone()
-    conn.close()
-    
-    if stats and stats[0]:
+    stats = get_adherence_statistics(30)
+    
+    if stats['taken']:
         with col2:
-            st.metric("Doses Taken", stats[0])
+            st.metric("Doses Taken", stats['taken'])
         with col3:
-            st.metric("Doses Missed", stats[1] if stats[1] else 0)
+            st.metric("Doses Missed", stats['missed'])
     
     if score >= 90:
         st.success("🌟 Excellent adherence! Keep up the great work!")
@@ -585,21 +614,11 @@ elif page == "📊 Analytics":
         st.error("❗ Poor adherence. Please consult your doctor")
     
     st.subheader("Recent Missed Doses")
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT m.name, m.dosage, sl.date, sl.scheduled_time
-        FROM schedule_log sl
-        JOIN medications m ON sl.medication_id = m.id
-        WHERE sl.status = 'Missed'
-        ORDER BY sl.date DESC, sl.scheduled_time DESC
-        LIMIT 10
-    ''')
-    missed = cursor.fetchall()
-    conn.close()
+    missed = get_recent_missed_doses(limit=10)
     
     if missed:
         for m in missed:
-            st.write(f"- **{m[0]}** ({m[1]}) - {m[2]} at {format_time_12hr(m[3])}")
+            st.write(f"- **{m.medication_name}** ({m.dosage}) - {m.date} at {format_time_12hr(m.scheduled_time)}")
     else:
         st.info("No missed doses! Great job! 🎉")
 
@@ -607,13 +626,13 @@ elif page == "📊 Analytics":
 elif page == "📋 Prescriptions":
     st.title("📋 Prescription Manager")
     
-    medications = get_all_medications()
+    medications = meds
     
     if not medications:
         st.info("Add medications first to upload prescriptions")
     else:
         st.subheader("Upload New Prescription")
-        med_names = {f"{get_med_type_icon(med[8] if len(med) > 8 else 'Tablet')} {med[1]} ({med[2]})": med[0] for med in medications}
+        med_names = {f"{get_med_type_icon(med.med_type)} {med.name} ({med.dosage})": med.id for med in medications}
         selected_med = st.selectbox("Select Medication", list(med_names.keys()))
         
         uploaded_file = st.file_uploader("Upload Prescription Image", type=['jpg', 'jpeg', 'png', 'pdf'])
@@ -624,54 +643,37 @@ elif page == "📋 Prescriptions":
             if not os.path.exists('prescriptions'):
                 os.makedirs('prescriptions')
             
-            file_path = f"prescriptions/prescription_{med_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uploaded_file.name}"
+            file_path = f"prescriptions/prescription_{med_id}_{clock.now().strftime('%Y%m%d_%H%M%S')}_{uploaded_file.name}"
             
             with open(file_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
             
-            conn = sqlite3.connect('data/dosebuddy.db')
-            conn.execute('''
-                INSERT INTO prescriptions (medication_id, image_path, upload_date)
-                VALUES (?, ?, ?)
-            ''', (med_id, file_path, datetime.now().strftime('%Y-%m-%d')))
-            conn.commit()
-            conn.close()
+            add_prescription(med_id, file_path)
             
             st.success("✅ Prescription saved successfully!")
             st.rerun()
         
         st.subheader("Saved Prescriptions")
-        conn = sqlite3.connect('data/dosebuddy.db')
-        cursor = conn.execute('''
-            SELECT p.id, p.image_path, p.upload_date, m.name, m.dosage
-            FROM prescriptions p
-            JOIN medications m ON p.medication_id = m.id
-            ORDER BY p.upload_date DESC
-        ''')
-        prescriptions = cursor.fetchall()
-        conn.close()
+        prescriptions = get_all_prescriptions()
         
         if prescriptions:
             for presc in prescriptions:
-                with st.expander(f"💊 {presc[3]} ({presc[4]}) - Uploaded on {presc[2]}"):
+                with st.expander(f"💊 {presc.medication_name} ({presc.dosage}) - Uploaded on {presc.upload_date}"):
                     col1, col2 = st.columns([3, 1])
                     with col1:
-                        if os.path.exists(presc[1]):
+                        if os.path.exists(presc.image_path):
                             try:
-                                image = Image.open(presc[1])
+                                image = Image.open(presc.image_path)
                                 st.image(image, use_container_width=True)
                             except:
                                 st.error("Unable to display image")
                         else:
                             st.error("Image file not found")
                     with col2:
-                        if st.button(f"🗑️ Delete", key=f"del_presc_{presc[0]}"):
-                            if os.path.exists(presc[1]):
-                                os.remove(presc[1])
-                            conn = sqlite3.connect('data/dosebuddy.db')
-                            conn.execute('DELETE FROM prescriptions WHERE id = ?', (presc[0],))
-                            conn.commit()
-                            conn.close()
+                        if st.button(f"🗑️ Delete", key=f"del_presc_{presc.id}"):
+                            if os.path.exists(presc.image_path):
+                                os.remove(presc.image_path)
+                            delete_prescription(presc.id)
                             st.success("Prescription deleted")
                             st.rerun()
         else:
@@ -685,16 +687,18 @@ elif page == "👨‍👩‍👧 Guardian Setup":
     guardian = get_guardian_info()
     
     if guardian:
-        st.success(f"✅ Guardian Configured: {guardian[2]} ({guardian[3]})")
+        st.success(f"✅ Guardian Configured: {guardian.guardian_name} ({guardian.guardian_phone})")
         
         col1, col2 = st.columns(2)
         with col1:
-            st.info(f"**Patient Name:** {guardian[1]}")
-            st.info(f"**Guardian Name:** {guardian[2]}")
+            st.info(f"**Patient Name:** {guardian.patient_name}")
+            st.info(f"**Guardian Name:** {guardian.guardian_name}")
         with col2:
-            st.info(f"**WhatsApp Number:** {guardian[3]}")
-            status = "✅ Enabled" if guardian[4] == 1 else "❌ Disabled"
+            st.info(f"**WhatsApp Number:** {guardian.guardian_phone}")
+            status = "✅ Enabled" if guardian.whatsapp_enabled == 1 else "❌ Disabled"
             st.info(f"**WhatsApp Alerts:** {status}")
+            st.info(f"**Message Language:** {guardian.locale or 'default'}"
+                    f" ({guardian.time_format or 'default'} time)")
         
         col1, col2, col3 = st.columns(3)
         
@@ -702,7 +706,7 @@ elif page == "👨‍👩‍👧 Guardian Setup":
             if st.button("🧪 Send Test WhatsApp"):
                 try:
                     from whatsapp_notifier import test_whatsapp_connection
-                    success, msg = test_whatsapp_connection(guardian[3])
+                    success, msg = test_whatsapp_connection(guardian.guardian_phone)
                     if success:
                         st.success("✅ Test message sent! Check WhatsApp.")
                     else:
@@ -711,7 +715,7 @@ elif page == "👨‍👩‍👧 Guardian Setup":
                     st.error(f"❌ WhatsApp notifier not configured: {e}")
         
         with col2:
-            current_status = guardian[4] == 1
+            current_status = guardian.whatsapp_enabled == 1
             new_status = st.toggle("Enable Alerts", value=current_status, key="whatsapp_toggle")
             if new_status != current_status:
                 update_guardian_whatsapp_status(new_status)
@@ -749,6 +753,12 @@ elif page == "👨‍👩‍👧 Guardian Setup":
                 placeholder="e.g., +919876543210 (with country code)")
             email = st.text_input("Email (Optional)", placeholder="guardian@example.com")
             
+            col1, col2 = st.columns(2)
+            with col1:
+                locale = st.selectbox("Message Language", sorted(LOCALES))
+            with col2:
+                time_format = st.selectbox("Time Format", ["Language default", "12h", "24h"])
+            
             st.info("📱 **Important:** Number must include country code (e.g., +91 for India, +1 for USA)")
             
             submitted = st.form_submit_button("💾 Save Guardian")
@@ -758,7 +768,8 @@ elif page == "👨‍👩‍👧 Guardian Setup":
                     if not guardian_phone.startswith('+'):
                         st.error("⚠️ Phone number must start with + and country code (e.g., +919876543210)")
                     else:
-                        add_guardian(patient_name, guardian_name, guardian_phone, email)
+                        add_guardian(patient_name, guardian_name, guardian_phone, email, locale,
+                                     None if time_format == "Language default" else time_format)
                         st.success("✅ Guardian added successfully!")
                         st.balloons()
                         st.rerun()
@@ -788,13 +799,12 @@ elif page == "👨‍👩‍👧 Guardian Setup":
             1. In Twilio Console, find:
                - **Account SID** (starts with AC...)
                - **Auth Token** (click to reveal)
-            2. Open `whatsapp_notifier.py` file
-            3. Replace:
+            2. Set them in the environment before starting DoseBuddy:
                ```
-               TWILIO_ACCOUNT_SID = "your_account_sid_here"
-               TWILIO_AUTH_TOKEN = "your_auth_token_here"
+               TWILIO_ACCOUNT_SID=your_account_sid_here
+               TWILIO_AUTH_TOKEN=your_auth_token_here
                ```
-            4. Save the file
+            3. Restart the app
             """)
         
         with st.expander("✅ Step 4: Test Connection"):
@@ -894,18 +904,12 @@ elif page == "⚙️ Settings":
         if st.button("📥 Export Data"):
             try:
                 import pandas as pd
-                conn = sqlite3.connect('data/dosebuddy.db')
-                df = pd.read_sql_query("""
-                    SELECT m.name, m.med_type, m.dosage, sl.date, sl.status
-                    FROM schedule_log sl
-                    JOIN medications m ON sl.medication_id = m.id
-                    ORDER BY sl.date DESC
-                """, conn)
-                conn.close()
+                df = pd.DataFrame(get_export_log_rows(),
+                    columns=['name', 'med_type', 'dosage', 'date', 'status'])
                 
                 csv = df.to_csv(index=False)
                 st.download_button("💾 Download CSV", csv, 
-                    f"dosebuddy_data_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv")
+                    f"dosebuddy_data_{clock.now().strftime('%Y%m%d')}.csv", "text/csv")
             except Exception as e:
                 st.error(f"Error: {e}")
     
@@ -932,16 +936,64 @@ elif page == "⚙️ Settings":
     """)
     
     st.subheader("🛠️ System Info")
+    
+    async def load_counts():
+        return await asyncio.gather(db.get_total_medications_count(), db.get_total_logs_count(),
+                                    db.get_total_prescriptions_count())
+    
+    medications_count, logs_count, prescriptions_count = asyncio.run(load_counts())
+    
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Medications", get_total_medications_count())
+        st.metric("Medications", medications_count)
     with col2:
-        st.metric("Logs", get_total_logs_count())
+        st.metric("Logs", logs_count)
     with col3:
-        conn = sqlite3.connect('data/dosebuddy.db')
-        presc_count = conn.execute('SELECT COUNT(*) FROM prescriptions').fetchone()[0]
-        conn.close()
-        st.metric("Prescriptions", presc_count)
+        st.metric("Prescriptions", prescriptions_count)
+    
+    with st.expander("📈 Database Queue Metrics"):
+        db_metrics = db.metrics()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Write Queue Depth", db_metrics['write_queue_depth'])
+            st.metric("Avg Write Latency", f"{db_metrics['writes']['avg_wait_ms'] + db_metrics['writes']['avg_run_ms']:.1f} ms")
+        with col2:
+            st.metric("Read Queue Depth", db_metrics['read_queue_depth'])
+            st.metric("Avg Read Latency", f"{db_metrics['reads']['avg_wait_ms'] + db_metrics['reads']['avg_run_ms']:.1f} ms")
+        st.json(db_metrics)
+    
+    with st.expander("⏰ Scheduler Status"):
+        scheduler_status = get_scheduler_status()
+        if scheduler_status['healthy']:
+            st.success(f"✅ Scheduler running (process {scheduler_status['pid']})")
+        elif scheduler_status['running']:
+            st.warning(f"⚠️ No heartbeat for {scheduler_status['heartbeat_age_seconds']:.0f}s")
+        else:
+            st.error("❌ Scheduler not running")
+        
+        if scheduler_status.get('next_fire_times'):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Scheduled Doses", scheduler_status['dose_count'])
+            with col2:
+                st.metric("Daily Jobs", scheduler_status['job_count'])
+            for event in scheduler_status['next_fire_times']:
+                st.write(f"🕐 {event['time'][:16].replace('T', ' ')} — {event['kind']}: {event['name']}")
+        
+        for channel, stats in scheduler_status.get('notifications', {}).items():
+            st.caption(f"📨 {channel}: {stats['count']} sent, {stats['queue_depth']} queued, "
+                       f"lag avg {stats['avg_wait_ms']:.0f} ms / max {stats['max_wait_ms']:.0f} ms, "
+                       f"{stats['timeouts']} timed out, {stats['dropped']} dropped")
+        
+        outbox = get_outbox_counts()
+        st.caption(f"📮 Outbox: {outbox['pending']} pending, {outbox['sent']} sent, "
+                   f"{outbox['dead']} dead-lettered")
+        if outbox['dead']:
+            for message in get_dead_letters(limit=5):
+                st.write(f"☠️ {message.kind} to {message.recipient} after {message.attempts} attempt(s): "
+                         f"{message.last_error}")
+            if st.button("🔁 Retry dead-lettered messages", key="requeue_dead_letters"):
+                st.success(f"✅ Requeued {requeue_dead_letters()} message(s)")
 
 # Footer
 st.sidebar.markdown("---")
@@ -0,0 +1,140 @@
+"""Monthly archival of old schedule_log rows.
+
+Rows older than ``config.ARCHIVE_AFTER_DAYS`` move out of the hot
+schedule_log table into one table per month (``schedule_log_archive_YYYY_MM``),
+listed in the log_archives registry. The daily_adherence rollup is not
+touched, so long-range statistics keep their counts; readers that need raw
+rows for an older range union in only the archive tables overlapping it.
+"""
+import re
+from datetime import timedelta
+
+import clock
+import config
+from db_pool import get_connection
+from log_storage import get_log_storage
+
+ARCHIVE_TABLE_PREFIX = 'schedule_log_archive_'
+
+# Column order of schedule_log, shared by every archive table
+LOG_COLUMNS = 'id, medication_id, scheduled_time, actual_time, status, date'
+
+_MONTH = re.compile(r'^\d{4}-\d{2}$')
+
+
+def archive_table_name(month):
+    """Return the archive table name for a 'YYYY-MM' month"""
+    if not isinstance(month, str) or not _MONTH.match(month):
+        raise ValueError(f"Invalid archive month: {month!r}")
+    return ARCHIVE_TABLE_PREFIX + month.replace('-', '_')
+
+
+def _next_month_start(month):
+    year, mon = (int(part) for part in month.split('-'))
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+
+
+def _create_archive_table(conn, table):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            medication_id INTEGER NOT NULL,
+            scheduled_time TEXT NOT NULL,
+            actual_time TEXT,
+            status TEXT NOT NULL,
+            date TEXT NOT NULL
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_medication ON {table} (medication_id, date)')
+
+
+def archive_old_logs(older_than_days=None):
+    """Move schedule_log rows older than the horizon into monthly archive tables
+
+    Each month is moved in its own transaction. Returns {month: rows_moved}.
+    """
+    days = config.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    if days < 1:
+        # Today's doses must stay in the hot table for status lookups and UPSERTs
+        raise ValueError("Logs can only be archived once they are at least a day old")
+
+    storage = get_log_storage()
+    # The process clock, not SQLite's UTC date('now'), decides which day is "today"
+    cutoff = (clock.now().date() - timedelta(days=days)).isoformat()
+
+    with get_connection() as conn:
+        months = [row[0] for row in conn.execute(storage.format(
+            'SELECT DISTINCT substr(date, 1, 7) FROM schedule_log WHERE {date} < ?'),
+            (storage.date_value(cutoff),))]
+
+    moved = {}
+    for month in months:
+        table = archive_table_name(month)
+        start, end = f"{month}-01", min(cutoff, _next_month_start(month))
+        in_month = storage.format('{date} >= ? AND {date} < ?')
+        bounds = (storage.date_value(start), storage.date_value(end))
+
+        with get_connection() as conn:
+            _create_archive_table(conn, table)
+            count = conn.execute(f'''
+                INSERT INTO {table} ({LOG_COLUMNS})
+                SELECT {LOG_COLUMNS} FROM schedule_log WHERE {in_month}
+            ''', bounds).rowcount
+
+            # Not tracked by the rollup triggers, so daily_adherence keeps these counts
+            conn.execute(f'DELETE FROM schedule_log WHERE {in_month}', bounds)
+
+            # "WHERE true" stops SQLite parsing ON CONFLICT as part of the SELECT
+            conn.execute(f'''
+                INSERT INTO log_archives (month, table_name, first_date, last_date, row_count)
+                SELECT ?, ?, MIN(date), MAX(date), COUNT(*) FROM {table} WHERE true
+                ON CONFLICT (month) DO UPDATE SET
+                    first_date = excluded.first_date,
+                    last_date = excluded.last_date,
+                    row_count = excluded.row_count
+            ''', (month, table))
+
+        moved[month] = count
+        print(f"📦 Archived {count} log(s) from {month}")
+
+    return moved
+
+
+def get_archive_tables(conn, since=None):
+    """Names of archive tables holding rows dated on or after `since` (all if None), oldest first"""
+    if since is None:
+        rows = conn.execute('SELECT table_name FROM log_archives ORDER BY month')
+    else:
+        rows = conn.execute('SELECT table_name FROM log_archives WHERE last_date >= ? ORDER BY month', (since,))
+    return [row[0] for row in rows]
+
+
+def all_logs_source(conn):
+    """FROM-clause source covering schedule_log and every archive table"""
+    tables = get_archive_tables(conn)
+    if not tables:
+        return 'schedule_log'
+
+    selects = [f'SELECT {LOG_COLUMNS} FROM {table}' for table in ['schedule_log'] + tables]
+    return '(' + ' UNION ALL '.join(selects) + ')'
+
+
+def get_archived_logs_count(conn):
+    """Number of log rows held in the archive tables"""
+    return conn.execute('SELECT COALESCE(SUM(row_count), 0) FROM log_archives').fetchone()[0]
+
+
+def delete_archived_logs(conn, medication_id):
+    """Remove a medication's rows from every archive table"""
+    for table in get_archive_tables(conn):
+        deleted = conn.execute(f'DELETE FROM {table} WHERE medication_id = ?', (medication_id,)).rowcount
+        if deleted:
+            conn.execute('UPDATE log_archives SET row_count = row_count - ? WHERE table_name = ?',
+                         (deleted, table))
+
+
+def drop_all_archives(conn):
+    """Drop every archive table and empty the registry"""
+    for table in get_archive_tables(conn):
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+    conn.execute('DELETE FROM log_archives')
@@ -0,0 +1,174 @@
+"""Asyncio facade over the database.py helpers.
+
+Writes go through a single writer thread fed by a queue, so they are
+applied in submission order and never compete for SQLite's write lock.
+Reads run on a small pool of reader threads. Every helper is available as
+a coroutine function (``await db.get_guardian_info()``); threads without an
+event loop, like the scheduler, use ``submit()`` to get a
+concurrent.futures.Future instead of blocking on the call.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config
+import database
+from latency import LatencyStats
+
+# database.py helpers that modify the database; they run on the writer thread
+WRITE_HELPERS = frozenset({
+    'add_medication_with_type', 'add_medication', 'update_tablet_count', 'update_tablet_counts',
+    'log_medication_taken', 'log_medications_bulk', 'rebuild_daily_adherence',
+    'add_guardian', 'update_guardian_whatsapp_status', 'delete_guardian',
+    'add_prescription', 'delete_prescription', 'record_low_stock_alert',
+    'delete_medication', 'clear_all_data', 'advance_missed_watermark', 'catch_up_missed_doses',
+    'refresh_dose_instances', 'set_dose_instances_alert_state', 'enqueue_outbox', 'requeue_dead_letters',
+    'prune_outbox',
+})
+
+# Read-only helpers; they run on the reader pool
+READ_HELPERS = frozenset({
+    'get_all_medications', 'get_medication_summaries', 'get_medication_schedules',
+    'get_dose_times_by_medication', 'get_dose_schedule', 'get_doses_from_minute',
+    'get_doses_due_between', 'get_medication_by_id', 'check_medication_status',
+    'get_adherence_data', 'get_daily_adherence', 'get_guardian_info', 'get_all_prescriptions',
+    'get_total_prescriptions_count', 'was_low_stock_alerted', 'get_missed_medications_today',
+    'get_recent_missed_doses', 'get_medication_history', 'get_low_stock_medications',
+    'get_total_medications_count', 'get_total_logs_count', 'get_adherence_statistics',
+    'get_medication_streak', 'get_export_log_rows', 'export_data_to_dict', 'get_missed_watermark',
+    'get_dose_instances_for_day', 'get_dose_instances_due', 'get_upcoming_dose_instances',
+    'get_upcoming_doses', 'get_stock_forecast', 'get_medications_to_refill', 'get_outbox_counts',
+    'get_dead_letters',
+})
+
+
+class AsyncDatabase:
+    """Serialized writer thread plus reader pool for the database.py helpers"""
+
+    def __init__(self, readers=None):
+        self.readers = config.DB_READER_THREADS if readers is None else readers
+        self._writes = queue.Queue()
+        self._reader_pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='dosebuddy-db-reader')
+        self._pending_reads = 0
+        self._pending_lock = threading.Lock()
+        self.write_stats = LatencyStats()
+        self.read_stats = LatencyStats()
+        self._closed = False
+
+        self._writer = threading.Thread(target=self._writer_loop, name='dosebuddy-db-writer', daemon=True)
+        self._writer.start()
+
+    def _run(self, future, func, args, kwargs, enqueued, stats):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            stats.record(started - enqueued, time.perf_counter() - started, True)
+            future.set_exception(e)
+        else:
+            # Record before resolving, so a caller that awaited the call sees it in metrics()
+            stats.record(started - enqueued, time.perf_counter() - started, False)
+            future.set_result(result)
+
+    def _writer_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+
+            future, func, args, kwargs, enqueued = item
+            if future.set_running_or_notify_cancel():
+                self._run(future, func, args, kwargs, enqueued, self.write_stats)
+
+    def _read(self, future, func, args, kwargs, enqueued):
+        with self._pending_lock:
+            self._pending_reads -= 1
+        if future.set_running_or_notify_cancel():
+            self._run(future, func, args, kwargs, enqueued, self.read_stats)
+
+    def submit(self, name, *args, **kwargs):
+        """Queue a database.py helper by name and return a concurrent.futures.Future"""
+        if self._closed:
+            raise RuntimeError("AsyncDatabase is closed")
+
+        if name in WRITE_HELPERS:
+            is_write = True
+        elif name in READ_HELPERS:
+            is_write = False
+        else:
+            raise AttributeError(f"database has no async helper '{name}'")
+
+        func = getattr(database, name)
+        future = Future()
+        enqueued = time.perf_counter()
+
+        if is_write:
+            self._writes.put((future, func, args, kwargs, enqueued))
+        else:
+            with self._pending_lock:
+                self._pending_reads += 1
+            self._reader_pool.submit(self._read, future, func, args, kwargs, enqueued)
+
+        return future
+
+    def flush(self, timeout=None):
+        """Block until every write queued so far has been applied"""
+        done = Future()
+        self._writes.put((done, lambda: None, (), {}, time.perf_counter()))
+        done.result(timeout)
+
+    def __getattr__(self, name):
+        if name not in WRITE_HELPERS and name not in READ_HELPERS:
+            raise AttributeError(f"{type(self).__name__} has no attribute '{name}'")
+
+        async def call(*args, **kwargs):
+            return await asyncio.wrap_future(self.submit(name, *args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = getattr(database, name).__doc__
+        return call
+
+    def metrics(self):
+        """Queue depths and latency stats for the writer thread and reader pool"""
+        with self._pending_lock:
+            pending_reads = self._pending_reads
+        return {
+            'write_queue_depth': self._writes.qsize(),
+            'read_queue_depth': pending_reads,
+            'writes': self.write_stats.snapshot(),
+            'reads': self.read_stats.snapshot(),
+        }
+
+    def close(self):
+        """Finish queued work and stop the writer thread and reader pool"""
+        if self._closed:
+            return
+        self._closed = True
+        self._writes.put(None)
+        self._writer.join()
+        self._reader_pool.shutdown(wait=True)
+
+
+_async_db = None
+_async_db_lock = threading.Lock()
+
+
+def get_async_database():
+    """Return the process-wide AsyncDatabase, starting it on first use"""
+    global _async_db
+    if _async_db is None:
+        with _async_db_lock:
+            if _async_db is None:
+                _async_db = AsyncDatabase()
+    return _async_db
+
+
+def close_async_database():
+    """Stop the process-wide AsyncDatabase (used by tests and benchmarks)"""
+    global _async_db
+    with _async_db_lock:
+        if _async_db is not None:
+            _async_db.close()
+            _async_db = None
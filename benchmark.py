@@ -0,0 +1,598 @@
+"""DoseBuddy performance benchmarks
+
+Usage:
+    python benchmark.py                 # run every benchmark
+    python benchmark.py connections     # run one benchmark by name
+    python benchmark.py storage --rows 100000
+"""
+import argparse
+import inspect
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import config
+import db_pool
+import database
+from clock import SimulatedClock
+from dose_worker import DoseWorker
+from event_scheduler import EventScheduler
+from log_storage import get_log_storage
+from migrations import SCHEDULE_LOG_INDEXES
+from models import DoseLog, format_minute_of_day
+from stand_in import StandInServer
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark function under a command-line name"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def temp_database(pool_size=None):
+    """Point the connection pool at a fresh database in a temp directory"""
+    temp_dir = tempfile.mkdtemp(prefix='dosebuddy_bench_')
+    db_path = os.path.join(temp_dir, 'bench.db')
+    db_pool.configure_pool(db_path, size=pool_size)
+    try:
+        database.init_database()
+        yield db_path
+    finally:
+        db_pool.close_all_connections()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def timed(func, iterations):
+    """Run func() `iterations` times and return seconds per call"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def report(label, seconds_per_op, baseline=None):
+    """Print one benchmark result line"""
+    line = f"   {label:<40} {seconds_per_op * 1e6:>10.1f} µs/op"
+    if baseline:
+        line += f"   ({baseline / seconds_per_op:.1f}x)"
+    print(line)
+
+
+# ===== CONNECTIONS =====
+
+@benchmark('connections')
+def bench_connections(iterations=2000):
+    """Per-call sqlite3.connect vs pooled connections"""
+    with temp_database() as db_path:
+        database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+
+        def per_call_connect():
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('SELECT * FROM medications').fetchall()
+            conn.close()
+
+        def pooled():
+            database.get_all_medications()
+
+        per_call = timed(per_call_connect, iterations)
+        pooled_time = timed(pooled, iterations)
+
+        print(f"🔌 Connections ({iterations} queries)")
+        report("sqlite3.connect per call", per_call)
+        report("pooled connection", pooled_time, baseline=per_call)
+        print(f"   connections opened by pool: {db_pool.get_pool().created}")
+
+
+# ===== DOSE LOGGING =====
+
+@benchmark('logging')
+def bench_logging(doses=2000):
+    """Per-row log_medication_taken vs log_medications_bulk"""
+    with temp_database():
+        for i in range(10):
+            database.add_medication_with_type(f"Med {i}", "10mg", 1, "09:00", 30, "Tablet")
+
+        # Distinct doses for today: 10 medications x one slot per minute
+        entries = [(i % 10 + 1, f"{(i // 10) // 60 % 24:02d}:{(i // 10) % 60:02d}", "Taken")
+                   for i in range(doses)]
+
+        start = time.perf_counter()
+        for medication_id, scheduled_time, status in entries:
+            database.log_medication_taken(medication_id, scheduled_time, status)
+        per_row = (time.perf_counter() - start) / doses
+
+        database.clear_all_data()
+
+        start = time.perf_counter()
+        database.log_medications_bulk(entries)
+        bulk = (time.perf_counter() - start) / doses
+
+        print(f"📝 Dose logging ({doses} doses)")
+        report("log_medication_taken per row", per_row)
+        report("log_medications_bulk", bulk, baseline=per_row)
+        print(f"   throughput: {1 / per_row:,.0f} vs {1 / bulk:,.0f} doses/s")
+
+
+# ===== ROW RECORDS =====
+
+def _fetch_with_factory(sql, row_factory=None, fetch_all=None):
+    """Fetch all rows with a row factory (or a fetch_all(cursor)), returning (row count, seconds, bytes held)"""
+    fetch_all = fetch_all or (lambda cursor: cursor.fetchall())
+    with db_pool.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory
+
+        start = time.perf_counter()
+        count = len(fetch_all(cursor.execute(sql)))
+        elapsed = time.perf_counter() - start
+
+        # Separate pass so tracemalloc overhead doesn't skew the timing
+        tracemalloc.start()
+        rows = fetch_all(cursor.execute(sql))
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del rows
+    return count, elapsed, held
+
+
+@benchmark('records')
+def bench_records(rows=100000):
+    """Tuples vs sqlite3.Row vs DoseLog records when listing history"""
+    with temp_database():
+        database.log_medications_bulk(
+            (i % 50 + 1, f"{i % 1440 // 60:02d}:{i % 60:02d}", "Taken" if i % 7 else "Missed",
+             f"2025-{(i // 72000) % 12 + 1:02d}-{(i // 2400) % 28 + 1:02d}")
+            for i in range(rows)
+        )
+        total = database.get_total_logs_count()
+
+        full = 'SELECT id, medication_id, scheduled_time, actual_time, status, date FROM schedule_log'
+        narrow = 'SELECT date, scheduled_time, status FROM schedule_log'
+
+        print(f"📦 Row records ({total} log rows)")
+        results = [
+            ("tuple, all columns", full, None, None),
+            ("sqlite3.Row, all columns", full, sqlite3.Row, None),
+            ("DoseLog row_factory, all columns", full, DoseLog.row_factory, None),
+            ("DoseLog.fetch_all, all columns", full, None, DoseLog.fetch_all),
+            ("DoseLog.fetch_all, 3 columns", narrow, None, DoseLog.fetch_all),
+        ]
+        baseline = None
+        for label, sql, factory, fetch_all in results:
+            count, elapsed, held = _fetch_with_factory(sql, factory, fetch_all)
+            per_row = elapsed / count
+            baseline = baseline or per_row
+            report(label, per_row, baseline=baseline)
+            print(f"   {'':<40} {held / count:>10.0f} bytes/row")
+
+
+# ===== LOG STORAGE =====
+
+def _on_disk_sizes(conn, names):
+    """Bytes used by each named table or index, from the dbstat virtual table"""
+    placeholders = ','.join('?' * len(names))
+    return dict(conn.execute(f'''
+        SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ({placeholders}) GROUP BY name
+    ''', names).fetchall())
+
+
+@benchmark('storage')
+def bench_storage(rows=1000000, iterations=200):
+    """TEXT vs integer-encoded dates and times in schedule_log"""
+    today = date.today()
+    days = [(today - timedelta(days=i)).isoformat() for i in range(rows // 200 + 1)]
+    times = ("08:00", "12:00", "18:00", "22:00")
+
+    # 50 medications x 4 doses a day, newest day first
+    def entries():
+        return ((i % 50 + 1, times[i // 50 % 4], "Taken" if i % 9 else "Missed", days[i // 200])
+                for i in range(rows))
+
+    print(f"🗓️ Log storage ({rows:,} log rows, {len(days):,} days)")
+    names = ['schedule_log'] + list(SCHEDULE_LOG_INDEXES)
+    baseline = {}
+    configured = config.LOG_STORAGE
+
+    try:
+        for mode in ('text', 'integer'):
+            config.LOG_STORAGE = mode
+            with temp_database() as db_path:
+                start = time.perf_counter()
+                database.log_medications_bulk(entries())
+                load = time.perf_counter() - start
+
+                storage = get_log_storage()
+                with db_pool.get_connection() as conn:
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                    sizes = _on_disk_sizes(conn, names)
+
+                    # Index-only range scan over the last 30 days
+                    range_sql = storage.format('''
+                        SELECT COUNT(*), SUM(status = 'Missed') FROM schedule_log
+                        WHERE {date} >= ? AND {date} < ?
+                    ''')
+                    bounds = (storage.date_value(days[30]), storage.date_value(days[0]))
+                    range_scan = timed(lambda: conn.execute(range_sql, bounds).fetchone(), iterations)
+
+                history = timed(lambda: database.get_medication_history(7, 365), iterations)
+
+                results = {
+                    'file': os.path.getsize(db_path),
+                    'table': sizes.get('schedule_log', 0),
+                    'indexes': sum(sizes.get(name, 0) for name in SCHEDULE_LOG_INDEXES),
+                }
+
+            print(f"   {mode} storage (loaded in {load:.1f} s)")
+            for label, size in results.items():
+                line = f"   {'  ' + label + ' size':<40} {size / 2**20:>10.1f} MB"
+                if mode != 'text':
+                    line += f"   ({size / baseline[label]:.0%} of text)"
+                print(line)
+            report("  30-day range scan", range_scan, baseline=baseline.get('range_scan'))
+            report("  get_medication_history, 365 days", history, baseline=baseline.get('history'))
+
+            if mode == 'text':
+                baseline = dict(results, range_scan=range_scan, history=history)
+    finally:
+        config.LOG_STORAGE = configured
+
+
+# ===== SCHEDULE RELOAD =====
+
+@benchmark('reload')
+def bench_reload(medications=1000, iterations=20):
+    """Full schedule rebuild vs incremental registry diffs"""
+    with temp_database():
+        for i in range(medications):
+            database.add_medication_with_type(f"Med {i}", "10mg", 3,
+                                              f"{8 + i % 4:02d}:{i % 60:02d},14:00,{20 + i % 3:02d}:30", 30, "Tablet")
+
+        def new_scheduler():
+            scheduler = EventScheduler(database.get_dose_schedule, lambda doses: None, lambda doses: None,
+                                       clock=SimulatedClock(datetime.now()))
+            scheduler.reload()
+            return scheduler
+
+        scheduler = new_scheduler()
+        doses = scheduler.dose_count
+
+        rebuild = timed(new_scheduler, iterations)
+        full_diff = timed(scheduler.reload, iterations)
+        one = timed(lambda: scheduler.reload(medications // 2), iterations * 10)
+
+        # Diff cost alone, without the database query
+        loaded = database.get_dose_schedule()
+        diff_only = timed(lambda: scheduler.apply(loaded), iterations)
+
+        print(f"📅 Schedule reload ({medications} medications, {doses} doses)")
+        report("rebuild scheduler from scratch", rebuild)
+        report("full reload, diff against registry", full_diff, baseline=rebuild)
+        report("  registry diff only (no query)", diff_only, baseline=rebuild)
+        report("refresh one medication", one, baseline=rebuild)
+
+# ===== UPCOMING DOSES =====
+
+def _upcoming_by_sorting(limit, now):
+    # What get_next_scheduled_times used to do: parse every time, sort everything
+    with db_pool.get_connection() as conn:
+        medications = conn.execute('SELECT name, dosage, times FROM medications').fetchall()
+    today = now.strftime('%Y-%m-%d')
+    upcoming = []
+    for name, dosage, times in medications:
+        for scheduled_time in times.split(','):
+            scheduled_dt = datetime.strptime(f"{today} {scheduled_time.strip()}", '%Y-%m-%d %H:%M')
+            if scheduled_dt < now:
+                scheduled_dt += timedelta(days=1)
+            upcoming.append({'medication': f"{name} ({dosage})", 'time': scheduled_time, 'datetime': scheduled_dt})
+    upcoming.sort(key=lambda x: x['datetime'])
+    return upcoming[:limit]
+
+
+@benchmark('upcoming')
+def bench_upcoming(medications=10000, iterations=200):
+    """Next-doses list: parse and sort every schedule vs indexed top-k"""
+    with temp_database():
+        with db_pool.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO medications (id, name, dosage, frequency, times, total_count,
+                                         remaining_count, added_date, med_type)
+                VALUES (?, ?, '10mg', 3, ?, 30, 30, '2025-05-01', 'Tablet')
+            ''', ((i + 1, f"Med {i}", f"{8 + i % 4:02d}:{i % 60:02d},14:00,{20 + i % 3:02d}:30")
+                  for i in range(medications)))
+            conn.execute('''
+                INSERT INTO dose_times (medication_id, minute_of_day)
+                SELECT id, CAST(substr(times, 1, 2) AS INTEGER) * 60 + CAST(substr(times, 4, 2) AS INTEGER)
+                FROM medications
+                UNION ALL SELECT id, 14 * 60 FROM medications
+                UNION ALL SELECT id, CAST(substr(times, 13, 2) AS INTEGER) * 60 + 30 FROM medications
+            ''')
+
+        # Late evening, so the top-k has to wrap into tomorrow
+        now = datetime.now().replace(hour=22, minute=0, second=0, microsecond=0)
+        sort_all = timed(lambda: _upcoming_by_sorting(5, now), max(iterations // 20, 1))
+
+        print(f"⏭️ Upcoming doses ({medications} medications, {medications * 3} doses)")
+        report("parse + sort every schedule, top 5", sort_all)
+        report("indexed top 5", timed(lambda: database.get_upcoming_doses(5, now), iterations), baseline=sort_all)
+        report("indexed top 100 over 7 days", timed(lambda: database.get_upcoming_doses(100, now), iterations),
+               baseline=sort_all)
+        report("indexed top 5, one medication", timed(
+            lambda: database.get_upcoming_doses(5, now, medication_id=medications // 2), iterations),
+            baseline=sort_all)
+
+
+# ===== DOSE WORKERS =====
+
+def _dose_minute(i):
+    # Two thirds of doses cluster around 08:00, 13:00 and 21:00; the rest spread over the day
+    if i % 3 == 0:
+        return i * 7 % 1440
+    return (8 * 60, 13 * 60, 21 * 60)[i // 3 % 3] + i % 31 - 15
+
+
+@benchmark('workers')
+def bench_workers(rows=100000, shards=4):
+    """Sharded dose workers draining a simulated day at 10k / 100k / 1M doses per day"""
+    day = datetime(2025, 6, 1)
+    for doses in [n for n in (10000, 100000, 1000000) if n <= rows] or [rows]:
+        with temp_database(pool_size=shards + 1):
+            with db_pool.get_connection() as conn:
+                conn.executemany('''
+                    INSERT INTO medications (id, name, dosage, frequency, times, total_count,
+                                             remaining_count, added_date, med_type)
+                    VALUES (?, ?, '10mg', 1, ?, 30, 30, '2025-05-01', 'Tablet')
+                ''', ((i + 1, f"Med {i}", format_minute_of_day(_dose_minute(i)))
+                      for i in range(doses)))
+                conn.execute('''
+                    INSERT INTO dose_times (medication_id, minute_of_day)
+                    SELECT id, CAST(substr(times, 1, 2) AS INTEGER) * 60 + CAST(substr(times, 4, 2) AS INTEGER)
+                    FROM medications
+                ''')
+            start = time.perf_counter()
+            database.refresh_dose_instances(day)
+            materialize = time.perf_counter() - start
+
+            clock = SimulatedClock(day)
+            workers = [DoseWorker(shard, shards, on_reminder=lambda doses: None, on_missed=lambda doses: None,
+                                  clock=clock, worker_id=f'bench-{shard}')
+                       for shard in range(shards)]
+
+            # Each simulated minute every shard drains what came due; the tick's
+            # wall time is how late the slowest dose of that minute was handled
+            latencies, handled = [], 0
+            with ThreadPoolExecutor(max_workers=shards) as pool:
+                for minute in range(24 * 60):
+                    clock.set(day + timedelta(minutes=minute))
+                    start = time.perf_counter()
+                    handled += sum(pool.map(lambda worker: worker.run_once(), workers))
+                    latencies.append(time.perf_counter() - start)
+
+            latencies.sort()
+            busy = sum(latencies)
+            print(f"👷 Dose workers ({doses} doses/day, {shards} shards, {handled} reminders + alerts)")
+            report("materialize today + look-ahead", materialize)
+            report("minute tick latency, p50", latencies[len(latencies) // 2])
+            report("minute tick latency, p95", latencies[int(len(latencies) * 0.95)])
+            report("minute tick latency, max", latencies[-1])
+            print(f"   {'throughput':<40} {handled / busy:>10.0f} doses/s")
+
+# ===== TWILIO CLIENT =====
+
+@benchmark('twilio')
+def bench_twilio(messages=200):
+    """WhatsApp send latency: new Twilio client per message vs the shared pooled client"""
+    from whatsapp_notifier import create_client
+
+    def send(client):
+        client.messages.create(from_=config.TWILIO_WHATSAPP_NUMBER, body="Benchmark", to="whatsapp:+10000000000")
+
+    # The stand-in accepts any credentials
+    credentials = config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN
+    config.TWILIO_ACCOUNT_SID = config.TWILIO_ACCOUNT_SID or 'AC' + '0' * 32
+    config.TWILIO_AUTH_TOKEN = config.TWILIO_AUTH_TOKEN or 'stand-in'
+    try:
+        with StandInServer(keep=False) as server:
+            fresh = timed(lambda: send(create_client(server.url)), messages)
+            pooled_client = create_client(server.url)
+            send(pooled_client)
+            pooled = timed(lambda: send(pooled_client), messages)
+    finally:
+        config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN = credentials
+
+    print(f"📨 Twilio client ({messages} messages to a local stand-in, plain HTTP so no TLS handshake)")
+    report("new client per message", fresh)
+    report("shared pooled client", pooled, baseline=fresh)
+
+
+@benchmark('outbox')
+def bench_outbox(rows=2000):
+    """Cost of enqueueing a guardian alert, and outbox drain throughput against a local stand-in"""
+    from async_db import close_async_database, get_async_database
+    from channels import WebhookChannel
+    from notification_dispatch import NotificationDispatcher
+    from outbox_worker import OutboxWorker
+
+    def messages(prefix, count):
+        # One guardian each, so the per-guardian rate limit stays out of the way
+        return [(f"{prefix}:{i}", 'missed_dose', f"+1{i:010d}", "🚨 MEDICATION ALERT " * 8)
+                for i in range(count)]
+
+    server = StandInServer(keep=False).start()
+    send = WebhookChannel('whatsapp', server.url, 1).send
+
+    print(f"📮 Outbox ({rows} messages, local stand-in over plain HTTP)")
+    try:
+        with temp_database():
+            pending = iter(messages('sync', rows))
+            report("enqueue, committed per alert", timed(lambda: database.enqueue_outbox([next(pending)]), rows))
+
+            db = get_async_database()
+            pending = iter(messages('async', rows))
+            report("enqueue via async writer (caller)", timed(lambda: db.submit('enqueue_outbox', [next(pending)]),
+                                                              rows))
+            db.flush()
+            close_async_database()
+
+            baseline = None
+            for concurrency in (1, config.NOTIFICATION_CHANNELS['whatsapp'][0]):
+                with db_pool.get_connection() as conn:
+                    conn.execute('DELETE FROM outbox')
+                database.enqueue_outbox(messages(f'drain{concurrency}', rows))
+                dispatcher = NotificationDispatcher({'whatsapp': (concurrency, 15, config.OUTBOX_BATCH_SIZE)})
+                try:
+                    worker = OutboxWorker(send=send, dispatcher=dispatcher)
+                    start = time.perf_counter()
+                    sent = worker.drain()['sent']
+                    seconds = (time.perf_counter() - start) / sent
+                finally:
+                    dispatcher.close()
+                report(f"drain, {concurrency} delivery thread(s)", seconds, baseline=baseline)
+                baseline = baseline or seconds
+                print(f"   {'':<40} {1 / seconds:>10.0f} messages/s")
+
+            # A morning where one guardian's patient misses a dose of every medication
+            burst = 20
+            calls = []
+            database.enqueue_outbox([
+                (f"burst:{i}", 'missed_dose', "+10000000000", f"Missed Med {i}",
+                 {'patient_name': "Patient", 'medication_name': f"Med {i}", 'date': "2025-06-02",
+                  'scheduled_time': f"{7 + i // 4:02d}:{i % 4 * 15:02d}"})
+                for i in range(burst)
+            ])
+            dispatcher = NotificationDispatcher({'whatsapp': (1, 15, config.OUTBOX_BATCH_SIZE)})
+            try:
+                worker = OutboxWorker(send=lambda delivery: calls.append(send(delivery)), dispatcher=dispatcher)
+                worker.drain()
+            finally:
+                dispatcher.close()
+            print(f"   {f'{burst} missed doses for one guardian':<40} {len(calls):>10} API call(s)")
+    finally:
+        server.stop()
+
+
+@benchmark('fanout')
+def bench_fanout(rows=1000):
+    """Alerts fanned out to every guardian channel, drained end to end into a local stand-in"""
+    from channels import WebhookChannel, default_channels, stand_in_channels
+    from notification_dispatch import NotificationDispatcher
+    from outbox_worker import OutboxWorker
+
+    names = ('whatsapp', 'sms', 'email', 'webhook')
+    # One guardian per alert, as in _enqueue_alerts: the same key on every channel
+    messages = [(f"{name}:low_stock:{i}", 'low_stock', f"+1{i:010d}", "🔔 REFILL REMINDER " * 8, None, name)
+                for i in range(rows) for name in names]
+
+    print(f"📡 Channel fan-out ({rows} alerts x {len(names)} channels, local stand-in over plain HTTP)")
+    with StandInServer(keep=False) as server, temp_database():
+        batched = {name: channel for name, channel in stand_in_channels(default_channels(), server.url).items()
+                   if name in names}
+        baseline = None
+        for label, channels in (("one request per message", {name: WebhookChannel(name, server.url, 1)
+                                                               for name in names}),
+                                ("channel batch sizes", batched)):
+            with db_pool.get_connection() as conn:
+                conn.execute('DELETE FROM outbox')
+            database.enqueue_outbox(messages)
+            requests_before = server.requests
+            dispatcher = NotificationDispatcher({name: config.NOTIFICATION_CHANNELS[name] for name in names})
+            try:
+                worker = OutboxWorker(channels=channels, dispatcher=dispatcher, batch_size=500)
+                start = time.perf_counter()
+                sent = worker.drain()['sent']
+                seconds = (time.perf_counter() - start) / sent
+            finally:
+                dispatcher.close()
+            report(f"drain, {label}", seconds, baseline=baseline)
+            baseline = baseline or seconds
+            print(f"   {'':<40} {1 / seconds:>10.0f} messages/s, "
+                  f"{server.requests - requests_before} HTTP request(s)")
+
+
+# ===== MESSAGE TEMPLATES =====
+
+def _daily_summary_f_string(patient_name, stats, date):
+    """The daily summary as whatsapp_notifier built it before templates.py"""
+    adherence = stats.get('adherence_rate', 0)
+    taken = stats.get('taken', 0)
+    missed = stats.get('missed', 0)
+
+    emoji = "🌟" if adherence == 100 else "✅" if adherence >= 80 else "⚠️"
+    feedback = "Perfect day!" if adherence == 100 else "Good job!" if adherence >= 80 else "Needs improvement"
+
+    return f"""📊 *DAILY SUMMARY*
+
+Patient: {patient_name}
+Date: {date.strftime('%B %d, %Y')}
+
+✅ Taken: {taken} dose(s)
+❌ Missed: {missed} dose(s)
+📈 Adherence: {adherence}%
+
+{emoji} {feedback}
+
+- DoseBuddy Daily Report"""
+
+
+@benchmark('templates')
+def bench_templates(rows=5000):
+    """Rendering the 22:00 daily summary for many guardians: f-strings vs prepared templates"""
+    from templates import MARKDOWN, PLAIN, DailySummary, render
+
+    today = datetime(2025, 6, 1, 22, 0)
+    guardians = [(f"Patient {i}", {'taken': 6 - i % 4, 'missed': i % 4,
+                                   'adherence_rate': round((6 - i % 4) / 6 * 100, 1)})
+                 for i in range(rows)]
+
+    def f_strings():
+        for patient_name, stats in guardians:
+            _daily_summary_f_string(patient_name, stats, today)
+
+    def prepared(locale=None, markup=MARKDOWN):
+        date = today.strftime('%Y-%m-%d')
+        for patient_name, stats in guardians:
+            render('daily_summary', DailySummary(patient_name, date, stats['taken'], stats['missed'],
+                                                 stats['adherence_rate']), locale, None, markup)
+
+    assert (render('daily_summary', DailySummary("P", '2025-06-01', 5, 1, 83.3))
+            == _daily_summary_f_string("P", {'taken': 5, 'missed': 1, 'adherence_rate': 83.3}, today))
+
+    print(f"📝 Message templates ({rows} daily summaries)")
+    baseline = timed(f_strings, 5) / rows
+    report("f-string per message", baseline)
+    report("prepared template", timed(prepared, 5) / rows, baseline=baseline)
+    report("prepared template, es + plain", timed(lambda: prepared('es', PLAIN), 5) / rows, baseline=baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DoseBuddy performance benchmarks")
+    parser.add_argument('names', nargs='*', help="benchmarks to run (default: all): " + ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--rows', type=int, help="override the row count of benchmarks that take one")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.names or sorted(BENCHMARKS):
+        func = BENCHMARKS[name]
+        if args.rows and 'rows' in inspect.signature(func).parameters:
+            func(rows=args.rows)
+        else:
+            func()
+        print()
+
+
+if __name__ == "__main__":
+    main()
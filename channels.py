@@ -0,0 +1,289 @@
+"""Notification channels: how a message reaches a guardian (or the desktop).
+
+A channel turns Delivery objects into sends over one transport::
+
+    desktop   plyer popup on this machine
+    whatsapp  Twilio WhatsApp (whatsapp_notifier.py)
+    sms       Twilio SMS from config.TWILIO_SMS_NUMBER
+    email     SMTP, one connection per batch
+    webhook   JSON POST to config.WEBHOOK_URL, one request per batch
+
+``batch_size`` is a channel's batching capability: the outbox worker
+hands it up to that many deliveries per send_batch() call (1 means one
+message per call). Channels live in a registry keyed by name;
+register_channel() adds or replaces one, and use_stand_in() swaps every
+registered channel for a local stand-in that records instead of sending,
+either to a JSON-lines file or to an HTTP endpoint such as stand_in.py's
+server. Setting ``DOSEBUDDY_NOTIFY_STAND_IN`` does the same at startup,
+so the whole alert pipeline can be load-tested offline.
+"""
+import http.client
+import json
+import smtplib
+import threading
+from email.message import EmailMessage
+from urllib.parse import urlsplit
+
+import config
+
+
+class Delivery:
+    """One message to send: a single outbox message or a digest of several"""
+
+    __slots__ = ('channel', 'kind', 'recipient', 'body', 'messages')
+
+    def __init__(self, channel, kind, recipient, body, messages=()):
+        self.channel = channel
+        self.kind = kind
+        self.recipient = recipient
+        self.body = body
+        self.messages = messages
+
+    def to_dict(self):
+        return {'channel': self.channel, 'kind': self.kind, 'recipient': self.recipient, 'body': self.body}
+
+
+class Channel:
+    """Base channel: subclasses implement send(); batching channels override send_batch()"""
+
+    batch_size = 1
+
+    def __init__(self, name):
+        self.name = name
+
+    def send(self, delivery):
+        """Send one delivery; raises on failure"""
+        raise NotImplementedError
+
+    def send_batch(self, deliveries):
+        """Send several deliveries; returns one entry per delivery, None if sent or the exception"""
+        errors = []
+        for delivery in deliveries:
+            try:
+                self.send(delivery)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class DesktopChannel(Channel):
+    """Desktop popup through plyer; the recipient is ignored"""
+
+    def send(self, delivery):
+        from plyer import notification
+
+        title, _, message = delivery.body.partition("\n")
+        notification.notify(title=title, message=message, timeout=15, app_name="DoseBuddy", app_icon=None)
+
+
+class WhatsAppChannel(Channel):
+    """Twilio WhatsApp through the shared pooled client"""
+
+    def send(self, delivery):
+        from whatsapp_notifier import send_message
+        return send_message(delivery.recipient, delivery.body)
+
+
+class SmsChannel(Channel):
+    """Twilio SMS through the shared pooled client"""
+
+    def send(self, delivery):
+        from whatsapp_notifier import send_sms
+        return send_sms(delivery.recipient, delivery.body)
+
+
+class EmailChannel(Channel):
+    """SMTP; a batch shares one connection and login"""
+
+    def __init__(self, name, host=None, port=None, batch_size=None):
+        super().__init__(name)
+        self.host = host or config.SMTP_HOST
+        self.port = port or config.SMTP_PORT
+        self.batch_size = config.EMAIL_BATCH_SIZE if batch_size is None else batch_size
+
+    def _message(self, delivery):
+        message = EmailMessage()
+        # The first line of an alert is its heading, e.g. '🚨 *MEDICATION ALERT*'
+        message['Subject'] = delivery.body.split("\n", 1)[0].replace("*", "").strip() or "DoseBuddy"
+        message['From'] = config.SMTP_FROM
+        message['To'] = delivery.recipient
+        message.set_content(delivery.body.replace("*", ""))
+        return message
+
+    def send(self, delivery):
+        error = self.send_batch([delivery])[0]
+        if error:
+            raise error
+
+    def send_batch(self, deliveries):
+        if not self.host:
+            raise RuntimeError("Email channel has no SMTP host (set DOSEBUDDY_SMTP_HOST)")
+
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=config.SMTP_TIMEOUT_SECONDS) as smtp:
+            if config.SMTP_STARTTLS:
+                smtp.starttls()
+            if config.SMTP_USER:
+                smtp.login(config.SMTP_USER, config.SMTP_PASSWORD)
+            for delivery in deliveries:
+                try:
+                    smtp.send_message(self._message(delivery))
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(e)
+        return errors
+
+
+class WebhookChannel(Channel):
+    """JSON POST of {"messages": [...]} to a URL; a batch is one request
+
+    Idle keep-alive connections are pooled on the channel rather than per
+    thread, since the dispatcher runs every call on a thread of its own.
+    """
+
+    def __init__(self, name, url=None, batch_size=None):
+        super().__init__(name)
+        self.url = url or config.WEBHOOK_URL
+        self.batch_size = config.WEBHOOK_BATCH_SIZE if batch_size is None else batch_size
+        self._idle = []
+        self._idle_lock = threading.Lock()
+
+    def _connection(self):
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        parts = urlsplit(self.url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(parts.netloc, timeout=config.WEBHOOK_TIMEOUT_SECONDS)
+
+    def _post(self, body):
+        if not self.url:
+            raise RuntimeError("Webhook channel has no URL (set DOSEBUDDY_WEBHOOK_URL)")
+        parts = urlsplit(self.url)
+        conn = self._connection()
+        try:
+            conn.request('POST', parts.path or '/', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the connection; the next send opens a fresh one
+            conn.close()
+            raise
+        with self._idle_lock:
+            self._idle.append(conn)
+        if response.status >= 300:
+            raise ConnectionError(f"Webhook answered HTTP {response.status}")
+
+    def send(self, delivery):
+        self._post(json.dumps({'messages': [delivery.to_dict()]}))
+
+    def send_batch(self, deliveries):
+        self._post(json.dumps({'messages': [delivery.to_dict() for delivery in deliveries]}))
+        return [None] * len(deliveries)
+
+
+class RecordingChannel(Channel):
+    """Stand-in that records deliveries in memory and, with a path, as JSON lines"""
+
+    def __init__(self, name, path=None, batch_size=1):
+        super().__init__(name)
+        self.path = path
+        self.batch_size = batch_size
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, delivery):
+        self.send_batch([delivery])
+
+    def send_batch(self, deliveries):
+        with self._lock:
+            self.sent.extend(deliveries)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for delivery in deliveries:
+                        f.write(json.dumps(delivery.to_dict(), ensure_ascii=False) + "\n")
+        return [None] * len(deliveries)
+
+
+def default_channels():
+    """The live channels, by name"""
+    return {
+        'desktop': DesktopChannel('desktop'),
+        'whatsapp': WhatsAppChannel('whatsapp'),
+        'sms': SmsChannel('sms'),
+        'email': EmailChannel('email'),
+        'webhook': WebhookChannel('webhook'),
+    }
+
+
+def stand_in_channels(channels, target):
+    """Stand-ins for `channels` that keep their names and batch sizes
+
+    target is an http(s):// URL (each batch is POSTed there, see stand_in.py)
+    or a file path (deliveries are appended as JSON lines).
+    """
+    if target.startswith(('http://', 'https://')):
+        return {name: WebhookChannel(name, target, channel.batch_size) for name, channel in channels.items()}
+    return {name: RecordingChannel(name, target, channel.batch_size) for name, channel in channels.items()}
+
+
+_channels = None
+_channels_lock = threading.Lock()
+
+
+def _registry():
+    global _channels
+    if _channels is None:
+        with _channels_lock:
+            if _channels is None:
+                channels = default_channels()
+                if config.NOTIFICATION_STAND_IN:
+                    channels = stand_in_channels(channels, config.NOTIFICATION_STAND_IN)
+                _channels = channels
+    return _channels
+
+
+def get_channel(name):
+    """The registered channel called `name`"""
+    try:
+        return _registry()[name]
+    except KeyError:
+        raise ValueError(f"Unknown notification channel '{name}'") from None
+
+
+def registered_channels():
+    """Names of every registered channel"""
+    return sorted(_registry())
+
+
+def register_channel(channel):
+    """Add or replace a channel under channel.name; returns the one it replaced, if any"""
+    registry = _registry()
+    with _channels_lock:
+        previous = registry.get(channel.name)
+        registry[channel.name] = channel
+    return previous
+
+
+def use_stand_in(target):
+    """Swap every registered channel for a stand-in (see stand_in_channels); returns the old registry"""
+    global _channels
+    previous = dict(_registry())
+    with _channels_lock:
+        _channels = stand_in_channels(previous, target)
+    return previous
+
+
+def set_channels(channels):
+    """Replace the whole registry (e.g. with use_stand_in's return value); returns the old one
+
+    None goes back to the defaults, built again on next use.
+    """
+    global _channels
+    with _channels_lock:
+        previous, _channels = _channels, None if channels is None else dict(channels)
+    return previous
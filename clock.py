@@ -0,0 +1,73 @@
+"""Clocks for the background scheduler.
+
+SystemClock reads the wall clock and sleeps for real. SimulatedClock only
+moves when a test sets or advances it, so scheduling can be checked
+deterministically without waiting. The process-wide clock (``now()``,
+``set_clock()``) is what the scheduler jobs and database helpers read.
+"""
+import threading
+from datetime import datetime
+
+
+class SystemClock:
+    """Wall-clock time"""
+
+    def now(self):
+        return datetime.now()
+
+    def wait(self, condition, timeout):
+        """Sleep on a held condition until notified or `timeout` seconds pass"""
+        condition.wait(timeout)
+
+
+class SimulatedClock:
+    """Clock that stands still until set() or advance() moves it"""
+
+    def __init__(self, start):
+        self._now = start
+        self._lock = threading.Lock()
+        self._conditions = []
+
+    def now(self):
+        return self._now
+
+    def set(self, when):
+        """Jump to `when` and wake anything waiting on this clock"""
+        with self._lock:
+            self._now = when
+            conditions = list(self._conditions)
+
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
+
+    def advance(self, delta):
+        self.set(self._now + delta)
+
+    def wait(self, condition, timeout):
+        """Wait on a held condition until notified; simulated time never passes by itself"""
+        with self._lock:
+            if condition not in self._conditions:
+                self._conditions.append(condition)
+        condition.wait()
+
+
+# Process-wide clock read by the scheduler jobs and database helpers instead
+# of datetime.now(); the replay harness swaps in a SimulatedClock
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Make `clock` the process-wide clock; returns the previous one"""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def now():
+    """Current time on the process-wide clock"""
+    return _clock.now()
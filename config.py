@@ -0,0 +1,170 @@
+import os
+
+# ===== DATABASE =====
+
+# Location of the SQLite database (override with DOSEBUDDY_DB_PATH)
+DB_PATH = os.environ.get('DOSEBUDDY_DB_PATH', 'data/dosebuddy.db')
+
+# Number of idle connections kept open by the connection pool
+DB_POOL_SIZE = int(os.environ.get('DOSEBUDDY_DB_POOL_SIZE', '4'))
+
+# How schedule_log stores dose dates and times: 'text' or 'integer'
+# (epoch days and minutes after midnight, see log_storage.py)
+LOG_STORAGE = os.environ.get('DOSEBUDDY_LOG_STORAGE', 'text')
+
+# Dose logs older than this many days move to monthly archive tables
+ARCHIVE_AFTER_DAYS = int(os.environ.get('DOSEBUDDY_ARCHIVE_AFTER_DAYS', '90'))
+
+# Reader threads used by the async database facade (async_db.py)
+DB_READER_THREADS = int(os.environ.get('DOSEBUDDY_DB_READER_THREADS', '3'))
+
+# PRAGMAs applied once to every new pooled connection
+DB_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -8000,       # negative value = KiB, so ~8 MB page cache
+    'mmap_size': 67108864,     # 64 MB memory-mapped I/O
+    'busy_timeout': 5000,      # wait up to 5 s on a locked database
+}
+
+# ===== SCHEDULER SERVICE =====
+
+# Only the process holding this file lock runs the scheduler on this host
+SCHEDULER_LOCK_PATH = os.environ.get('DOSEBUDDY_SCHEDULER_LOCK', 'data/scheduler.lock')
+
+# Status snapshot written by the running scheduler, read by the app
+SCHEDULER_STATUS_PATH = os.environ.get('DOSEBUDDY_SCHEDULER_STATUS', 'data/scheduler_status.json')
+
+# How often the scheduler checks for schedule changes made by other processes
+SCHEDULER_CHANGE_POLL_SECONDS = float(os.environ.get('DOSEBUDDY_SCHEDULER_POLL', '2'))
+
+# How often the status file is refreshed, and standby processes retry the lock
+SCHEDULER_HEARTBEAT_SECONDS = float(os.environ.get('DOSEBUDDY_SCHEDULER_HEARTBEAT', '30'))
+
+# Longest stretch of downtime the missed-dose catch-up goes back over on start
+CATCH_UP_MAX_DAYS = int(os.environ.get('DOSEBUDDY_CATCH_UP_MAX_DAYS', '7'))
+
+# ===== DOSE INSTANCES =====
+
+# Days after today whose dose instances are generated ahead of time
+DOSE_INSTANCE_LOOKAHEAD_DAYS = int(os.environ.get('DOSEBUDDY_DOSE_INSTANCE_LOOKAHEAD_DAYS', '1'))
+
+# Past dose instances are kept this long (the adherence streak reads 30 days)
+DOSE_INSTANCE_RETENTION_DAYS = int(os.environ.get('DOSEBUDDY_DOSE_INSTANCE_RETENTION_DAYS', '35'))
+
+# ===== DOSE WORKERS =====
+
+# Number of sharded dose worker processes (dose_worker.py). When set, the
+# scheduler service leaves reminders and missed-dose alerts to the workers
+DOSE_WORKER_SHARDS = int(os.environ.get('DOSEBUDDY_DOSE_WORKER_SHARDS', '0'))
+
+# How long a worker's claim on a batch of doses lasts before others may take it
+DOSE_WORKER_LEASE_SECONDS = float(os.environ.get('DOSEBUDDY_DOSE_WORKER_LEASE_SECONDS', '60'))
+
+# Doses left unclaimed this long after they were due are taken by any shard
+DOSE_WORKER_ORPHAN_SECONDS = float(os.environ.get('DOSEBUDDY_DOSE_WORKER_ORPHAN_SECONDS', '120'))
+
+# How often each worker polls for due doses, and how many it leases per claim
+DOSE_WORKER_POLL_SECONDS = float(os.environ.get('DOSEBUDDY_DOSE_WORKER_POLL_SECONDS', '1'))
+DOSE_WORKER_BATCH_SIZE = int(os.environ.get('DOSEBUDDY_DOSE_WORKER_BATCH_SIZE', '500'))
+
+# ===== NOTIFICATIONS =====
+
+# Delivery channels: (concurrent deliveries, timeout in seconds, queue size).
+# Notifications past the queue size are dropped rather than blocking the scheduler
+NOTIFICATION_CHANNELS = {
+    'desktop': (1, float(os.environ.get('DOSEBUDDY_DESKTOP_NOTIFY_TIMEOUT', '10')), 100),
+    'whatsapp': (int(os.environ.get('DOSEBUDDY_WHATSAPP_CONCURRENCY', '4')),
+                 float(os.environ.get('DOSEBUDDY_WHATSAPP_TIMEOUT', '15')), 1000),
+    'sms': (int(os.environ.get('DOSEBUDDY_SMS_CONCURRENCY', '2')),
+            float(os.environ.get('DOSEBUDDY_SMS_TIMEOUT', '15')), 1000),
+    'email': (1, float(os.environ.get('DOSEBUDDY_EMAIL_TIMEOUT', '60')), 1000),
+    'webhook': (int(os.environ.get('DOSEBUDDY_WEBHOOK_CONCURRENCY', '2')),
+                float(os.environ.get('DOSEBUDDY_WEBHOOK_TIMEOUT', '15')), 1000),
+}
+
+# Channels every guardian alert goes out on (see channels.py); comma-separated
+GUARDIAN_CHANNELS = [name.strip() for name in os.environ.get('DOSEBUDDY_GUARDIAN_CHANNELS', 'whatsapp').split(',')
+                     if name.strip()]
+
+# Language of guardian messages when the guardian has none set (see templates.LOCALES)
+MESSAGE_LOCALE = os.environ.get('DOSEBUDDY_MESSAGE_LOCALE', 'en')
+
+# Send every notification to a local stand-in instead: a JSON-lines file path,
+# or an http:// URL such as `python -m stand_in` (for offline load tests)
+NOTIFICATION_STAND_IN = os.environ.get('DOSEBUDDY_NOTIFY_STAND_IN')
+
+# Email alerts over SMTP; a batch of up to EMAIL_BATCH_SIZE shares one connection
+SMTP_HOST = os.environ.get('DOSEBUDDY_SMTP_HOST')
+SMTP_PORT = int(os.environ.get('DOSEBUDDY_SMTP_PORT', '587'))
+SMTP_USER = os.environ.get('DOSEBUDDY_SMTP_USER')
+SMTP_PASSWORD = os.environ.get('DOSEBUDDY_SMTP_PASSWORD')
+SMTP_FROM = os.environ.get('DOSEBUDDY_SMTP_FROM', 'dosebuddy@localhost')
+SMTP_STARTTLS = os.environ.get('DOSEBUDDY_SMTP_STARTTLS', '1') == '1'
+SMTP_TIMEOUT_SECONDS = float(os.environ.get('DOSEBUDDY_SMTP_TIMEOUT', '30'))
+EMAIL_BATCH_SIZE = int(os.environ.get('DOSEBUDDY_EMAIL_BATCH_SIZE', '50'))
+
+# Webhook alerts: JSON POSTs of up to WEBHOOK_BATCH_SIZE messages each
+WEBHOOK_URL = os.environ.get('DOSEBUDDY_WEBHOOK_URL')
+WEBHOOK_BATCH_SIZE = int(os.environ.get('DOSEBUDDY_WEBHOOK_BATCH_SIZE', '100'))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('DOSEBUDDY_WEBHOOK_TIMEOUT', '10'))
+
+# ===== OUTBOX =====
+
+# Guardian messages are retried with exponential backoff (base, doubling up to
+# the max) and dead-lettered after this many failed attempts
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('DOSEBUDDY_OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('DOSEBUDDY_OUTBOX_RETRY_BASE_SECONDS', '30'))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get('DOSEBUDDY_OUTBOX_RETRY_MAX_SECONDS', '3600'))
+
+# Messages claimed per batch, and how long a claim lasts before another worker
+# may retry it (long enough for a full batch through the WhatsApp channel)
+OUTBOX_BATCH_SIZE = int(os.environ.get('DOSEBUDDY_OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_LEASE_SECONDS = float(os.environ.get('DOSEBUDDY_OUTBOX_LEASE_SECONDS', '300'))
+
+# How often the worker looks for retries that came due
+OUTBOX_POLL_SECONDS = float(os.environ.get('DOSEBUDDY_OUTBOX_POLL_SECONDS', '5'))
+
+# Per-guardian token bucket: at most this many messages at once, refilled at
+# the hourly rate, so a guardian gets at most BURST + PER_HOUR in any hour
+OUTBOX_RATE_LIMIT_BURST = int(os.environ.get('DOSEBUDDY_OUTBOX_RATE_LIMIT_BURST', '3'))
+OUTBOX_RATE_LIMIT_PER_HOUR = float(os.environ.get('DOSEBUDDY_OUTBOX_RATE_LIMIT_PER_HOUR', '12'))
+if OUTBOX_RATE_LIMIT_BURST < 1 or OUTBOX_RATE_LIMIT_PER_HOUR <= 0:
+    raise ValueError("DOSEBUDDY_OUTBOX_RATE_LIMIT_BURST must be at least 1 and "
+                     "DOSEBUDDY_OUTBOX_RATE_LIMIT_PER_HOUR above 0")
+
+# Missed-dose alerts wait this long in the outbox so alerts for doses due
+# together (e.g. handled by different dose workers) go out as one digest
+OUTBOX_COALESCE_SECONDS = float(os.environ.get('DOSEBUDDY_OUTBOX_COALESCE_SECONDS', '10'))
+
+# Delivered messages (and their idempotency keys) are kept this long
+OUTBOX_RETENTION_DAYS = int(os.environ.get('DOSEBUDDY_OUTBOX_RETENTION_DAYS', '30'))
+
+# ===== STOCK FORECAST =====
+
+# Days of Taken history used to estimate each medication's daily use
+STOCK_FORECAST_WINDOW_DAYS = int(os.environ.get('DOSEBUDDY_STOCK_FORECAST_WINDOW_DAYS', '14'))
+
+# Refill alerts go out this many days before a medication is forecast to run out
+REFILL_LEAD_DAYS = float(os.environ.get('DOSEBUDDY_REFILL_LEAD_DAYS', '3'))
+
+# ===== TWILIO / WHATSAPP =====
+
+# Credentials come only from the environment (TWILIO_ACCOUNT_SID and
+# TWILIO_AUTH_TOKEN, from the Twilio Console); WhatsApp and SMS sends fail
+# with a configuration error while either is unset
+TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
+TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
+TWILIO_WHATSAPP_NUMBER = os.environ.get('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
+
+# Sender number for the SMS channel (no default: SMS needs a purchased number)
+TWILIO_SMS_NUMBER = os.environ.get('TWILIO_SMS_NUMBER')
+
+# Seconds to wait on the Twilio API before a send fails
+TWILIO_TIMEOUT_SECONDS = float(os.environ.get('DOSEBUDDY_TWILIO_TIMEOUT', '10'))
+
+# Keep-alive connections held open to the API (one per concurrent WhatsApp delivery)
+TWILIO_POOL_SIZE = NOTIFICATION_CHANNELS['whatsapp'][0]
+
+# Point the client at another API host, e.g. a local stand-in for benchmarks
+TWILIO_API_BASE_URL = os.environ.get('DOSEBUDDY_TWILIO_API_BASE_URL')
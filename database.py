@@ -1,82 +1,102 @@
-import sqlite3
-from datetime import datetime
-import os
+import math
+from datetime import datetime, timedelta
+
+import clock
+import config
+from archive import (LOG_COLUMNS, all_logs_source, delete_archived_logs, drop_all_archives,
+                     get_archive_tables, get_archived_logs_count)
+from db_pool import get_connection, get_pool
+from dose_instances import (ALERT_ALERTED, DUE_AT_FORMAT, HISTORY_DAYS, materialize_dose_instances,
+                            prune_dose_instances, set_alert_state, sync_dose_instances)
+from log_storage import ensure_log_storage, get_log_storage
+from migrations import REBUILD_DAILY_ADHERENCE, migrate
+from outbox import OUTBOX_COLUMNS, enqueue, outbox_counts, prune_sent, requeue_dead
+from stock_forecast import cached_forecast
+from models import (DoseInstance, DoseLog, DoseTime, Guardian, Medication, OutboxMessage, Prescription,
+                    format_minute_of_day, parse_minute_of_day)
+
+
+# Single-statement dose write backed by idx_schedule_log_dose.
+# {date} and {time} are filled in with the stored columns (see log_storage.py)
+UPSERT_DOSE_LOG = '''
+    INSERT INTO schedule_log (medication_id, {time}, actual_time, status, {date})
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (medication_id, {date}, {time})
+    DO UPDATE SET actual_time = excluded.actual_time, status = excluded.status
+'''
+
+# Statuses counted by the daily_adherence rollup, in the order reports list them
+ROLLUP_STATUSES = ('Delayed', 'Missed', 'Taken')
+
+# Same write, but an existing log for the dose is left untouched
+INSERT_DOSE_LOG_IF_ABSENT = '''
+    INSERT INTO schedule_log (medication_id, {time}, actual_time, status, {date})
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (medication_id, {date}, {time}) DO NOTHING
+'''
+
+
+# Columns the sidebar, dashboard, analytics and prescription pages show
+MEDICATION_SUMMARY_COLUMNS = 'id, name, dosage, times, total_count, remaining_count, med_type'
+
+_initialized_databases = set()
 
 
 def init_database():
-    """Create database tables for DoseBuddy"""
-    # Create data directory if it doesn't exist
-    if not os.path.exists('data'):
-        os.makedirs('data')
-    
-    conn = sqlite3.connect('data/dosebuddy.db', check_same_thread=False)
-    conn.execute('PRAGMA journal_mode=WAL')
-    
-    # Medications table with med_type column
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS medications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            dosage TEXT NOT NULL,
-            frequency INTEGER NOT NULL,
-            times TEXT NOT NULL,
-            total_count INTEGER NOT NULL,
-            remaining_count INTEGER NOT NULL,
-            added_date TEXT NOT NULL,
-            med_type TEXT DEFAULT 'Tablet'
-        )
-    ''')
-    
-    # Schedule log table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS schedule_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            medication_id INTEGER NOT NULL,
-            scheduled_time TEXT NOT NULL,
-            actual_time TEXT,
-            status TEXT NOT NULL,
-            date TEXT NOT NULL,
-            FOREIGN KEY (medication_id) REFERENCES medications (id)
-        )
-    ''')
-    
-    # Prescriptions table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS prescriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            medication_id INTEGER NOT NULL,
-            image_path TEXT NOT NULL,
-            upload_date TEXT NOT NULL,
-            FOREIGN KEY (medication_id) REFERENCES medications (id)
-        )
-    ''')
-    
-    # Guardian table for WhatsApp alerts
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS guardian (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_name TEXT NOT NULL,
-            guardian_name TEXT NOT NULL,
-            guardian_phone TEXT NOT NULL,
-            whatsapp_enabled INTEGER DEFAULT 1,
-            email TEXT,
-            added_date TEXT NOT NULL
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Create or upgrade the DoseBuddy database schema
+
+    Pending migrations run once per database per process; later calls
+    (every Streamlit rerun) return without touching the database.
+    """
+    pool = get_pool()
+    if pool.db_path in _initialized_databases:
+        return
+
+    with pool.connection() as conn:
+        migrate(conn)
+        ensure_log_storage(conn)
+
+    # Fill in dose instances for the streak history, today and the look-ahead
+    # (a no-op for rows that already exist)
+    with pool.connection() as conn:
+        today = clock.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        materialize_dose_instances(conn, today - timedelta(days=HISTORY_DAYS),
+                                   HISTORY_DAYS + config.DOSE_INSTANCE_LOOKAHEAD_DAYS)
+
+    _initialized_databases.add(pool.db_path)
+
+
+def _fetch_all(record_class, sql, params=()):
+    """Run a query and build a record_class instance per row"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        return record_class.fetch_all(cursor.execute(sql, params))
+
+
+def _fetch_one(record_class, sql, params=()):
+    """Run a query and build a record_class instance from the first row"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = record_class.row_factory
+        return cursor.execute(sql, params).fetchone()
 
 
 def add_medication_with_type(name, dosage, frequency, times, total_count, med_type):
     """Add new medication with type"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    conn.execute('''
-        INSERT INTO medications (name, dosage, frequency, times, total_count, remaining_count, added_date, med_type)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (name, dosage, frequency, times, total_count, total_count, datetime.now().strftime('%Y-%m-%d'), med_type))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO medications (name, dosage, frequency, times, total_count, remaining_count, added_date, med_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (name, dosage, frequency, times, total_count, total_count, clock.now().strftime('%Y-%m-%d'), med_type))
+
+        # Keep the normalized dose times in the same transaction
+        minutes = {parse_minute_of_day(t) for t in times.split(',')} - {None}
+        conn.executemany('INSERT OR IGNORE INTO dose_times (medication_id, minute_of_day) VALUES (?, ?)',
+                         [(cursor.lastrowid, minute) for minute in sorted(minutes)])
+        # Rest of today's doses and the look-ahead days
+        materialize_dose_instances(conn, clock.now(), config.DOSE_INSTANCE_LOOKAHEAD_DAYS,
+                                   medication_id=cursor.lastrowid)
+        return cursor.lastrowid
 
 
 def add_medication(name, dosage, frequency, times, total_count):
@@ -86,254 +106,730 @@ def add_medication(name, dosage, frequency, times, total_count):
 
 def get_all_medications():
     """Get all medications"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('SELECT * FROM medications')
-    medications = cursor.fetchall()
-    conn.close()
-    return medications
+    return _fetch_all(Medication, '''
+        SELECT id, name, dosage, frequency, times, total_count, remaining_count, added_date, med_type
+        FROM medications
+    ''')
+
+
+def get_medication_summaries():
+    """Get medications with only the columns the list and stock views need"""
+    return _fetch_all(Medication, f'SELECT {MEDICATION_SUMMARY_COLUMNS} FROM medications')
+
+
+def get_medication_schedules():
+    """Get id, name, dosage and times for every medication, used by the scheduler"""
+    return _fetch_all(Medication, 'SELECT id, name, dosage, times FROM medications')
+
+
+# ===== DOSE TIMES =====
+
+def get_dose_times_by_medication():
+    """Get {medication_id: ['HH:MM', ...]} for every medication, earliest first"""
+    with get_connection() as conn:
+        rows = conn.execute('SELECT medication_id, minute_of_day FROM dose_times ORDER BY medication_id, minute_of_day')
+        dose_times = {}
+        for medication_id, minute in rows:
+            dose_times.setdefault(medication_id, []).append(format_minute_of_day(minute))
+    return dose_times
+
+
+def get_dose_schedule(medication_id=None):
+    """Get every scheduled dose (or one medication's) with its medication name and dosage"""
+    if medication_id is not None:
+        return _fetch_all(DoseTime, '''
+            SELECT dt.medication_id, dt.minute_of_day, m.name, m.dosage
+            FROM dose_times dt
+            JOIN medications m ON m.id = dt.medication_id
+            WHERE dt.medication_id = ?
+            ORDER BY dt.minute_of_day
+        ''', (medication_id,))
+
+    return _fetch_all(DoseTime, '''
+        SELECT dt.medication_id, dt.minute_of_day, m.name, m.dosage
+        FROM dose_times dt
+        JOIN medications m ON m.id = dt.medication_id
+        ORDER BY dt.minute_of_day
+    ''')
+
+
+def get_doses_from_minute(start_minute, limit):
+    """Get up to `limit` doses scheduled at or after start_minute, earliest first"""
+    return _fetch_all(DoseTime, '''
+        SELECT dt.medication_id, dt.minute_of_day, m.name, m.dosage
+        FROM dose_times dt
+        JOIN medications m ON m.id = dt.medication_id
+        WHERE dt.minute_of_day >= ?
+        ORDER BY dt.minute_of_day
+        LIMIT ?
+    ''', (start_minute, limit))
+
+
+def get_doses_due_between(start, end):
+    """Get dose occurrences scheduled between two datetimes (inclusive)
+
+    Each DoseTime has `date` set to the day of that occurrence, so windows
+    that cross midnight return yesterday's late doses with yesterday's date.
+    """
+    doses = []
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        while day <= end:
+            first = max(0, math.ceil((start - day).total_seconds() / 60))
+            last = min(1439, math.floor((end - day).total_seconds() / 60))
+
+            if first <= last:
+                doses.extend(DoseTime.fetch_all(cursor.execute('''
+                    SELECT dt.medication_id, dt.minute_of_day, ? AS date, m.name, m.dosage
+                    FROM dose_times dt
+                    JOIN medications m ON m.id = dt.medication_id
+                    WHERE dt.minute_of_day BETWEEN ? AND ?
+                    ORDER BY dt.minute_of_day
+                ''', (day.strftime('%Y-%m-%d'), first, last))))
+
+            day += timedelta(days=1)
+
+    return doses
+
+
+# Walks idx_dose_times_minute (or the dose_times primary key for one
+# medication) in minute order and stops after LIMIT rows; doses already
+# logged for that day are skipped through the dose_instances primary key
+UPCOMING_DOSES = '''
+    SELECT dt.medication_id, dt.minute_of_day, ? AS date, m.name, m.dosage
+    FROM dose_times dt
+    JOIN medications m ON m.id = dt.medication_id
+    WHERE dt.minute_of_day >= ? {medication_filter}
+      AND NOT EXISTS (
+          SELECT 1 FROM dose_instances di
+          WHERE di.medication_id = dt.medication_id AND di.date = ? AND di.minute_of_day = dt.minute_of_day
+            AND di.status IS NOT NULL
+      )
+    ORDER BY dt.minute_of_day, dt.medication_id
+    LIMIT ?
+'''
+
+
+def get_upcoming_doses(limit=5, now=None, medication_id=None, days=7):
+    """Get the next `limit` unlogged doses after now, across up to `days` days
+
+    Each DoseTime has `date` set. Costs one indexed query per day reached,
+    each reading at most the rows still needed, instead of expanding every
+    schedule. With medication_id only that medication's doses are returned.
+    """
+    now = now or clock.now()
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_minute = now.hour * 60 + now.minute + 1
+    sql = UPCOMING_DOSES.format(medication_filter='AND dt.medication_id = ?' if medication_id is not None else '')
+
+    doses = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        for _ in range(days):
+            date = day.strftime('%Y-%m-%d')
+            params = [date, start_minute, date, limit - len(doses)]
+            if medication_id is not None:
+                params.insert(2, medication_id)
+
+            doses.extend(DoseTime.fetch_all(cursor.execute(sql, params)))
+            if len(doses) >= limit:
+                break
+            day += timedelta(days=1)
+            start_minute = 0
+
+    return doses
 
 
 def get_medication_by_id(medication_id):
     """Get specific medication by ID"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('SELECT * FROM medications WHERE id = ?', (medication_id,))
-    medication = cursor.fetchone()
-    conn.close()
-    return medication
+    return _fetch_one(Medication, '''
+        SELECT id, name, dosage, frequency, times, total_count, remaining_count, added_date, med_type
+        FROM medications WHERE id = ?
+    ''', (medication_id,))
 
 
 def update_tablet_count(medication_id, new_count):
     """Update remaining tablet count"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    conn.execute('UPDATE medications SET remaining_count = ? WHERE id = ?', (new_count, medication_id))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('UPDATE medications SET remaining_count = ? WHERE id = ?', (new_count, medication_id))
+
+
+def update_tablet_counts(counts):
+    """Update remaining counts for many medications from (medication_id, new_count) pairs"""
+    with get_connection() as conn:
+        conn.executemany('UPDATE medications SET remaining_count = ? WHERE id = ?',
+                         [(new_count, medication_id) for medication_id, new_count in counts])
 
 
 def log_medication_taken(medication_id, scheduled_time, status):
     """Log when medication is taken or missed"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    actual_time = datetime.now().strftime('%H:%M:%S') if status == 'Taken' else None
-    
-    # Check if already logged for this medication, time, and date
-    cursor = conn.execute('''
-        SELECT id FROM schedule_log 
-        WHERE medication_id = ? AND scheduled_time = ? AND date = ?
-    ''', (medication_id, scheduled_time, datetime.now().strftime('%Y-%m-%d')))
-    
-    existing = cursor.fetchone()
-    
-    if existing:
-        # Update existing log
-        conn.execute('''
-            UPDATE schedule_log 
-            SET actual_time = ?, status = ?
-            WHERE id = ?
-        ''', (actual_time, status, existing[0]))
-    else:
-        # Insert new log
-        conn.execute('''
-            INSERT INTO schedule_log (medication_id, scheduled_time, actual_time, status, date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (medication_id, scheduled_time, actual_time, status, datetime.now().strftime('%Y-%m-%d')))
-    
-    conn.commit()
-    conn.close()
+    now = clock.now()
+    today = now.strftime('%Y-%m-%d')
+    actual_time = now.strftime('%H:%M:%S') if status == 'Taken' else None
+    storage = get_log_storage()
+
+    # Inserts the log, or updates the existing one for this medication, time, and date
+    with get_connection() as conn:
+        conn.execute(storage.format(UPSERT_DOSE_LOG),
+                     (medication_id, storage.time_value(scheduled_time), actual_time, status,
+                      storage.date_value(today)))
+        sync_dose_instances(conn, [(medication_id, scheduled_time, status, today)])
+
+
+def log_medications_bulk(entries, overwrite=True):
+    """Log many dose events in one transaction
+
+    entries holds (medication_id, scheduled_time, status) tuples, optionally
+    with a fourth 'YYYY-MM-DD' date (defaults to today). With overwrite=False
+    doses that already have a log row are skipped instead of updated.
+    Returns the number of entries written.
+    """
+    now = clock.now()
+    today = now.strftime('%Y-%m-%d')
+    taken_time = now.strftime('%H:%M:%S')
+    storage = get_log_storage()
+
+    rows = []
+    logged = []
+    for entry in entries:
+        medication_id, scheduled_time, status = entry[:3]
+        date = entry[3] if len(entry) > 3 else today
+        actual_time = taken_time if status == 'Taken' else None
+        rows.append((medication_id, storage.time_value(scheduled_time), actual_time, status,
+                     storage.date_value(date)))
+        logged.append((medication_id, scheduled_time, status, date))
+
+    if rows:
+        with get_connection() as conn:
+            sql = UPSERT_DOSE_LOG if overwrite else INSERT_DOSE_LOG_IF_ABSENT
+            conn.executemany(storage.format(sql), rows)
+            sync_dose_instances(conn, logged, overwrite)
+
+    return len(rows)
 
 
 def check_medication_status(medication_id, scheduled_time, date):
     """Check if medication was logged for specific time and date"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT status FROM schedule_log
-        WHERE medication_id = ? AND scheduled_time = ? AND date = ?
-    ''', (medication_id, scheduled_time, date))
-    result = cursor.fetchone()
-    conn.close()
+    storage = get_log_storage()
+    with get_connection() as conn:
+        cursor = conn.execute(storage.format('''
+            SELECT status FROM schedule_log
+            WHERE medication_id = ? AND {time} = ? AND {date} = ?
+        '''), (medication_id, storage.time_value(scheduled_time), storage.date_value(date)))
+        result = cursor.fetchone()
     return result[0] if result else None
 
 
+def _days_ago(days):
+    """'YYYY-MM-DD' of the day `days` days before today on the process-wide clock"""
+    return (clock.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
 def get_adherence_data(days=7):
     """Get adherence data for analytics"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT status, COUNT(*) as count
-        FROM schedule_log
-        WHERE date >= date('now', '-{} days')
-        GROUP BY status
-    '''.format(days))
-    data = cursor.fetchall()
-    conn.close()
-    return data
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT SUM(delayed), SUM(missed), SUM(taken)
+            FROM daily_adherence
+            WHERE date >= ?
+        ''', (_days_ago(days),))
+        counts = cursor.fetchone()
+
+    # Same (status, count) rows the old GROUP BY status query returned
+    return [(status, count) for status, count in zip(ROLLUP_STATUSES, counts) if count]
 
 
 def get_daily_adherence(days=7):
     """Get daily adherence for bar chart"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT date, status, COUNT(*) as count
-        FROM schedule_log
-        WHERE date >= date('now', '-{} days')
-        GROUP BY date, status
-        ORDER BY date
-    '''.format(days))
-    data = cursor.fetchall()
-    conn.close()
-    return data
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT date, SUM(delayed), SUM(missed), SUM(taken)
+            FROM daily_adherence
+            WHERE date >= ?
+            GROUP BY date
+            ORDER BY date
+        ''', (_days_ago(days),))
+        days_data = cursor.fetchall()
+
+    return [(date, status, count)
+            for date, *counts in days_data
+            for status, count in zip(ROLLUP_STATUSES, counts) if count]
+
+
+def rebuild_daily_adherence():
+    """Recompute the daily_adherence rollup from the full schedule log, archives included"""
+    with get_connection() as conn:
+        conn.execute('DELETE FROM daily_adherence')
+        conn.execute(REBUILD_DAILY_ADHERENCE.format(source=all_logs_source(conn)))
+
+
+# ===== MISSED-DOSE CATCH-UP =====
+
+MISSED_WATERMARK_KEY = 'missed_watermark'
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M'
+
+# Every scheduled dose occurrence in the window with no log row. One
+# (date, stored date, first minute, last minute) row per day is spliced into
+# the days CTE; the NOT EXISTS probe is an idx_schedule_log_dose lookup.
+# Doses on the day a medication was added are skipped: added_date has no
+# time, and a dose earlier that day predates the medication.
+UNLOGGED_DOSES = '''
+    WITH days (date, stored_date, first_minute, last_minute) AS (VALUES {days})
+    SELECT dt.medication_id, dt.minute_of_day, d.date, m.name, m.dosage
+    FROM days d
+    JOIN dose_times dt ON dt.minute_of_day BETWEEN d.first_minute AND d.last_minute
+    JOIN medications m ON m.id = dt.medication_id
+    WHERE m.added_date < d.date
+      AND NOT EXISTS (
+          SELECT 1 FROM schedule_log l
+          WHERE l.medication_id = dt.medication_id
+            AND l.{{date}} = d.stored_date
+            AND l.{{time}} = {dose_time}
+      )
+    ORDER BY d.date, dt.minute_of_day, dt.medication_id
+'''
+
+
+def get_missed_watermark():
+    """Datetime of the last dose occurrence the missed-dose checks have processed, or None"""
+    with get_connection() as conn:
+        row = conn.execute('SELECT value FROM scheduler_state WHERE key = ?', (MISSED_WATERMARK_KEY,)).fetchone()
+    return datetime.strptime(row[0], WATERMARK_FORMAT) if row else None
+
+
+def _advance_watermark(conn, until):
+    # Text comparison works because the format sorts chronologically
+    conn.execute('''
+        INSERT INTO scheduler_state (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = max(value, excluded.value)
+    ''', (MISSED_WATERMARK_KEY, until.strftime(WATERMARK_FORMAT)))
+
+
+def advance_missed_watermark(until):
+    """Record that every dose scheduled at or before `until` has been processed (never moves back)"""
+    with get_connection() as conn:
+        _advance_watermark(conn, until)
+
+
+def catch_up_missed_doses(now=None, missed_after=timedelta(minutes=1), max_days=None):
+    """Log every unlogged dose whose missed deadline passed since the watermark as Missed
+
+    Covers doses scheduled after the watermark (at most max_days back) whose
+    time + missed_after is before `now`. The logs and the new watermark are
+    written in one transaction. On the very first run only the watermark is
+    set, so an existing install is not backfilled. Returns the newly logged
+    doses as DoseTime rows with their `date`.
+    """
+    now = now or clock.now()
+    max_days = config.CATCH_UP_MAX_DAYS if max_days is None else max_days
+
+    # Last minute whose deadline is strictly in the past
+    deadline = now - missed_after
+    end = deadline.replace(second=0, microsecond=0)
+    if end == deadline:
+        end -= timedelta(minutes=1)
+
+    storage = get_log_storage()
+
+    with get_connection() as conn:
+        row = conn.execute('SELECT value FROM scheduler_state WHERE key = ?', (MISSED_WATERMARK_KEY,)).fetchone()
+        if row is None:
+            _advance_watermark(conn, end)
+            return []
+
+        start = max(datetime.strptime(row[0], WATERMARK_FORMAT) + timedelta(minutes=1),
+                    end.replace(hour=0, minute=0) - timedelta(days=max_days))
+        if start > end:
+            return []
+
+        days = []
+        params = []
+        day = start.replace(hour=0, minute=0)
+        while day <= end:
+            first = max(0, int((start - day).total_seconds() // 60))
+            last = min(1439, int((end - day).total_seconds() // 60))
+            date = day.strftime('%Y-%m-%d')
+            days.append('(?, ?, ?, ?)')
+            params.extend((date, storage.date_value(date), first, last))
+            day += timedelta(days=1)
+
+        sql = UNLOGGED_DOSES.format(days=', '.join(days), dose_time=storage.time_sql('dt.minute_of_day'))
+        missed = DoseTime.fetch_all(conn.execute(storage.format(sql), params))
+
+        conn.executemany(storage.format(INSERT_DOSE_LOG_IF_ABSENT), [
+            (dose.medication_id, storage.time_value(dose.scheduled_time), None, 'Missed',
+             storage.date_value(dose.date))
+            for dose in missed
+        ])
+        sync_dose_instances(conn, [(dose.medication_id, dose.scheduled_time, 'Missed', dose.date)
+                                   for dose in missed], overwrite=False)
+        _advance_watermark(conn, end)
+
+    return missed
+
+
+# ===== DOSE INSTANCES =====
+
+DOSE_INSTANCE_COLUMNS = '''
+    di.medication_id, di.date, di.minute_of_day, di.due_at, di.status, di.alert_state, m.name, m.dosage
+'''
+
+
+def refresh_dose_instances(now=None):
+    """Generate instances for today and the look-ahead days, and prune old ones
+
+    Run by the scheduler at midnight. Returns the number of instances added.
+    """
+    now = now or clock.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    with get_connection() as conn:
+        added = materialize_dose_instances(conn, today, config.DOSE_INSTANCE_LOOKAHEAD_DAYS, now=now)
+        prune_dose_instances(conn, today - timedelta(days=config.DOSE_INSTANCE_RETENTION_DAYS))
+    return added
+
+
+def get_dose_instances_for_day(date=None):
+    """Get one day's dose instances (default today) with medication name and dosage, by due time"""
+    date = date or clock.now().strftime('%Y-%m-%d')
+    return _fetch_all(DoseInstance, f'''
+        SELECT {DOSE_INSTANCE_COLUMNS}
+        FROM dose_instances di
+        JOIN medications m ON m.id = di.medication_id
+        WHERE di.due_at BETWEEN ? AND ?
+        ORDER BY di.due_at, di.medication_id
+    ''', (f"{date} 00:00", f"{date} 23:59"))
+
+
+def get_dose_instances_due(due_ats):
+    """Get the instances due at any of the given 'YYYY-MM-DD HH:MM' times"""
+    due_ats = sorted(set(due_ats))
+    if not due_ats:
+        return []
+
+    return _fetch_all(DoseInstance, f'''
+        SELECT {DOSE_INSTANCE_COLUMNS}
+        FROM dose_instances di
+        JOIN medications m ON m.id = di.medication_id
+        WHERE di.due_at IN ({', '.join('?' * len(due_ats))})
+    ''', due_ats)
+
+
+def get_upcoming_dose_instances(limit=5, now=None):
+    """Get the next `limit` instances due after now that have not been logged yet"""
+    return _fetch_all(DoseInstance, f'''
+        SELECT {DOSE_INSTANCE_COLUMNS}
+        FROM dose_instances di
+        JOIN medications m ON m.id = di.medication_id
+        WHERE di.due_at > ? AND di.status IS NULL
+        ORDER BY di.due_at
+        LIMIT ?
+    ''', ((now or clock.now()).strftime(DUE_AT_FORMAT), limit))
+
+
+def set_dose_instances_alert_state(keys, state):
+    """Record how far alerting got for (medication_id, date, minute_of_day) keys"""
+    with get_connection() as conn:
+        set_alert_state(conn, keys, state)
 
 
 # ===== GUARDIAN MANAGEMENT FUNCTIONS =====
 
-def add_guardian(patient_name, guardian_name, guardian_phone, email=""):
-    """Add guardian contact information for WhatsApp alerts"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    # Delete existing guardian (only one guardian allowed)
-    conn.execute('DELETE FROM guardian')
-    
-    # Add new guardian
-    conn.execute('''
-        INSERT INTO guardian (patient_name, guardian_name, guardian_phone, email, whatsapp_enabled, added_date)
-        VALUES (?, ?, ?, ?, 1, ?)
-    ''', (patient_name, guardian_name, guardian_phone, email, datetime.now().strftime('%Y-%m-%d')))
-    
-    conn.commit()
-    conn.close()
+def add_guardian(patient_name, guardian_name, guardian_phone, email="", locale=None, time_format=None):
+    """Add guardian contact information for WhatsApp alerts
+
+    locale and time_format ('12h' or '24h') choose how the guardian's
+    messages are written (see templates.py); None uses the defaults.
+    """
+    with get_connection() as conn:
+        # Delete existing guardian (only one guardian allowed)
+        conn.execute('DELETE FROM guardian')
+
+        # Add new guardian
+        conn.execute('''
+            INSERT INTO guardian (patient_name, guardian_name, guardian_phone, email, locale, time_format,
+                                  whatsapp_enabled, added_date)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ''', (patient_name, guardian_name, guardian_phone, email, locale, time_format,
+              clock.now().strftime('%Y-%m-%d')))
 
 
 def get_guardian_info():
     """Get guardian information"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('SELECT * FROM guardian ORDER BY id DESC LIMIT 1')
-    guardian = cursor.fetchone()
-    conn.close()
-    return guardian
+    return _fetch_one(Guardian, '''
+        SELECT id, patient_name, guardian_name, guardian_phone, whatsapp_enabled, email, locale, time_format,
+               added_date
+        FROM guardian ORDER BY id DESC LIMIT 1
+    ''')
 
 
 def update_guardian_whatsapp_status(enabled):
     """Enable or disable WhatsApp notifications"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    conn.execute('UPDATE guardian SET whatsapp_enabled = ?', (1 if enabled else 0,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('UPDATE guardian SET whatsapp_enabled = ?', (1 if enabled else 0,))
 
 
 def delete_guardian():
     """Remove guardian information"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    conn.execute('DELETE FROM guardian')
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('DELETE FROM guardian')
+
+
+# ===== PRESCRIPTIONS =====
+
+def add_prescription(medication_id, image_path):
+    """Save a prescription image path for a medication"""
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT INTO prescriptions (medication_id, image_path, upload_date)
+            VALUES (?, ?, ?)
+        ''', (medication_id, image_path, clock.now().strftime('%Y-%m-%d')))
+
+
+def get_all_prescriptions():
+    """Get all prescriptions with their medication name and dosage"""
+    return _fetch_all(Prescription, '''
+        SELECT p.id, p.image_path, p.upload_date, m.name AS medication_name, m.dosage
+        FROM prescriptions p
+        JOIN medications m ON p.medication_id = m.id
+        ORDER BY p.upload_date DESC
+    ''')
+
+
+def delete_prescription(prescription_id):
+    """Delete a single prescription record"""
+    with get_connection() as conn:
+        conn.execute('DELETE FROM prescriptions WHERE id = ?', (prescription_id,))
+
+
+def get_total_prescriptions_count():
+    """Get total number of saved prescriptions"""
+    with get_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM prescriptions').fetchone()[0]
+
+
+# ===== LOW STOCK ALERT TRACKING =====
+
+def was_low_stock_alerted(medication_id, alert_date):
+    """Check whether a low stock alert was already sent for a medication on a date"""
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT id FROM low_stock_alerts
+            WHERE medication_id = ? AND alert_date = ?
+        ''', (medication_id, alert_date))
+        return cursor.fetchone() is not None
+
+
+def record_low_stock_alert(medication_id, alert_date):
+    """Remember that a low stock alert was sent"""
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT INTO low_stock_alerts (medication_id, alert_date)
+            VALUES (?, ?)
+        ''', (medication_id, alert_date))
+
+
+# ===== GUARDIAN OUTBOX =====
+
+def enqueue_outbox(messages, alerted_doses=(), delay_seconds=0, missed_logs=(), low_stock_alerts=()):
+    """Queue (idempotency_key, kind, recipient, body[, payload]) messages for the outbox worker
+
+    alerted_doses are (medication_id, date, minute_of_day) keys marked
+    alerted in the same transaction, so a dose is never left alerted
+    without its message queued. missed_logs are log_medications_bulk
+    entries written (without overwriting) in that transaction too, so a
+    dose is never logged missed without its alert queued, and
+    low_stock_alerts (medication_id, alert_date) pairs are recorded as sent
+    only if their messages are queued. delay_seconds holds the messages
+    back (the coalescing window). Returns the number of new messages.
+    """
+    with get_connection() as conn:
+        if missed_logs:
+            log_medications_bulk(missed_logs, overwrite=False)
+        for medication_id, alert_date in low_stock_alerts:
+            record_low_stock_alert(medication_id, alert_date)
+        added = enqueue(conn, messages, clock.now(), timedelta(seconds=delay_seconds))
+        if alerted_doses:
+            set_alert_state(conn, alerted_doses, ALERT_ALERTED)
+    return added
+
+
+def get_outbox_counts():
+    """Outbox messages per status, plus when the oldest pending one is due"""
+    with get_connection() as conn:
+        return outbox_counts(conn)
+
+
+def get_dead_letters(limit=20):
+    """Messages the outbox gave up on, most recent first"""
+    return _fetch_all(OutboxMessage, f'''
+        SELECT {OUTBOX_COLUMNS} FROM outbox
+        WHERE status = 'dead'
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (limit,))
+
+
+def requeue_dead_letters(message_ids=None):
+    """Retry dead-lettered messages (all, or just message_ids); returns how many"""
+    with get_connection() as conn:
+        return requeue_dead(conn, clock.now(), message_ids)
+
+
+def prune_outbox(now=None):
+    """Delete messages delivered more than config.OUTBOX_RETENTION_DAYS ago; returns how many"""
+    before = (now or clock.now()) - timedelta(days=config.OUTBOX_RETENTION_DAYS)
+    with get_connection() as conn:
+        return prune_sent(conn, before)
 
 
 # ===== MEDICATION HISTORY & REPORTING =====
 
 def get_missed_medications_today():
     """Get medications missed today"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT m.name, m.dosage, sl.scheduled_time, sl.status
+    storage = get_log_storage()
+    return _fetch_all(DoseLog, storage.format('''
+        SELECT m.name AS medication_name, m.dosage, sl.scheduled_time, sl.status
         FROM schedule_log sl
         JOIN medications m ON sl.medication_id = m.id
-        WHERE sl.date = ? AND sl.status = 'Missed'
-        ORDER BY sl.scheduled_time
-    ''', (datetime.now().strftime('%Y-%m-%d'),))
-    missed = cursor.fetchall()
-    conn.close()
-    return missed
+        WHERE sl.{date} = ? AND sl.status = 'Missed'
+        ORDER BY sl.{time}
+    '''), (storage.date_value(clock.now().strftime('%Y-%m-%d')),))
+
+
+def get_recent_missed_doses(limit=10):
+    """Get the most recent missed doses across all medications"""
+    return _fetch_all(DoseLog, get_log_storage().format('''
+        SELECT m.name AS medication_name, m.dosage, sl.date, sl.scheduled_time
+        FROM schedule_log sl
+        JOIN medications m ON sl.medication_id = m.id
+        WHERE sl.status = 'Missed'
+        ORDER BY sl.{date} DESC, sl.{time} DESC
+        LIMIT ?
+    '''), (limit,))
 
 
 def get_medication_history(medication_id, days=30):
-    """Get medication history for specific medication"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
+    """Get medication history for specific medication
+
+    Archive tables are only read when the range reaches back past the hot log.
+    """
+    storage = get_log_storage()
+    select = '''
         SELECT date, scheduled_time, actual_time, status
-        FROM schedule_log
-        WHERE medication_id = ? AND date >= date('now', '-{} days')
-        ORDER BY date DESC, scheduled_time DESC
-    '''.format(days), (medication_id,))
-    history = cursor.fetchall()
-    conn.close()
-    return history
+        FROM {table}
+        WHERE medication_id = ? AND {date} >= ?
+    '''
+
+    with get_connection() as conn:
+        since = _days_ago(days)
+
+        # The hot table may use integer storage; archive tables are always text
+        selects = [select.format(table='schedule_log', date=storage.date_column)]
+        params = [medication_id, storage.date_value(since)]
+        for table in get_archive_tables(conn, since):
+            selects.append(select.format(table=table, date='date'))
+            params += [medication_id, since]
+
+        # Without archives, sort on the stored columns so the index supplies the order
+        if len(selects) == 1:
+            order = storage.format(' ORDER BY {date} DESC, {time} DESC')
+        else:
+            order = ' ORDER BY date DESC, scheduled_time DESC'
+
+        sql = ' UNION ALL '.join(selects) + order
+
+        return DoseLog.fetch_all(conn.execute(sql, params))
 
 
 def get_low_stock_medications(threshold=10):
     """Get medications with low stock"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('''
-        SELECT * FROM medications
+    return _fetch_all(Medication, '''
+        SELECT id, name, dosage, remaining_count
+        FROM medications
         WHERE remaining_count <= ?
         ORDER BY remaining_count ASC
     ''', (threshold,))
-    low_stock = cursor.fetchall()
-    conn.close()
-    return low_stock
+
+
+def get_stock_forecast(today=None):
+    """Days-until-empty forecast for every medication, soonest to run out first
+
+    Cached until stock, schedules or Taken counts change (see stock_forecast.py).
+    """
+    with get_connection() as conn:
+        return cached_forecast(conn, get_pool().db_path, today or clock.now().date(),
+                               config.STOCK_FORECAST_WINDOW_DAYS)
+
+
+def get_medications_to_refill(lead_days=None, today=None):
+    """Forecasts of medications that run out within lead_days (config.REFILL_LEAD_DAYS by default)"""
+    lead_days = config.REFILL_LEAD_DAYS if lead_days is None else lead_days
+    return [forecast for forecast in get_stock_forecast(today)
+            if forecast.days_left is not None and forecast.days_left <= lead_days]
 
 
 def get_total_medications_count():
     """Get total number of active medications"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('SELECT COUNT(*) FROM medications')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    with get_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM medications').fetchone()[0]
 
 
 def get_total_logs_count():
-    """Get total number of medication logs"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    cursor = conn.execute('SELECT COUNT(*) FROM schedule_log')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    """Get total number of medication logs, archived ones included"""
+    with get_connection() as conn:
+        hot = conn.execute('SELECT COUNT(*) FROM schedule_log').fetchone()[0]
+        return hot + get_archived_logs_count(conn)
 
 
 def delete_medication(medication_id):
     """Delete medication and all related data"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    # Delete from all tables
-    conn.execute('DELETE FROM medications WHERE id = ?', (medication_id,))
-    conn.execute('DELETE FROM schedule_log WHERE medication_id = ?', (medication_id,))
-    conn.execute('DELETE FROM prescriptions WHERE medication_id = ?', (medication_id,))
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        # Delete from all tables
+        conn.execute('DELETE FROM medications WHERE id = ?', (medication_id,))
+        conn.execute('DELETE FROM schedule_log WHERE medication_id = ?', (medication_id,))
+        delete_archived_logs(conn, medication_id)
+        conn.execute('DELETE FROM daily_adherence WHERE medication_id = ?', (medication_id,))
+        conn.execute('DELETE FROM dose_times WHERE medication_id = ?', (medication_id,))
+        conn.execute('DELETE FROM dose_instances WHERE medication_id = ?', (medication_id,))
+        conn.execute('DELETE FROM prescriptions WHERE medication_id = ?', (medication_id,))
 
 
 def clear_all_data():
     """Clear all data from database (use with caution)"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    conn.execute('DELETE FROM medications')
-    conn.execute('DELETE FROM schedule_log')
-    conn.execute('DELETE FROM prescriptions')
-    conn.execute('DELETE FROM guardian')
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('DELETE FROM medications')
+        conn.execute('DELETE FROM schedule_log')
+        drop_all_archives(conn)
+        conn.execute('DELETE FROM daily_adherence')
+        conn.execute('DELETE FROM dose_times')
+        conn.execute('DELETE FROM dose_instances')
+        conn.execute('DELETE FROM prescriptions')
+        conn.execute('DELETE FROM guardian')
+        conn.execute('DELETE FROM outbox')
 
 
 # ===== STATISTICS & ANALYTICS =====
 
 def get_adherence_statistics(days=30):
     """Get detailed adherence statistics"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    cursor = conn.execute('''
-        SELECT 
-            COUNT(*) as total_doses,
-            SUM(CASE WHEN status='Taken' THEN 1 ELSE 0 END) as taken,
-            SUM(CASE WHEN status='Missed' THEN 1 ELSE 0 END) as missed,
-            SUM(CASE WHEN status='Delayed' THEN 1 ELSE 0 END) as delayed
-        FROM schedule_log
-        WHERE date >= date('now', '-{} days')
-    '''.format(days))
-    
-    stats = cursor.fetchone()
-    conn.close()
-    
-    if stats and stats[0] > 0:
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT
+                SUM(total) as total_doses,
+                SUM(taken) as taken,
+                SUM(missed) as missed,
+                SUM(delayed) as delayed
+            FROM daily_adherence
+            WHERE date >= ?
+        ''', (_days_ago(days),))
+
+        stats = cursor.fetchone()
+
+    if stats and stats[0]:
         return {
             'total_doses': stats[0],
             'taken': stats[1] or 0,
@@ -352,49 +848,60 @@ def get_adherence_statistics(days=30):
 
 
 def get_medication_streak():
-    """Get current streak of consecutive days with 100% adherence"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    # Get last 30 days of data
-    cursor = conn.execute('''
-        SELECT date, 
-               SUM(CASE WHEN status='Taken' THEN 1 ELSE 0 END) as taken,
-               COUNT(*) as total
-        FROM schedule_log
-        WHERE date >= date('now', '-30 days')
-        GROUP BY date
-        ORDER BY date DESC
-    ''')
-    
-    days_data = cursor.fetchall()
-    conn.close()
-    
+    """Get current streak of consecutive days on which every scheduled dose was taken
+
+    Reads the dose instances already due; today counts once its first dose
+    is due, and an unlogged dose breaks the streak like a missed one.
+    """
+    now = clock.now()
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT date,
+                   SUM(status = 'Taken') as taken,
+                   COUNT(*) as total
+            FROM dose_instances
+            WHERE due_at BETWEEN ? AND ?
+            GROUP BY date
+            ORDER BY date DESC
+        ''', ((now - timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d 00:00'), now.strftime(DUE_AT_FORMAT)))
+
+        days_data = cursor.fetchall()
+
     streak = 0
     for date, taken, total in days_data:
         if taken == total and total > 0:
             streak += 1
         else:
             break
-    
+
     return streak
 
 
 # ===== BACKUP & EXPORT =====
 
+def get_export_log_rows():
+    """Get (name, med_type, dosage, date, status) rows for the CSV export, archives included"""
+    with get_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT m.name, m.med_type, m.dosage, sl.date, sl.status
+            FROM {all_logs_source(conn)} sl
+            JOIN medications m ON sl.medication_id = m.id
+            ORDER BY sl.date DESC
+        ''')
+        return cursor.fetchall()
+
+
 def export_data_to_dict():
     """Export all data to dictionary for backup"""
-    conn = sqlite3.connect('data/dosebuddy.db')
-    
-    # Get all data
-    medications = conn.execute('SELECT * FROM medications').fetchall()
-    schedule_log = conn.execute('SELECT * FROM schedule_log').fetchall()
-    guardian = conn.execute('SELECT * FROM guardian').fetchall()
-    
-    conn.close()
-    
+    with get_connection() as conn:
+        # Get all data
+        medications = conn.execute('SELECT * FROM medications').fetchall()
+        schedule_log = conn.execute(f'SELECT {LOG_COLUMNS} FROM {all_logs_source(conn)}').fetchall()
+        guardian = conn.execute('SELECT * FROM guardian').fetchall()
+
     return {
         'medications': medications,
         'schedule_log': schedule_log,
         'guardian': guardian,
-        'export_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'export_date': clock.now().strftime('%Y-%m-%d %H:%M:%S')
     }
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import config
+
+
+class ConnectionPool:
+    """Small pool of SQLite connections shared by the app and scheduler threads.
+
+    A thread checks out one connection at a time. Nested ``connection()``
+    blocks on the same thread reuse it, and the outermost block commits
+    (or rolls back on error) before handing it back to the pool.
+    """
+
+    def __init__(self, db_path, size=None, pragmas=None):
+        self.db_path = db_path
+        self.size = config.DB_POOL_SIZE if size is None else size
+        self.pragmas = dict(config.DB_PRAGMAS if pragmas is None else pragmas)
+        self.created = 0
+        # Optional sqlite3 trace callback installed on every checkout (the replay harness counts queries)
+        self.trace = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _create(self):
+        """Open a new connection and apply the PRAGMAs once"""
+        directory = os.path.dirname(self.db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._create()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Check out this thread's connection for the duration of a block"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+
+        # Re-entrant use on the same thread shares the outer transaction
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        conn.set_trace_callback(self.trace)
+        local.conn = conn
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            local.conn = None
+            self._release(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(config.DB_PATH)
+    return _pool
+
+
+def configure_pool(db_path=None, size=None, pragmas=None):
+    """Replace the process-wide pool (used by tests and benchmarks)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(db_path or config.DB_PATH, size=size, pragmas=pragmas)
+    return _pool
+
+
+def get_connection():
+    """Context manager yielding a pooled connection for the current thread"""
+    return get_pool().connection()
+
+
+def close_all_connections():
+    """Close every idle pooled connection"""
+    if _pool is not None:
+        _pool.close()
@@ -0,0 +1,191 @@
+"""Materialized dose instances: one row per scheduled dose per day.
+
+dose_times says when a medication is due each day; dose_instances spells
+that out for concrete days (the last ``HISTORY_DAYS``, today and
+``config.DOSE_INSTANCE_LOOKAHEAD_DAYS`` ahead) with the due timestamp, the
+logged status and how far alerting got::
+
+    pending -> reminded -> alerted
+
+The dashboard, reminders, missed-dose alerts, the upcoming-doses list and
+the streak read these rows through idx_dose_instances_due instead of
+expanding schedules in Python, and every log write updates the matching
+row. init_database and a job at midnight generate the rows; rows older
+than ``config.DOSE_INSTANCE_RETENTION_DAYS`` are pruned. Sharded dose
+workers lease open rows through leased_by/lease_expires_at (see
+dose_worker.py).
+"""
+from datetime import timedelta
+
+import clock
+from log_storage import get_log_storage
+from models import parse_minute_of_day
+
+ALERT_PENDING = 'pending'
+ALERT_REMINDED = 'reminded'
+ALERT_ALERTED = 'alerted'
+
+# Later states are never overwritten by earlier ones
+ALERT_STATES = (ALERT_PENDING, ALERT_REMINDED, ALERT_ALERTED)
+
+# due_at is 'YYYY-MM-DD HH:MM', so it sorts and compares as text
+DUE_AT_FORMAT = '%Y-%m-%d %H:%M'
+
+# Days of history generated for the adherence streak
+HISTORY_DAYS = 30
+
+# Status is copied from an existing log row, so regenerating a day keeps
+# what was already logged. Medications start the day after they were added
+# (added_date has no time), except the one being added right now. Doses
+# whose missed deadline has already passed are generated as 'alerted':
+# nothing is waiting to alert on them (downtime is the catch-up's job).
+# WHERE true keeps SQLite from reading ON CONFLICT as a join constraint.
+MATERIALIZE_DOSE_INSTANCES = '''
+    INSERT INTO dose_instances (medication_id, date, minute_of_day, due_at, status, alert_state)
+    WITH RECURSIVE days (date) AS (
+        SELECT ? UNION ALL SELECT date(date, '+1 day') FROM days WHERE date < ?
+    )
+    SELECT medication_id, date, minute_of_day, due_at, status,
+           CASE WHEN due_at < ? THEN 'alerted' ELSE 'pending' END
+    FROM (
+        SELECT dt.medication_id, d.date, dt.minute_of_day,
+               d.date || printf(' %02d:%02d', dt.minute_of_day / 60, dt.minute_of_day % 60) AS due_at,
+               (SELECT l.status FROM schedule_log l
+                WHERE l.medication_id = dt.medication_id AND l.{{date}} = {log_date} AND l.{{time}} = {log_time})
+                   AS status
+        FROM days d
+        JOIN dose_times dt
+        JOIN medications m ON m.id = dt.medication_id
+        WHERE (d.date > ? OR dt.minute_of_day >= ?)
+          AND (m.added_date < d.date OR m.id = ?)
+          {medication_filter}
+    )
+    WHERE true
+    ON CONFLICT DO NOTHING
+'''
+
+
+def due_at(date, minute_of_day):
+    """due_at value for a dose on 'YYYY-MM-DD' at minute_of_day"""
+    return f"{date} {minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+
+def materialize_dose_instances(conn, start, days, medication_id=None, now=None,
+                               missed_after=timedelta(minutes=1)):
+    """Generate instances from the datetime `start` through `days` more days
+
+    On start's own day only doses at or after its time are generated. With
+    medication_id only that medication's instances are generated, including
+    the rest of the day it was added. Existing rows are kept. Returns the
+    number of rows inserted.
+    """
+    storage = get_log_storage()
+    first_date = start.strftime('%Y-%m-%d')
+    last_date = (start + timedelta(days=days)).strftime('%Y-%m-%d')
+
+    sql = MATERIALIZE_DOSE_INSTANCES.format(
+        log_date=storage.date_sql('d.date'),
+        log_time=storage.time_sql('dt.minute_of_day'),
+        medication_filter='AND dt.medication_id = ?' if medication_id is not None else '',
+    )
+    closed_before = ((now or clock.now()) - missed_after).strftime(DUE_AT_FORMAT)
+    params = [first_date, last_date, closed_before, first_date, start.hour * 60 + start.minute, medication_id]
+    if medication_id is not None:
+        params.append(medication_id)
+
+    return conn.execute(storage.format(sql), params).rowcount
+
+
+def prune_dose_instances(conn, before):
+    """Delete instances due before the datetime `before`; returns how many"""
+    return conn.execute('DELETE FROM dose_instances WHERE due_at < ?',
+                        (before.strftime(DUE_AT_FORMAT),)).rowcount
+
+
+def sync_dose_instances(conn, entries, overwrite=True):
+    """Copy logged statuses onto their instances
+
+    entries holds (medication_id, scheduled_time, status, date) tuples as
+    written to schedule_log. 'Manual' logs have no instance and are skipped.
+    With overwrite=False only instances without a status are updated.
+    """
+    rows = []
+    for medication_id, scheduled_time, status, date in entries:
+        minute = parse_minute_of_day(scheduled_time)
+        if minute is not None:
+            rows.append((status, medication_id, date, minute))
+
+    sql = 'UPDATE dose_instances SET status = ? WHERE medication_id = ? AND date = ? AND minute_of_day = ?'
+    if not overwrite:
+        sql += ' AND status IS NULL'
+    conn.executemany(sql, rows)
+
+
+def _earlier_states(state):
+    if state not in ALERT_STATES:
+        raise ValueError(f"Unknown alert state {state!r}; expected one of {', '.join(ALERT_STATES)}")
+    return ALERT_STATES[:ALERT_STATES.index(state)]
+
+
+def set_alert_state(conn, keys, state):
+    """Advance alert_state for (medication_id, date, minute_of_day) keys; never moves back"""
+    earlier = _earlier_states(state)
+    placeholders = ', '.join('?' * len(earlier))
+    conn.executemany(f'''
+        UPDATE dose_instances SET alert_state = ?
+        WHERE medication_id = ? AND date = ? AND minute_of_day = ? AND alert_state IN ({placeholders})
+    ''', [(state, medication_id, date, minute, *earlier) for medication_id, date, minute in keys])
+
+
+# ----- leases (dose_worker.py) -----
+
+LEASE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Lease up to `limit` open instances due in [first, last] whose alert_state
+# is one of {states}, from one shard of medications (or any shard once they
+# are older than the orphan cutoff), skipping instances under a live lease.
+# The subquery walks idx_dose_instances_open, each claimed row is updated
+# by primary key, and the single statement makes the claim atomic between
+# worker processes.
+CLAIM_DOSE_INSTANCES = '''
+    UPDATE dose_instances
+    SET leased_by = ?, lease_expires_at = ?
+    FROM (
+        SELECT medication_id, date, minute_of_day FROM dose_instances
+        WHERE status IS NULL AND alert_state != 'alerted'
+          AND due_at BETWEEN ? AND ?
+          AND alert_state IN ({states})
+          AND (medication_id % ? = ? OR due_at < ?)
+          AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+        ORDER BY due_at
+        LIMIT ?
+    ) AS claimed
+    WHERE dose_instances.medication_id = claimed.medication_id
+      AND dose_instances.date = claimed.date
+      AND dose_instances.minute_of_day = claimed.minute_of_day
+    RETURNING medication_id, date, minute_of_day
+'''
+
+
+def claim_dose_instances(conn, worker_id, states, first_due, last_due, shard, shards, orphaned_before,
+                         now, lease, limit):
+    """Lease open instances for a worker; returns their (medication_id, date, minute_of_day) keys
+
+    Due bounds and orphaned_before are datetimes; `lease` is a timedelta.
+    """
+    sql = CLAIM_DOSE_INSTANCES.format(states=', '.join('?' * len(states)))
+    params = [worker_id, (now + lease).strftime(LEASE_FORMAT),
+              first_due.strftime(DUE_AT_FORMAT), last_due.strftime(DUE_AT_FORMAT), *states,
+              shards, shard, orphaned_before.strftime(DUE_AT_FORMAT), now.strftime(LEASE_FORMAT), limit]
+    return sorted(conn.execute(sql, params).fetchall())
+
+
+def complete_leases(conn, keys, worker_id, state):
+    """Release a worker's leases and advance their alert_state"""
+    earlier = _earlier_states(state)
+    placeholders = ', '.join('?' * len(earlier))
+    conn.executemany(f'''
+        UPDATE dose_instances SET alert_state = ?, leased_by = NULL, lease_expires_at = NULL
+        WHERE medication_id = ? AND date = ? AND minute_of_day = ? AND leased_by = ?
+          AND alert_state IN ({placeholders})
+    ''', [(state, medication_id, date, minute, worker_id, *earlier) for medication_id, date, minute in keys])
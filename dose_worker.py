@@ -0,0 +1,183 @@
+"""Sharded dose workers for hosts that run many schedules.
+
+Instead of one in-process EventScheduler, N worker processes share the
+dose_instances table as a work queue. Worker ``k`` of ``N`` owns the
+medications with ``medication_id % N == k``; DoseBuddy's schema has one
+patient per database, so medications are the unit of partitioning. Each
+poll a worker leases a batch of due instances, hands them to the reminder
+and missed-dose handlers, waits for the database writes they queued, and
+completes the lease by advancing alert_state. A lease carries an expiry:
+if a worker dies mid-batch, its instances become claimable again once the
+lease runs out, and instances a dead shard never claimed are picked up by
+any worker after ``config.DOSE_WORKER_ORPHAN_SECONDS``.
+
+Run every shard from one command, or one shard per process::
+
+    python -m dose_worker --shards 4
+    python -m dose_worker --shard 2 --shards 4
+
+Set ``DOSEBUDDY_DOSE_WORKER_SHARDS`` so the scheduler service leaves dose
+events to the workers and only runs the daily jobs. Claims use UPDATE ...
+FROM ... RETURNING, which needs SQLite 3.35 or newer.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+from datetime import timedelta
+
+import config
+from clock import get_clock
+from db_pool import get_connection
+from dose_instances import (ALERT_ALERTED, ALERT_PENDING, ALERT_REMINDED, claim_dose_instances,
+                            complete_leases)
+from models import DoseTime
+
+
+def _default_handlers():
+    from scheduler import check_missed_medications, send_reminders
+    return send_reminders, check_missed_medications
+
+
+class DoseWorker:
+    """Leases and handles due dose instances for one shard of medications"""
+
+    def __init__(self, shard, shards, on_reminder=None, on_missed=None, clock=None, worker_id=None,
+                 lease_seconds=None, batch_size=None, orphan_seconds=None, missed_after=timedelta(minutes=1)):
+        if not 0 <= shard < shards:
+            raise ValueError(f"Shard {shard} is outside 0..{shards - 1}")
+
+        if on_reminder is None or on_missed is None:
+            default_reminder, default_missed = _default_handlers()
+            on_reminder = on_reminder or default_reminder
+            on_missed = on_missed or default_missed
+
+        self.shard = shard
+        self.shards = shards
+        self.on_reminder = on_reminder
+        self.on_missed = on_missed
+        self.clock = clock or get_clock()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{shard}"
+        self.lease = timedelta(seconds=config.DOSE_WORKER_LEASE_SECONDS if lease_seconds is None
+                               else lease_seconds)
+        self.batch_size = config.DOSE_WORKER_BATCH_SIZE if batch_size is None else batch_size
+        self.orphan_after = timedelta(seconds=config.DOSE_WORKER_ORPHAN_SECONDS if orphan_seconds is None
+                                      else orphan_seconds)
+        self.missed_after = missed_after
+
+    def _claim(self, states, first_due, last_due, now):
+        with get_connection() as conn:
+            keys = claim_dose_instances(conn, self.worker_id, states, first_due, last_due, self.shard,
+                                        self.shards, now - self.orphan_after, now, self.lease,
+                                        self.batch_size)
+            if not keys:
+                return []
+
+            medication_ids = sorted({medication_id for medication_id, _, _ in keys})
+            medications = {row[0]: row[1:] for row in conn.execute(
+                f"SELECT id, name, dosage FROM medications WHERE id IN ({', '.join('?' * len(medication_ids))})",
+                medication_ids)}
+
+        return [DoseTime(medication_id=medication_id, date=date, minute_of_day=minute,
+                         name=medications.get(medication_id, (None, None))[0],
+                         dosage=medications.get(medication_id, (None, None))[1])
+                for medication_id, date, minute in keys]
+
+    def _handle(self, handler, doses, state):
+        # A failing handler, or a failed write it queued, keeps the leases;
+        # they expire and the doses are retried
+        try:
+            for write in handler(doses) or ():
+                write.result()
+        except Exception as e:
+            print(f"❌ Dose worker {self.worker_id} handler error: {e}")
+            return 0
+
+        with get_connection() as conn:
+            complete_leases(conn, [(d.medication_id, d.date, d.minute_of_day) for d in doses],
+                            self.worker_id, state)
+        return len(doses)
+
+    def run_once(self):
+        """Handle every due reminder and missed dose this worker can lease; returns how many"""
+        now = self.clock.now()
+        handled = 0
+
+        # Unlogged doses past their grace period first, so a dose that is
+        # already overdue gets the missed alert without a late reminder
+        passes = (
+            ((ALERT_PENDING, ALERT_REMINDED), now - timedelta(days=config.CATCH_UP_MAX_DAYS),
+             now - self.missed_after, self.on_missed, ALERT_ALERTED),
+            ((ALERT_PENDING,), now - self.missed_after, now, self.on_reminder, ALERT_REMINDED),
+        )
+        for states, first_due, last_due, handler, state in passes:
+            while True:
+                doses = self._claim(states, first_due, last_due, now)
+                if not doses:
+                    break
+                handled += self._handle(handler, doses, state)
+                if len(doses) < self.batch_size:
+                    break
+
+        return handled
+
+    def run_forever(self, stop=None, poll_seconds=None):
+        """Poll until `stop` (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        poll_seconds = config.DOSE_WORKER_POLL_SECONDS if poll_seconds is None else poll_seconds
+
+        print(f"👷 Dose worker {self.worker_id} started (shard {self.shard + 1} of {self.shards})")
+        while not stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Dose worker {self.worker_id} error: {e}")
+            stop.wait(poll_seconds)
+
+
+def run_shard(shard, shards):
+    """Entry point of one worker process"""
+    from database import init_database
+
+    init_database()
+    try:
+        DoseWorker(shard, shards).run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sharded DoseBuddy dose workers")
+    parser.add_argument('--shards', type=int, default=config.DOSE_WORKER_SHARDS or os.cpu_count(),
+                        help="total number of shards")
+    parser.add_argument('--shard', type=int, help="run only this shard (0-based) in this process")
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    if args.shard is not None:
+        if not 0 <= args.shard < args.shards:
+            parser.error(f"--shard must be between 0 and {args.shards - 1}")
+        run_shard(args.shard, args.shards)
+        return
+
+    processes = [multiprocessing.Process(target=run_shard, args=(shard, args.shards),
+                                         name=f'dosebuddy-worker-{shard}')
+                 for shard in range(args.shards)]
+    for process in processes:
+        process.start()
+    print(f"👷 Started {len(processes)} dose workers (Ctrl+C to stop)")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping dose workers")
+        for process in processes:
+            process.join(5)
+
+
+if __name__ == "__main__":
+    main()
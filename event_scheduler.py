@@ -0,0 +1,331 @@
+"""Priority-queue scheduler for dose reminders and missed-dose deadlines.
+
+Every dose in dose_times has two events per day: a reminder at the
+scheduled time and a missed deadline ``missed_after`` later. Events sit in
+a heap ordered by due time, and the worker thread sleeps exactly until the
+earliest one instead of polling. Events due at the same moment are handed
+to their handler together, so doses sharing a time are logged in one
+write.
+
+Doses are kept in a registry keyed by (medication_id, minute_of_day).
+Reloading diffs the registry against the database: new keys get events,
+removed keys are dropped, and a changed name or dosage just replaces the
+registered dose. Heap entries of removed keys are skipped lazily when they
+surface and compacted away once they outnumber live ones.
+notify_changed(medication_id) wakes the worker to refresh one medication.
+
+With an on_catch_up handler, doses whose events were not fired in time
+(the process was down, or the machine slept past them) are handed over
+to it instead: on_catch_up(now) runs when the worker starts and whenever
+it wakes to find dose events more than ``catch_up_after`` late. Those
+late events are skipped rather than fired, so a resume does not replay
+hours of stale reminders.
+"""
+import heapq
+import itertools
+import threading
+from datetime import timedelta
+
+from clock import get_clock
+from models import DoseTime, parse_minute_of_day
+
+REMINDER = 'reminder'
+MISSED = 'missed'
+JOB = 'job'
+
+# Upper bound on one sleep, so wall-clock jumps (suspend, DST) are noticed
+MAX_SLEEP_SECONDS = 300
+
+
+class EventScheduler:
+    """Heap of upcoming dose events with a worker thread that sleeps until the next one"""
+
+    def __init__(self, load_doses, on_reminder, on_missed, clock=None, missed_after=timedelta(minutes=1),
+                 on_catch_up=None, catch_up_after=timedelta(minutes=5)):
+        # load_doses(medication_id=None) returns DoseTime rows for one or all medications
+        self.load_doses = load_doses
+        self.on_reminder = on_reminder
+        self.on_missed = on_missed
+        self.clock = clock or get_clock()
+        self.missed_after = missed_after
+        self.on_catch_up = on_catch_up
+        self.catch_up_after = catch_up_after
+
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+        # (medication_id, minute_of_day) -> (dose, token); heap entries carry the
+        # token they were pushed with and are stale once it no longer matches
+        self._registry = {}
+        self._stale = 0
+
+        # Medication ids waiting to be refreshed; None means every medication
+        self._pending = set()
+        self._stopped = False
+        self._thread = None
+
+    # ----- planning -----
+
+    def _push(self, when, kind, key, scheduled_at, token=None):
+        heapq.heappush(self._heap, (when, next(self._sequence), kind, key, scheduled_at, token))
+
+    def _first_occurrence(self, minute_of_day, offset, now):
+        """Earliest day's occurrence of a daily time whose event (time + offset) is not past"""
+        scheduled_at = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(minutes=minute_of_day)
+        if scheduled_at + offset < now:
+            scheduled_at += timedelta(days=1)
+        return scheduled_at
+
+    def _register(self, key, dose, now):
+        token = next(self._sequence)
+        self._registry[key] = (dose, token)
+
+        for kind, offset in ((REMINDER, timedelta(0)), (MISSED, self.missed_after)):
+            scheduled_at = self._first_occurrence(dose.minute_of_day, offset, now)
+            self._push(scheduled_at + offset, kind, key, scheduled_at, token)
+
+    def _unregister(self, key):
+        del self._registry[key]
+        # Its reminder and missed entries stay in the heap until they surface or are compacted
+        self._stale += 2
+
+    def _compact(self):
+        if self._stale > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _is_live(self, entry):
+        kind, key, token = entry[2], entry[3], entry[5]
+        if kind == JOB:
+            return True
+        registered = self._registry.get(key)
+        return registered is not None and registered[1] == token
+
+    def apply(self, doses, medication_id=None):
+        """Diff the registry against `doses` for one medication (or all of them)
+
+        Returns (added, updated, removed) counts. Unchanged doses keep their
+        heap entries untouched.
+        """
+        wanted = {(dose.medication_id, dose.minute_of_day): dose for dose in doses}
+        added = updated = removed = 0
+        now = self.clock.now()
+
+        with self._condition:
+            if medication_id is None:
+                current = list(self._registry)
+            else:
+                current = [key for key in self._registry if key[0] == medication_id]
+
+            for key in current:
+                if key not in wanted:
+                    self._unregister(key)
+                    removed += 1
+
+            for key, dose in wanted.items():
+                registered = self._registry.get(key)
+                if registered is None:
+                    self._register(key, dose, now)
+                    added += 1
+                elif (registered[0].name, registered[0].dosage) != (dose.name, dose.dosage):
+                    # Same time, new details: swap the dose, keep the events
+                    self._registry[key] = (dose, registered[1])
+                    updated += 1
+
+            self._compact()
+            self._condition.notify_all()
+
+        return added, updated, removed
+
+    def reload(self, medication_id=None):
+        """Refresh one medication's doses (or all) from load_doses()"""
+        if medication_id is None:
+            return self.apply(self.load_doses())
+        return self.apply(self.load_doses(medication_id), medication_id)
+
+    def remove_medication(self, medication_id):
+        """Drop every event of a medication"""
+        return self.apply([], medication_id)
+
+    def add_daily_job(self, time_str, func):
+        """Run func() every day at 'HH:MM'"""
+        minute_of_day = parse_minute_of_day(time_str)
+        if minute_of_day is None:
+            raise ValueError(f"Invalid job time: {time_str!r}")
+
+        with self._condition:
+            scheduled_at = self._first_occurrence(minute_of_day, timedelta(0), self.clock.now())
+            self._push(scheduled_at, JOB, func, scheduled_at)
+            self._condition.notify_all()
+
+    def notify_changed(self, medication_id=None):
+        """Ask the worker to refresh one medication, or all of them (safe from any thread)"""
+        with self._condition:
+            self._pending.add(medication_id)
+            self._condition.notify_all()
+
+    def _refresh_pending(self):
+        with self._condition:
+            pending, self._pending = self._pending, set()
+
+        if None in pending:
+            self.reload()
+        else:
+            for medication_id in pending:
+                self.reload(medication_id)
+
+    @property
+    def dose_count(self):
+        """Number of registered (medication, time) doses"""
+        return len(self._registry)
+
+    @property
+    def job_count(self):
+        """Number of daily jobs"""
+        with self._condition:
+            return sum(1 for entry in self._heap if entry[2] == JOB)
+
+    def upcoming(self, limit=5):
+        """The next `limit` events as dicts with 'time', 'kind' and 'name'"""
+        with self._condition:
+            entries = heapq.nsmallest(limit, (entry for entry in self._heap if self._is_live(entry)))
+            events = []
+            for when, _, kind, key, scheduled_at, _ in entries:
+                if kind == JOB:
+                    name = getattr(key, '__name__', str(key))
+                else:
+                    dose = self._registry[key][0]
+                    name = f"{dose.name} ({dose.dosage}) at {dose.scheduled_time}"
+                events.append({'time': when, 'kind': kind, 'name': name})
+        return events
+
+    # ----- running -----
+
+    def _drop_stale_head(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+    def next_due(self):
+        """Due time of the earliest event, or None when nothing is scheduled"""
+        with self._condition:
+            self._drop_stale_head()
+            return self._heap[0][0] if self._heap else None
+
+    def _pop_due(self, now):
+        due = []
+        with self._condition:
+            self._drop_stale_head()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, kind, key, scheduled_at, token = heapq.heappop(self._heap)
+                payload = key if kind == JOB else self._registry[key][0]
+                due.append((kind, payload, scheduled_at, when))
+
+                # Same event on the next day it is still ahead (after a long sleep
+                # that can be more than one day away)
+                offset = when - scheduled_at
+                next_at = scheduled_at + timedelta(days=1)
+                while next_at + offset <= now:
+                    next_at += timedelta(days=1)
+                self._push(next_at + offset, kind, key, next_at, token)
+
+                self._drop_stale_head()
+        return due
+
+    def run_pending(self):
+        """Fire every event due at the clock's current time; returns how many fired"""
+        now = self.clock.now()
+        due = self._pop_due(now)
+        reminders, missed = [], []
+        catch_up = False
+
+        for kind, payload, scheduled_at, when in due:
+            if kind == JOB:
+                self._call(payload)
+                continue
+
+            if self.on_catch_up and now - when > self.catch_up_after:
+                catch_up = True
+                continue
+
+            dose = DoseTime(medication_id=payload.medication_id, minute_of_day=payload.minute_of_day,
+                            date=scheduled_at.strftime('%Y-%m-%d'), name=payload.name, dosage=payload.dosage)
+            (reminders if kind == REMINDER else missed).append(dose)
+
+        if reminders:
+            self._call(self.on_reminder, reminders)
+        if missed:
+            self._call(self.on_missed, missed)
+        if catch_up:
+            self._call(self.on_catch_up, now)
+
+        return len(due)
+
+    def _call(self, func, *args):
+        # A failing handler must not stop the worker thread
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"❌ Scheduled task error in {getattr(func, '__name__', func)}: {e}")
+
+    def seconds_until_next(self):
+        due = self.next_due()
+        if due is None:
+            return None
+        return max(0.0, (due - self.clock.now()).total_seconds())
+
+    def _worker(self):
+        print("🔄 Scheduler started...")
+        if self.on_catch_up:
+            # Doses whose deadline passed while no scheduler was running
+            self._call(self.on_catch_up, self.clock.now())
+
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+
+                if not self._pending:
+                    delay = self.seconds_until_next()
+                    if delay is None or delay > 0:
+                        self.clock.wait(self._condition, MAX_SLEEP_SECONDS if delay is None
+                                        else min(delay, MAX_SLEEP_SECONDS))
+                        continue
+
+                refresh = bool(self._pending)
+
+            if refresh:
+                self._call(self._refresh_pending)
+            else:
+                self.run_pending()
+
+    def start(self):
+        """Load the doses and start the worker thread"""
+        self.reload()
+        self._thread = threading.Thread(target=self._worker, name='dosebuddy-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ----- simulated-clock harness -----
+
+    def run_until(self, end):
+        """Step a settable clock from event to event up to `end`, firing each on time"""
+        while True:
+            due = self.next_due()
+            if due is None or due > end:
+                break
+            self.clock.set(max(due, self.clock.now()))
+            self.run_pending()
+        self.clock.set(end)
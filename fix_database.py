@@ -1,44 +1,57 @@
-import sqlite3
 import os
+import sys
+
+import config
+from archive import archive_old_logs
+from database import rebuild_daily_adherence
+from db_pool import get_connection
+from log_storage import convert_log_storage, detect_log_storage
+from migrations import get_schema_version, latest_version, migrate
 
 print("🔧 DoseBuddy Database Fix Script")
 print("=" * 50)
 
 # Check if database exists
-if not os.path.exists('data/dosebuddy.db'):
-    print("❌ Database not found at 'data/dosebuddy.db'")
+if not os.path.exists(config.DB_PATH):
+    print(f"❌ Database not found at '{config.DB_PATH}'")
     print("The database will be created when you run the app.")
     exit()
 
-# Connect to database
-conn = sqlite3.connect('data/dosebuddy.db')
-cursor = conn.cursor()
-
-print("✅ Connected to database")
-
-# Fix 1: Add med_type column if missing
-try:
-    cursor.execute("SELECT med_type FROM medications LIMIT 1")
-    print("✅ Column 'med_type' already exists")
-except sqlite3.OperationalError:
-    print("⚠️  Column 'med_type' missing. Adding it now...")
-    cursor.execute("ALTER TABLE medications ADD COLUMN med_type TEXT DEFAULT 'Tablet'")
-    conn.commit()
-    print("✅ Column 'med_type' added successfully!")
-
-# Fix 2: Update existing medications to have default type
-cursor.execute("UPDATE medications SET med_type = 'Tablet' WHERE med_type IS NULL")
-conn.commit()
-print("✅ Updated existing medications with default type")
-
-# Verify the fix
-cursor.execute("PRAGMA table_info(medications)")
-columns = cursor.fetchall()
+with get_connection() as conn:
+    print(f"✅ Connected to database (schema version {get_schema_version(conn)})")
+
+    # Apply pending schema migrations
+    applied = migrate(conn)
+    if applied:
+        for version, description in applied:
+            print(f"✅ Migration {version}: {description}")
+    else:
+        print(f"✅ Schema already at latest version ({latest_version()})")
+
+    # Optional: move logs older than config.ARCHIVE_AFTER_DAYS into monthly archives
+    if '--archive' in sys.argv:
+        moved = archive_old_logs()
+        print(f"✅ Archived {sum(moved.values())} log(s) from {len(moved)} month(s)")
+
+    # Optional: rebuild schedule_log in another storage mode (text or integer);
+    # set DOSEBUDDY_LOG_STORAGE to match or the app converts it back on start
+    if '--log-storage' in sys.argv:
+        convert_log_storage(conn, sys.argv[sys.argv.index('--log-storage') + 1])
+        print(f"✅ schedule_log uses {detect_log_storage(conn).name} storage")
+
+    # Optional: recompute analytics rollups from the raw log
+    if '--rebuild-rollups' in sys.argv:
+        rebuild_daily_adherence()
+        days = conn.execute("SELECT COUNT(DISTINCT date) FROM daily_adherence").fetchone()[0]
+        print(f"✅ Rebuilt daily adherence rollup ({days} day(s))")
+
+    # Verify the fix
+    columns = conn.execute("PRAGMA table_info(medications)").fetchall()
+
 print("\n📋 Current database columns:")
 for col in columns:
     print(f"   - {col[1]} ({col[2]})")
 
-conn.close()
 print("\n" + "=" * 50)
 print("✅ Database fix completed successfully!")
 print("You can now run: streamlit run app.py")
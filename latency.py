@@ -0,0 +1,41 @@
+"""Latency counters shared by the background workers.
+
+The async database writer and readers (async_db.py) and the notification
+channels (notification_dispatch.py) each keep one LatencyStats per kind of
+call and report its snapshot() in their metrics().
+"""
+import threading
+
+
+class LatencyStats:
+    """Queue wait and run time totals for one kind of call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_wait = 0.0
+        self.max_run = 0.0
+
+    def record(self, wait, run, failed):
+        with self._lock:
+            self.count += 1
+            self.errors += failed
+            self.total_wait += wait
+            self.total_run += run
+            self.max_wait = max(self.max_wait, wait)
+            self.max_run = max(self.max_run, run)
+
+    def snapshot(self):
+        with self._lock:
+            count = self.count or 1
+            return {
+                'count': self.count,
+                'errors': self.errors,
+                'avg_wait_ms': self.total_wait / count * 1000,
+                'avg_run_ms': self.total_run / count * 1000,
+                'max_wait_ms': self.max_wait * 1000,
+                'max_run_ms': self.max_run * 1000,
+            }
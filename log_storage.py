@@ -0,0 +1,226 @@
+"""Storage modes for the dates and times in schedule_log.
+
+``text`` (the default) stores 'YYYY-MM-DD' dates and 'HH:MM' times.
+``integer`` stores epoch days and minutes after midnight in ``day`` and
+``minute`` columns, and keeps ``date`` and ``scheduled_time`` as virtual
+generated columns so code that only reads them works unchanged. Filters,
+sort keys and writes go through the active LogStorage so that they hit
+the integer indexes.
+
+The mode is picked with ``config.LOG_STORAGE``; init_database converts an
+existing log to it. Switch modes with the app stopped: other processes
+cache the mode of each database they have opened.
+"""
+from datetime import date as Date
+
+import config
+from db_pool import get_connection, get_pool
+from migrations import SCHEDULE_LOG_INDEXES, SCHEDULE_LOG_ROLLUP_TRIGGERS
+from models import parse_minute_of_day
+
+EPOCH_ORDINAL = Date(1970, 1, 1).toordinal()
+
+# Doses logged from the dashboard without a schedule slot use the time 'Manual'
+MANUAL_TIME = 'Manual'
+MANUAL_MINUTE = -1
+
+# Integer-mode versions of migrations.SCHEDULE_LOG_INDEXES (same names)
+INTEGER_SCHEDULE_LOG_INDEXES = {
+    'idx_schedule_log_dose': '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_log_dose
+        ON schedule_log (medication_id, day, minute)
+    ''',
+    'idx_schedule_log_date_status': '''
+        CREATE INDEX IF NOT EXISTS idx_schedule_log_date_status
+        ON schedule_log (day, status, minute, medication_id)
+    ''',
+    'idx_schedule_log_missed': '''
+        CREATE INDEX IF NOT EXISTS idx_schedule_log_missed
+        ON schedule_log (day, minute) WHERE status = 'Missed'
+    ''',
+}
+
+_TEXT_TABLE = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        medication_id INTEGER NOT NULL,
+        scheduled_time TEXT NOT NULL,
+        actual_time TEXT,
+        status TEXT NOT NULL,
+        date TEXT NOT NULL,
+        FOREIGN KEY (medication_id) REFERENCES medications (id)
+    )
+'''
+
+_INTEGER_TABLE = f'''
+    CREATE TABLE {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        medication_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        minute INTEGER NOT NULL,
+        actual_time TEXT,
+        status TEXT NOT NULL,
+        date TEXT GENERATED ALWAYS AS (date(day * 86400, 'unixepoch')) VIRTUAL,
+        scheduled_time TEXT GENERATED ALWAYS AS (
+            CASE WHEN minute = {MANUAL_MINUTE} THEN '{MANUAL_TIME}'
+                 ELSE printf('%02d:%02d', minute / 60, minute % 60) END
+        ) VIRTUAL,
+        FOREIGN KEY (medication_id) REFERENCES medications (id)
+    )
+'''
+
+
+def to_epoch_day(date_str):
+    """Convert 'YYYY-MM-DD' to days since 1970-01-01"""
+    return Date.fromisoformat(date_str).toordinal() - EPOCH_ORDINAL
+
+
+def to_minute(time_str):
+    """Convert 'HH:MM' (or 'Manual') to the stored minute value"""
+    if time_str == MANUAL_TIME:
+        return MANUAL_MINUTE
+
+    minute = parse_minute_of_day(time_str)
+    if minute is None:
+        raise ValueError(f"Cannot store scheduled time {time_str!r} as minutes")
+    return minute
+
+
+def _text_date_sql(date_expr):
+    return date_expr
+
+
+def _integer_date_sql(date_expr):
+    return f"CAST(julianday({date_expr}) - 2440587.5 AS INTEGER)"
+
+
+def _text_time_sql(minute_expr):
+    return f"printf('%02d:%02d', {minute_expr} / 60, {minute_expr} % 60)"
+
+
+def _integer_time_sql(minute_expr):
+    return minute_expr
+
+
+class LogStorage:
+    """Column names and value conversions for one schedule_log layout"""
+
+    def __init__(self, name, date_column, time_column, date_value, time_value, date_sql, time_sql,
+                 table_sql, indexes):
+        self.name = name
+        self.date_column = date_column
+        self.time_column = time_column
+        self.date_value = date_value
+        self.time_value = time_value
+        # date_sql(expr) and time_sql(expr) turn SQL 'YYYY-MM-DD' and minute-of-day
+        # expressions into the stored values, for joins computed inside a query
+        self.date_sql = date_sql
+        self.time_sql = time_sql
+        self.table_sql = table_sql
+        self.indexes = indexes
+
+    def format(self, sql):
+        """Fill {date} and {time} in a schedule_log query with the stored columns"""
+        return sql.format(date=self.date_column, time=self.time_column)
+
+    def __repr__(self):
+        return f"LogStorage({self.name!r})"
+
+
+TEXT = LogStorage('text', 'date', 'scheduled_time', str, str, _text_date_sql, _text_time_sql,
+                  _TEXT_TABLE, SCHEDULE_LOG_INDEXES)
+INTEGER = LogStorage('integer', 'day', 'minute', to_epoch_day, to_minute, _integer_date_sql, _integer_time_sql,
+                     _INTEGER_TABLE, INTEGER_SCHEDULE_LOG_INDEXES)
+
+LOG_STORAGES = {storage.name: storage for storage in (TEXT, INTEGER)}
+
+_storage_by_database = {}
+
+
+def detect_log_storage(conn):
+    """Return the storage mode schedule_log currently uses"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(schedule_log)')}
+    return INTEGER if 'day' in columns else TEXT
+
+
+def get_log_storage():
+    """Return the storage mode of the pooled database, cached per database path"""
+    db_path = get_pool().db_path
+    storage = _storage_by_database.get(db_path)
+    if storage is None:
+        with get_connection() as conn:
+            storage = detect_log_storage(conn)
+        _storage_by_database[db_path] = storage
+    return storage
+
+
+def _copy_rows(conn, target):
+    if target is TEXT:
+        # The generated columns already hold the text values
+        conn.execute('''
+            INSERT INTO schedule_log_new (id, medication_id, scheduled_time, actual_time, status, date)
+            SELECT id, medication_id, scheduled_time, actual_time, status, date FROM schedule_log
+        ''')
+        return
+
+    rows = conn.execute('SELECT id, medication_id, date, scheduled_time, actual_time, status FROM schedule_log')
+    conn.executemany('''
+        INSERT INTO schedule_log_new (id, medication_id, day, minute, actual_time, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((log_id, medication_id, to_epoch_day(date), to_minute(scheduled_time), actual_time, status)
+          for log_id, medication_id, date, scheduled_time, actual_time, status in rows))
+
+
+def convert_log_storage(conn, name):
+    """Rebuild schedule_log in the named storage mode; returns True if it changed"""
+    if name not in LOG_STORAGES:
+        raise ValueError(f"Unknown log storage {name!r}; expected one of {', '.join(LOG_STORAGES)}")
+
+    target = LOG_STORAGES[name]
+    source = detect_log_storage(conn)
+    if source is target:
+        _storage_by_database[get_pool().db_path] = target
+        return False
+
+    if conn.in_transaction:
+        conn.commit()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Keep the AUTOINCREMENT high-water mark so new ids never reuse archived ones
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'schedule_log'").fetchone()
+
+        conn.execute('DROP TABLE IF EXISTS schedule_log_new')
+        conn.execute(target.table_sql.format(table='schedule_log_new'))
+        _copy_rows(conn, target)
+
+        # Dropping the table drops its indexes and triggers; DROP fires no
+        # delete triggers, so daily_adherence is left as it is
+        conn.execute('DROP TABLE schedule_log')
+        conn.execute('ALTER TABLE schedule_log_new RENAME TO schedule_log')
+
+        if sequence:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'schedule_log'", sequence)
+            conn.execute('''
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT 'schedule_log', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'schedule_log')
+            ''', sequence)
+
+        for sql in target.indexes.values():
+            conn.execute(sql)
+        for sql in SCHEDULE_LOG_ROLLUP_TRIGGERS:
+            conn.execute(sql.format(date_column=target.date_column))
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    _storage_by_database[get_pool().db_path] = target
+    print(f"🔁 Converted schedule_log to {target.name} storage")
+    return True
+
+
+def ensure_log_storage(conn):
+    """Convert schedule_log to config.LOG_STORAGE if it uses the other mode"""
+    return convert_log_storage(conn, config.LOG_STORAGE)
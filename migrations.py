@@ -0,0 +1,447 @@
+"""Versioned schema migrations for the DoseBuddy database.
+
+The schema version lives in ``PRAGMA user_version``. Each migration runs
+once, in order, inside its own transaction, and is written so that it is
+safe to re-run against a database that already has the change (older
+installs were upgraded by hand with fix_database.py).
+"""
+import clock
+from models import parse_minute_of_day
+
+MIGRATIONS = []
+
+# Secondary indexes on schedule_log.
+# idx_schedule_log_dose doubles as the one-row-per-dose uniqueness key.
+SCHEDULE_LOG_INDEXES = {
+    'idx_schedule_log_dose': '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_log_dose
+        ON schedule_log (medication_id, date, scheduled_time)
+    ''',
+    'idx_schedule_log_date_status': '''
+        CREATE INDEX IF NOT EXISTS idx_schedule_log_date_status
+        ON schedule_log (date, status, scheduled_time, medication_id)
+    ''',
+    'idx_schedule_log_missed': '''
+        CREATE INDEX IF NOT EXISTS idx_schedule_log_missed
+        ON schedule_log (date, scheduled_time) WHERE status = 'Missed'
+    ''',
+}
+
+
+def migration(version, description):
+    """Register a migration function for a schema version"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def get_schema_version(conn):
+    """Return the schema version stored in the database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version():
+    """Return the version the newest migration brings the schema to"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def migrate(conn):
+    """Apply every pending migration and return the (version, description) pairs applied"""
+    if conn.in_transaction:
+        conn.commit()
+
+    applied = []
+    current = get_schema_version(conn)
+
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have applied it while we waited for the write lock
+            if get_schema_version(conn) < version:
+                func(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                applied.append((version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        current = version
+
+    return applied
+
+
+def _column_names(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+# ===== MIGRATIONS =====
+
+@migration(1, "Create base tables")
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS medications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            dosage TEXT NOT NULL,
+            frequency INTEGER NOT NULL,
+            times TEXT NOT NULL,
+            total_count INTEGER NOT NULL,
+            remaining_count INTEGER NOT NULL,
+            added_date TEXT NOT NULL,
+            med_type TEXT DEFAULT 'Tablet'
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medication_id INTEGER NOT NULL,
+            scheduled_time TEXT NOT NULL,
+            actual_time TEXT,
+            status TEXT NOT NULL,
+            date TEXT NOT NULL,
+            FOREIGN KEY (medication_id) REFERENCES medications (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prescriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medication_id INTEGER NOT NULL,
+            image_path TEXT NOT NULL,
+            upload_date TEXT NOT NULL,
+            FOREIGN KEY (medication_id) REFERENCES medications (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS guardian (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_name TEXT NOT NULL,
+            guardian_name TEXT NOT NULL,
+            guardian_phone TEXT NOT NULL,
+            whatsapp_enabled INTEGER DEFAULT 1,
+            email TEXT,
+            added_date TEXT NOT NULL
+        )
+    ''')
+
+
+@migration(2, "Add medications.med_type")
+def _add_med_type(conn):
+    # Databases created before medication types existed lack the column
+    if 'med_type' not in _column_names(conn, 'medications'):
+        conn.execute("ALTER TABLE medications ADD COLUMN med_type TEXT DEFAULT 'Tablet'")
+
+    conn.execute("UPDATE medications SET med_type = 'Tablet' WHERE med_type IS NULL")
+
+
+@migration(3, "Create low_stock_alerts table")
+def _create_low_stock_alerts(conn):
+    # Used to be created lazily by the scheduler after the first alert
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS low_stock_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medication_id INTEGER,
+            alert_date TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_low_stock_alerts_medication
+        ON low_stock_alerts (medication_id, alert_date)
+    ''')
+
+
+@migration(4, "Add schedule_log indexes")
+def _add_schedule_log_indexes(conn):
+    # Older databases may hold duplicate rows for a dose; keep the latest one
+    conn.execute('''
+        DELETE FROM schedule_log
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM schedule_log
+            GROUP BY medication_id, date, scheduled_time
+        )
+    ''')
+
+    for sql in SCHEDULE_LOG_INDEXES.values():
+        conn.execute(sql)
+
+
+# Rebuilds daily_adherence from the raw log; shared with database.rebuild_daily_adherence,
+# which substitutes a source that also covers the archive tables
+REBUILD_DAILY_ADHERENCE = '''
+    INSERT INTO daily_adherence (date, medication_id, taken, missed, delayed, total)
+    SELECT date, medication_id,
+           SUM(status = 'Taken'), SUM(status = 'Missed'), SUM(status = 'Delayed'), COUNT(*)
+    FROM {source}
+    GROUP BY date, medication_id
+'''
+
+
+# Rollup triggers on schedule_log, also recreated when log_storage rebuilds the
+# table. {date_column} is the stored date column (`date`, or `day` in integer mode).
+SCHEDULE_LOG_ROLLUP_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_schedule_log_rollup_insert
+    AFTER INSERT ON schedule_log
+    BEGIN
+        INSERT INTO daily_adherence (date, medication_id, taken, missed, delayed, total)
+        VALUES (NEW.date, NEW.medication_id,
+                NEW.status = 'Taken', NEW.status = 'Missed', NEW.status = 'Delayed', 1)
+        ON CONFLICT (date, medication_id) DO UPDATE SET
+            taken = taken + excluded.taken,
+            missed = missed + excluded.missed,
+            delayed = delayed + excluded.delayed,
+            total = total + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_schedule_log_rollup_update
+    AFTER UPDATE OF status, {date_column}, medication_id ON schedule_log
+    BEGIN
+        UPDATE daily_adherence SET
+            taken = taken - (OLD.status = 'Taken'),
+            missed = missed - (OLD.status = 'Missed'),
+            delayed = delayed - (OLD.status = 'Delayed'),
+            total = total - 1
+        WHERE date = OLD.date AND medication_id = OLD.medication_id;
+
+        INSERT INTO daily_adherence (date, medication_id, taken, missed, delayed, total)
+        VALUES (NEW.date, NEW.medication_id,
+                NEW.status = 'Taken', NEW.status = 'Missed', NEW.status = 'Delayed', 1)
+        ON CONFLICT (date, medication_id) DO UPDATE SET
+            taken = taken + excluded.taken,
+            missed = missed + excluded.missed,
+            delayed = delayed + excluded.delayed,
+            total = total + 1;
+    END
+    ''',
+]
+
+
+@migration(5, "Add daily_adherence rollup")
+def _add_daily_adherence(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_adherence (
+            date TEXT NOT NULL,
+            medication_id INTEGER NOT NULL,
+            taken INTEGER NOT NULL DEFAULT 0,
+            missed INTEGER NOT NULL DEFAULT 0,
+            delayed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, medication_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_adherence_medication
+        ON daily_adherence (medication_id, date)
+    ''')
+
+    # The triggers keep the rollup in the same transaction as every dose write.
+    # Deletes are deliberately not tracked: removing a medication clears its
+    # rollup rows explicitly, and archived log rows must keep their counts.
+    for sql in SCHEDULE_LOG_ROLLUP_TRIGGERS:
+        conn.execute(sql.format(date_column='date'))
+
+    conn.execute('DELETE FROM daily_adherence')
+    conn.execute(REBUILD_DAILY_ADHERENCE.format(source='schedule_log'))
+
+
+@migration(6, "Add dose_times table")
+def _add_dose_times(conn):
+    # One row per scheduled dose, as minutes after midnight, so the scheduler
+    # can look up due doses by index instead of parsing medications.times
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dose_times (
+            medication_id INTEGER NOT NULL,
+            minute_of_day INTEGER NOT NULL CHECK (minute_of_day BETWEEN 0 AND 1439),
+            PRIMARY KEY (medication_id, minute_of_day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dose_times_minute
+        ON dose_times (minute_of_day, medication_id)
+    ''')
+
+    rows = []
+    for medication_id, times in conn.execute('SELECT id, times FROM medications'):
+        for time_str in times.split(','):
+            minute = parse_minute_of_day(time_str)
+            if minute is not None:
+                rows.append((medication_id, minute))
+
+    conn.executemany('INSERT OR IGNORE INTO dose_times (medication_id, minute_of_day) VALUES (?, ?)', rows)
+
+
+@migration(7, "Add log_archives registry")
+def _add_log_archives(conn):
+    # One row per monthly schedule_log archive table (see archive.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_archives (
+            month TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL UNIQUE,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+@migration(8, "Add schedule_changes queue")
+def _add_schedule_changes(conn):
+    # Medication changes made by processes that don't run the scheduler;
+    # the scheduler service picks them up (NULL medication_id = reload all)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medication_id INTEGER,
+            requested_at TEXT NOT NULL
+        )
+    ''')
+
+
+@migration(9, "Add scheduler_state table")
+def _add_scheduler_state(conn):
+    # Small key/value store for scheduler bookkeeping, e.g. the missed-dose
+    # catch-up watermark ('YYYY-MM-DD HH:MM' of the last processed dose)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+@migration(10, "Add dose_instances table")
+def _add_dose_instances(conn):
+    # One row per dose per day for today and the look-ahead window (see
+    # dose_instances.py); filled in by init_database and the midnight job
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dose_instances (
+            medication_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            minute_of_day INTEGER NOT NULL,
+            due_at TEXT NOT NULL,
+            status TEXT,
+            alert_state TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (medication_id, date, minute_of_day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dose_instances_due
+        ON dose_instances (due_at, status)
+    ''')
+
+
+@migration(11, "Add dose_instances leases")
+def _add_dose_instance_leases(conn):
+    # Sharded dose workers (dose_worker.py) lease due instances before
+    # handling them; an expired lease can be taken over by another worker
+    columns = _column_names(conn, 'dose_instances')
+    for column in ('leased_by', 'lease_expires_at'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE dose_instances ADD COLUMN {column} TEXT')
+
+    # Past doses nobody is waiting on an alert for; the watermark catch-up
+    # already covers downtime before this migration
+    conn.execute('''
+        UPDATE dose_instances SET alert_state = 'alerted'
+        WHERE status IS NULL AND due_at < ?
+    ''', (clock.now().strftime('%Y-%m-%d %H:%M'),))
+
+    # Open work: only unlogged, unalerted instances, so the claim queries
+    # never walk the taken history
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dose_instances_open
+        ON dose_instances (due_at) WHERE status IS NULL AND alert_state != 'alerted'
+    ''')
+
+
+# Bumps scheduler_state['stock_version'] on every change the stock forecast
+# reads (stock_forecast.py caches on it): stock, schedules and Taken counts
+BUMP_STOCK_VERSION = '''
+    INSERT INTO scheduler_state (key, value) VALUES ('stock_version', 1)
+    ON CONFLICT (key) DO UPDATE SET value = value + 1;
+'''
+
+STOCK_VERSION_TRIGGERS = {
+    'trg_stock_medication_insert': 'AFTER INSERT ON medications',
+    'trg_stock_medication_delete': 'AFTER DELETE ON medications',
+    'trg_stock_medication_update': '''AFTER UPDATE OF remaining_count, frequency ON medications
+        WHEN NEW.remaining_count IS NOT OLD.remaining_count OR NEW.frequency IS NOT OLD.frequency''',
+    'trg_stock_dose_times_insert': 'AFTER INSERT ON dose_times',
+    'trg_stock_dose_times_delete': 'AFTER DELETE ON dose_times',
+    'trg_stock_taken_insert': 'AFTER INSERT ON daily_adherence WHEN NEW.taken > 0',
+    'trg_stock_taken_update': 'AFTER UPDATE OF taken ON daily_adherence WHEN NEW.taken != OLD.taken',
+    'trg_stock_taken_delete': 'AFTER DELETE ON daily_adherence WHEN OLD.taken > 0',
+}
+
+
+@migration(12, "Add stock forecast version triggers")
+def _add_stock_version_triggers(conn):
+    for name, event in STOCK_VERSION_TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {BUMP_STOCK_VERSION} END')
+
+
+@migration(13, "Add outbox")
+def _add_outbox(conn):
+    # Guardian messages wait here until outbox_worker.py delivers them;
+    # idempotency_key makes enqueueing the same alert twice a no-op
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'dead')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+    ''')
+    # Only undelivered messages, so claims never walk the sent history
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON outbox (next_attempt_at) WHERE status = 'pending'
+    ''')
+
+
+@migration(14, "Add outbox payloads and rate limits")
+def _add_outbox_rate_limits(conn):
+    # JSON fields a message was rendered from, so several can be merged into one digest
+    if 'payload' not in _column_names(conn, 'outbox'):
+        conn.execute('ALTER TABLE outbox ADD COLUMN payload TEXT')
+    # One token bucket per recipient, keyed "<channel>:<recipient>" (see outbox.take_tokens)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_rate_limits (
+            recipient TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(15, "Add outbox channels")
+def _add_outbox_channels(conn):
+    # Which notification channel (channels.py) delivers the message
+    if 'channel' not in _column_names(conn, 'outbox'):
+        conn.execute("ALTER TABLE outbox ADD COLUMN channel TEXT NOT NULL DEFAULT 'whatsapp'")
+
+
+@migration(16, "Add guardian message locale")
+def _add_guardian_locale(conn):
+    # Language and time format of the guardian's messages (templates.py); NULL means the default
+    columns = _column_names(conn, 'guardian')
+    if 'locale' not in columns:
+        conn.execute('ALTER TABLE guardian ADD COLUMN locale TEXT')
+    if 'time_format' not in columns:
+        conn.execute('ALTER TABLE guardian ADD COLUMN time_format TEXT')
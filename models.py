@@ -0,0 +1,181 @@
+"""Compact record types for rows read from the DoseBuddy database.
+
+A record is a tuple of the columns a query selected, read by name
+(``med.remaining_count`` instead of ``med[6]``), so a row costs no more
+than a plain tuple. ``row_factory`` builds a record from whatever columns
+a query selected (matched by column name): each distinct column list gets
+its own subclass, created once, whose fields are ``itemgetter``
+properties, and a row is then one ``tuple.__new__`` call. Fields the query
+did not select read as ``None``. ``fetch_all`` skips the row factory and
+converts a whole result set with one ``map``, which keeps large listings
+as cheap to build as plain tuples.
+"""
+from functools import partial
+from operator import itemgetter
+
+def parse_minute_of_day(time_str):
+    """Convert 'HH:MM' to minutes after midnight, or None if it isn't a valid time"""
+    try:
+        hour, minute = (int(part) for part in time_str.strip().split(':'))
+    except (AttributeError, ValueError):
+        return None
+
+    if 0 <= hour < 24 and 0 <= minute < 60:
+        return hour * 60 + minute
+    return None
+
+
+def format_minute_of_day(minute_of_day):
+    """Convert minutes after midnight back to 'HH:MM'"""
+    return f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+
+_row_types = {}
+
+
+class Record(tuple):
+    """Base class for row records; subclasses list every known column in `fields`"""
+
+    __slots__ = ()
+    fields = ()
+    # (cursor.description, row type) of the last query, so a fetch resolves its type once
+    _last_description = (None, None)
+
+    def __new__(cls, **values):
+        return tuple.__new__(cls.row_type(tuple(values)), values.values())
+
+    @classmethod
+    def row_type(cls, columns):
+        """The subclass of cls holding exactly `columns`, in that order"""
+        key = (cls, columns)
+        row_type = _row_types.get(key)
+        if row_type is None:
+            unknown = [name for name in columns if name not in cls.fields]
+            if unknown:
+                raise AttributeError(f"{cls.__name__} has no field '{unknown[0]}'")
+            namespace = {'__slots__': (), '_record_type': cls}
+            namespace.update((name, property(itemgetter(i))) for i, name in enumerate(columns))
+            row_type = _row_types.setdefault(key, type(cls.__name__, (cls,), namespace))
+        return row_type
+
+    def __getattr__(self, name):
+        # Only called for fields the query never selected
+        if name in type(self).fields:
+            return None
+        raise AttributeError(f"{type(self).__name__} has no field '{name}'")
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """sqlite3 row factory: build a record from the selected columns"""
+        description, row_type = cls._last_description
+        if description is not cursor.description:
+            description = cursor.description
+            row_type = cls.row_type(tuple(column[0] for column in description))
+            cls._last_description = (description, row_type)
+        return tuple.__new__(row_type, row)
+
+    @classmethod
+    def fetch_all(cls, cursor):
+        """Every remaining row of an executed cursor (with no row factory) as records"""
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+        row_type = cls.row_type(tuple(column[0] for column in cursor.description))
+        return list(map(partial(tuple.__new__, row_type), rows))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+    def __eq__(self, other):
+        return (isinstance(other, Record) and self._record_type is other._record_type
+                and self.to_dict() == other.to_dict())
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.fields
+                           if getattr(self, name) is not None)
+        return f"{type(self).__name__}({fields})"
+
+
+class Medication(Record):
+    """Row of the medications table"""
+
+    __slots__ = ()
+    fields = ('id', 'name', 'dosage', 'frequency', 'times', 'total_count',
+                 'remaining_count', 'added_date', 'med_type')
+
+    @property
+    def times_list(self):
+        """Scheduled 'HH:MM' times as a list"""
+        return [t.strip() for t in self.times.split(',')] if self.times else []
+
+
+class DoseLog(Record):
+    """Row of schedule_log, optionally joined with its medication's name and dosage"""
+
+    __slots__ = ()
+    fields = ('id', 'medication_id', 'scheduled_time', 'actual_time', 'status', 'date',
+                 'medication_name', 'dosage')
+
+
+class DoseTime(Record):
+    """Row of dose_times joined with its medication; date is set for dated occurrences"""
+
+    __slots__ = ()
+    fields = ('medication_id', 'minute_of_day', 'date', 'name', 'dosage')
+
+    @property
+    def scheduled_time(self):
+        """'HH:MM' form used in schedule_log and notifications"""
+        return format_minute_of_day(self.minute_of_day)
+
+
+class DoseInstance(Record):
+    """Row of dose_instances, optionally joined with its medication's name and dosage"""
+
+    __slots__ = ()
+    fields = ('medication_id', 'date', 'minute_of_day', 'due_at', 'status', 'alert_state', 'name', 'dosage')
+
+    @property
+    def scheduled_time(self):
+        return format_minute_of_day(self.minute_of_day)
+
+    @property
+    def key(self):
+        """(medication_id, date, minute_of_day), the dose_instances primary key"""
+        return (self.medication_id, self.date, self.minute_of_day)
+
+
+class Guardian(Record):
+    """Row of the guardian table"""
+
+    __slots__ = ()
+    fields = ('id', 'patient_name', 'guardian_name', 'guardian_phone',
+                 'whatsapp_enabled', 'email', 'locale', 'time_format', 'added_date')
+
+    @property
+    def alerts_enabled(self):
+        return self.whatsapp_enabled == 1
+
+
+class Prescription(Record):
+    """Row of prescriptions, joined with its medication's name and dosage"""
+
+    __slots__ = ()
+    fields = ('id', 'medication_id', 'image_path', 'upload_date', 'medication_name', 'dosage')
+
+
+class StockForecast(Record):
+    """Days-until-empty forecast for one medication (see stock_forecast.py)"""
+
+    __slots__ = ()
+    fields = ('medication_id', 'name', 'dosage', 'remaining_count', 'daily_use', 'days_left')
+
+
+class OutboxMessage(Record):
+    """Row of the outbox table (see outbox.py)"""
+
+    __slots__ = ()
+    fields = ('id', 'idempotency_key', 'channel', 'kind', 'recipient', 'body', 'payload', 'status',
+                 'attempts', 'next_attempt_at', 'last_error', 'created_at', 'sent_at')
@@ -0,0 +1,236 @@
+"""Background delivery of desktop and WhatsApp notifications.
+
+The scheduler decides *what* to send; this module sends it, so a slow
+Twilio request no longer holds up the next dose check or daily job. Each
+channel has its own bounded queue and a fixed number of delivery threads
+(its concurrency limit), which run the calls themselves. One watchdog
+thread per channel fails a delivery that runs past the channel's timeout
+with TimeoutError and hands its slot to a fresh delivery thread; the stuck
+thread exits once its call returns (the transports carry their own
+network timeouts). At most `concurrency` such threads are left behind per
+channel; past that, a timed-out call keeps its slot. ``metrics()`` reports
+queue lag (time from submit to start of delivery) per channel, so
+detection latency and delivery latency can be watched separately.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import config
+from latency import LatencyStats
+
+
+class NotificationQueueFull(Exception):
+    """A channel's queue is full; the notification was dropped"""
+
+
+class _Channel:
+    """Bounded queue plus `concurrency` delivery threads and a timeout watchdog for one channel"""
+
+    def __init__(self, name, concurrency, timeout, queue_size):
+        self.name = name
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = LatencyStats()
+        self.timeouts = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending = {}          # id(future) -> enqueued time, for the oldest-waiting lag
+        self._running = {}          # delivery thread -> (future, started) of its current call
+        self._abandoned = set()     # threads whose call timed out and whose slot was handed on
+        self._in_flight = 0
+        self._threads = []
+        self._stop = threading.Event()
+
+        for _ in range(concurrency):
+            self._start_worker()
+        self._watchdog = threading.Thread(target=self._watch, name=f'dosebuddy-notify-{name}-watchdog',
+                                          daemon=True)
+        self._watchdog.start()
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._worker, name=f'dosebuddy-notify-{self.name}', daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def put(self, future, func, args, kwargs):
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._pending[id(future)] = enqueued
+        try:
+            self.queue.put_nowait((future, func, args, kwargs, enqueued))
+        except queue.Full:
+            with self._lock:
+                del self._pending[id(future)]
+                self.dropped += 1
+            future.set_exception(NotificationQueueFull(f"{self.name} queue is full"))
+
+    def _deliver(self, future, func, args, kwargs, enqueued):
+        """Run one call on this thread; returns False if it timed out and the slot was handed on"""
+        thread = threading.current_thread()
+        started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+            self._running[thread] = (future, started)
+
+        error = None
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            error = e
+
+        # Record before resolving, so a caller that waited on the future sees it in metrics()
+        self.stats.record(started - enqueued, time.perf_counter() - started, error is not None)
+        with self._lock:
+            abandoned = thread in self._abandoned
+            if abandoned:
+                # The watchdog already failed the future and released the slot
+                self._abandoned.discard(thread)
+                return False
+            del self._running[thread]
+            self._in_flight -= 1
+
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        return True
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            with self._lock:
+                self._pending.pop(id(item[0]), None)
+            if item[0].set_running_or_notify_cancel() and not self._deliver(*item):
+                break
+
+    def _watch(self):
+        """Fail deliveries that run past the timeout and hand their slots to new threads"""
+        wait = self.timeout
+        while not self._stop.wait(wait):
+            now = time.perf_counter()
+            expired = []
+            with self._lock:
+                for thread, (future, started) in list(self._running.items()):
+                    if now - started < self.timeout or future.done():
+                        continue
+                    self.timeouts += 1
+                    expired.append(future)
+                    if len(self._abandoned) < self.concurrency:
+                        del self._running[thread]
+                        self._abandoned.add(thread)
+                        self._threads.remove(thread)
+                        self._in_flight -= 1
+                        if not self._stop.is_set():
+                            self._start_worker()
+                deadlines = [started + self.timeout for future, started in self._running.values()
+                             if not future.done()]
+            wait = max(min(deadlines, default=now + self.timeout) - now, 0.005)
+
+            for future in expired:
+                future.set_exception(TimeoutError(f"{self.name} notification took over {self.timeout:g}s"))
+
+    def metrics(self):
+        now = time.perf_counter()
+        with self._lock:
+            oldest = min(self._pending.values(), default=now)
+            snapshot = {
+                'queue_depth': self.queue.qsize(),
+                'in_flight': self._in_flight,
+                'hung': len(self._abandoned),
+                'oldest_wait_ms': (now - oldest) * 1000,
+                'timeouts': self.timeouts,
+                'dropped': self.dropped,
+            }
+        snapshot.update(self.stats.snapshot())
+        return snapshot
+
+    def close(self):
+        for _ in range(self.concurrency):
+            self.queue.put(None)
+        # The watchdog may swap threads meanwhile; abandoned ones are not waited for
+        while True:
+            with self._lock:
+                alive = [thread for thread in self._threads if thread.is_alive()]
+            if not alive:
+                break
+            alive[0].join(0.1)
+        self._stop.set()
+        self._watchdog.join()
+
+
+class NotificationDispatcher:
+    """Per-channel delivery queues; channels maps name -> (concurrency, timeout seconds, queue size)"""
+
+    def __init__(self, channels=None):
+        channels = config.NOTIFICATION_CHANNELS if channels is None else channels
+        self._channels = {name: _Channel(name, *settings) for name, settings in channels.items()}
+        self._closed = False
+
+    def submit(self, channel, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) on a channel and return a concurrent.futures.Future
+
+        A full queue fails the future with NotificationQueueFull instead of blocking.
+        """
+        if self._closed:
+            raise RuntimeError("NotificationDispatcher is closed")
+        if channel not in self._channels:
+            raise ValueError(f"Unknown notification channel '{channel}'")
+
+        future = Future()
+        self._channels[channel].put(future, func, args, kwargs)
+        return future
+
+    def metrics(self):
+        """Queue lag, delivery time, timeouts and drops for every channel"""
+        return {name: channel.metrics() for name, channel in self._channels.items()}
+
+    def close(self):
+        """Deliver everything queued, then stop the delivery threads"""
+        if self._closed:
+            return
+        self._closed = True
+        for channel in self._channels.values():
+            channel.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide NotificationDispatcher, starting it on first use"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = NotificationDispatcher()
+    return _dispatcher
+
+
+def set_dispatcher(dispatcher):
+    """Replace the process-wide dispatcher (the replay harness records instead of sending); returns the old one"""
+    global _dispatcher
+    with _dispatcher_lock:
+        previous, _dispatcher = _dispatcher, dispatcher
+    return previous
+
+
+def close_dispatcher():
+    """Stop the process-wide NotificationDispatcher (used by tests and on shutdown)"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.close()
+            _dispatcher = None
+
+
+def get_dispatcher_metrics():
+    """metrics() of the process-wide dispatcher, or {} if nothing was sent yet"""
+    dispatcher = _dispatcher
+    return dispatcher.metrics() if dispatcher is not None else {}
@@ -0,0 +1,204 @@
+"""Durable outbox for guardian messages.
+
+The scheduler no longer calls Twilio itself: it renders each alert and
+enqueues it here, in the same SQLite database as everything else, once
+per guardian channel (WhatsApp by default, see channels.py), and
+outbox_worker.py delivers it. A message moves through::
+
+    pending -> sent
+            -> dead     (after config.OUTBOX_MAX_ATTEMPTS failures, or a
+                         permanent error such as an invalid number)
+
+Every message carries an idempotency key naming what it is about, e.g.
+``missed_dose:3:2025-06-01:540``; enqueueing the same key again is a
+no-op, so a job that runs twice (a restart, a second process, the catch-up
+overlapping the live check) never alerts the guardian twice. A failed
+attempt is retried after an exponential backoff; a worker claims a
+message by pushing its next_attempt_at out by a lease, so a worker that
+dies mid-send leaves the message to be retried once the lease runs out.
+Claims use UPDATE ... FROM ... RETURNING, which needs SQLite 3.35 or newer.
+
+Each recipient also has a token bucket per channel (outbox_rate_limits,
+keyed '<channel>:<recipient>'): a guardian gets at most ``burst`` messages
+at once and ``per_hour`` after that. Messages over the limit are deferred
+to the next token, where the worker can merge them into one digest (see
+outbox_worker.py).
+"""
+import json
+from datetime import datetime, timedelta
+
+from models import OutboxMessage
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+OUTBOX_STATUSES = (OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_DEAD)
+
+# Timestamps are 'YYYY-MM-DD HH:MM:SS', so they sort and compare as text
+OUTBOX_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+OUTBOX_COLUMNS = '''
+    id, idempotency_key, channel, kind, recipient, body, payload, status, attempts, next_attempt_at,
+    last_error, created_at, sent_at
+'''
+
+# Lease up to `limit` pending messages that are due, oldest first. The
+# subquery walks idx_outbox_due and the single statement makes the claim
+# atomic between workers.
+CLAIM_OUTBOX = f'''
+    UPDATE outbox
+    SET next_attempt_at = ?
+    FROM (
+        SELECT id FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+    ) AS claimed
+    WHERE outbox.id = claimed.id
+    RETURNING {OUTBOX_COLUMNS}
+'''
+
+
+def _format(moment):
+    return moment.strftime(OUTBOX_TIME_FORMAT)
+
+
+def enqueue(conn, messages, now, delay=timedelta(0)):
+    """Queue (idempotency_key, kind, recipient, body[, payload[, channel]]) messages for delivery after `delay`
+
+    payload is an optional dict of the fields the body was rendered from,
+    stored as JSON for digests; channel defaults to 'whatsapp'. Keys
+    already in the outbox, in any state, are skipped. Returns the number
+    of messages added.
+    """
+    rows = []
+    for key, kind, recipient, body, *extra in messages:
+        payload, channel = (extra + [None, None])[:2]
+        payload = json.dumps(payload) if payload is not None else None
+        rows.append((key, channel or 'whatsapp', kind, recipient, body, payload, _format(now + delay),
+                     _format(now)))
+
+    cursor = conn.executemany('''
+        INSERT INTO outbox (idempotency_key, channel, kind, recipient, body, payload, next_attempt_at,
+                            created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (idempotency_key) DO NOTHING
+    ''', rows)
+    return cursor.rowcount
+
+
+def claim_due(conn, now, lease, limit):
+    """Lease up to `limit` due messages until now + lease; returns OutboxMessage records in queue order"""
+    messages = OutboxMessage.fetch_all(conn.execute(CLAIM_OUTBOX, (_format(now + lease), _format(now), limit)))
+    return sorted(messages, key=lambda message: message.id)
+
+
+def next_attempt_at(conn):
+    """When the next pending message is due (a datetime), or None if nothing is pending"""
+    due = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+    return datetime.strptime(due, OUTBOX_TIME_FORMAT) if due else None
+
+
+def defer(conn, message_ids, until):
+    """Release claimed messages without counting an attempt; they are due again at `until`"""
+    conn.executemany('UPDATE outbox SET next_attempt_at = ? WHERE id = ?',
+                     [(_format(until), message_id) for message_id in message_ids])
+
+
+def take_tokens(conn, recipient, wanted, now, burst, per_hour):
+    """Take up to `wanted` send tokens from a recipient's bucket
+
+    The bucket holds at most `burst` tokens and refills at `per_hour`
+    (which must be above 0).
+    Returns (granted, next_token_at): how many sends may go now, and when
+    the bucket next holds a whole token.
+    """
+    row = conn.execute('SELECT tokens, updated_at FROM outbox_rate_limits WHERE recipient = ?',
+                       (recipient,)).fetchone()
+    if row is None:
+        tokens = burst
+    else:
+        elapsed = max(0.0, (now - datetime.strptime(row[1], OUTBOX_TIME_FORMAT)).total_seconds())
+        tokens = min(burst, row[0] + elapsed * per_hour / 3600)
+
+    granted = min(wanted, int(tokens))
+    tokens -= granted
+    conn.execute('''
+        INSERT INTO outbox_rate_limits (recipient, tokens, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (recipient) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+    ''', (recipient, tokens, _format(now)))
+
+    # Whole seconds, so the deferral never lands just before the token does
+    wait = 0 if tokens >= 1 else -(-(1 - tokens) * 3600 // per_hour)
+    return granted, now + timedelta(seconds=wait)
+
+
+def backoff_seconds(attempts, base_seconds, max_seconds):
+    """Delay before the retry that follows `attempts` failed attempts"""
+    return min(max_seconds, base_seconds * 2 ** max(0, attempts - 1))
+
+
+def mark_sent(conn, message_ids, now):
+    """Record delivered messages"""
+    conn.executemany("UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                     [(_format(now), message_id) for message_id in message_ids])
+
+
+def mark_failed(conn, failures, now, max_attempts, base_seconds, max_seconds):
+    """Record failed attempts and schedule their retries
+
+    failures holds (message_id, attempts_so_far, error, permanent) tuples;
+    attempts_so_far is the count before this attempt. A message is
+    dead-lettered on a permanent error or once it has used max_attempts.
+    Returns the ids that were dead-lettered.
+    """
+    rows, dead = [], []
+    for message_id, attempts, error, permanent in failures:
+        attempts += 1
+        if permanent or attempts >= max_attempts:
+            status = OUTBOX_DEAD
+            dead.append(message_id)
+        else:
+            status = OUTBOX_PENDING
+        retry_at = now + timedelta(seconds=backoff_seconds(attempts, base_seconds, max_seconds))
+        rows.append((status, attempts, _format(retry_at), str(error)[:500], message_id))
+
+    conn.executemany('''
+        UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+        WHERE id = ?
+    ''', rows)
+    return dead
+
+
+def outbox_counts(conn):
+    """Messages per status (every status present), plus the oldest pending message's due time"""
+    counts = dict.fromkeys(OUTBOX_STATUSES, 0)
+    counts.update(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+    counts['oldest_pending_at'] = conn.execute(
+        "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+    return counts
+
+
+def requeue_dead(conn, now, message_ids=None):
+    """Give dead-lettered messages (all, or just message_ids) a fresh set of attempts; returns how many"""
+    sql = '''
+        UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?
+        WHERE status = 'dead'
+    '''
+    params = [_format(now)]
+    if message_ids is not None:
+        message_ids = list(message_ids)
+        sql += f" AND id IN ({', '.join('?' * len(message_ids))})"
+        params.extend(message_ids)
+    return conn.execute(sql, params).rowcount
+
+
+def prune_sent(conn, before):
+    """Delete messages delivered before the datetime `before`; returns how many
+
+    Their idempotency keys go with them, so keys only need to stay unique
+    for the retention period.
+    """
+    return conn.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?",
+                        (_format(before),)).rowcount
@@ -0,0 +1,273 @@
+"""Delivers the outbox (see outbox.py) to guardians.
+
+The worker claims a batch of due messages and turns them into deliveries:
+messages of a kind with a digest builder (missed-dose alerts) are merged
+into one message per recipient, everything else goes out as it is. Each
+recipient's token bucket then decides which deliveries go now; the rest
+are deferred to the recipient's next token, by which time more alerts may
+have joined them. Each delivery goes out on its message's channel (see
+channels.py): the channel's transport sends up to its batch_size
+deliveries per call, on the notification dispatcher's pool of the same
+name (so concurrency and timeouts are the dispatcher's), and every result
+is recorded in one transaction: sent, retry later with exponential
+backoff, or dead-lettered.
+
+The scheduler service runs one worker in the process that holds the
+scheduler lock; scheduler.py wakes it as soon as an alert is enqueued, and
+otherwise it sleeps until the next message is due (at most
+``config.OUTBOX_POLL_SECONDS``).
+"""
+import json
+import threading
+from datetime import timedelta
+
+import config
+from channels import Delivery, get_channel
+from clock import get_clock
+from db_pool import get_connection
+from notification_dispatch import get_dispatcher
+from outbox import claim_due, defer, mark_failed, mark_sent, next_attempt_at, take_tokens
+from templates import MissedDoses, markup_for, render
+
+
+def missed_dose_digest(messages):
+    """One alert listing several missed doses, rendered from their outbox payloads
+
+    Uses the locale and time format the alerts were written in, and the
+    markup of their channel.
+    """
+    payloads = [json.loads(message.payload) for message in messages]
+    digest = MissedDoses(payloads[0]['patient_name'],
+                         [(payload['medication_name'], payload['date'], payload['scheduled_time'])
+                          for payload in payloads])
+    return render('missed_doses', digest, payloads[0].get('locale'), payloads[0].get('time_format'),
+                  markup_for(messages[0].channel))
+
+
+# Message kinds that are merged per recipient, and how
+DIGESTS = {'missed_dose': missed_dose_digest}
+
+
+def is_permanent_error(error):
+    """True for errors a retry cannot fix, e.g. Twilio rejecting the number (HTTP 4xx)"""
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+class OutboxWorker:
+    """Claims due outbox messages and delivers them through the dispatcher
+
+    Deliveries go to the registered channels (channels.get_channel), or to
+    `channels`, a {name: Channel} dict, when given. `send`, a function
+    taking one delivery, replaces every channel's transport.
+    """
+
+    def __init__(self, send=None, dispatcher=None, clock=None, channels=None, batch_size=None,
+                 lease_seconds=None, poll_seconds=None, max_attempts=None, retry_base_seconds=None,
+                 retry_max_seconds=None, digests=None, rate_burst=None, rate_per_hour=None):
+        self.send = send
+        self.channels = channels
+        self.digests = DIGESTS if digests is None else digests
+        self.dispatcher = dispatcher
+        self.clock = clock or get_clock()
+        self.batch_size = config.OUTBOX_BATCH_SIZE if batch_size is None else batch_size
+        self.lease_seconds = config.OUTBOX_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.poll_seconds = config.OUTBOX_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.max_attempts = config.OUTBOX_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.retry_base_seconds = (config.OUTBOX_RETRY_BASE_SECONDS if retry_base_seconds is None
+                                   else retry_base_seconds)
+        self.retry_max_seconds = (config.OUTBOX_RETRY_MAX_SECONDS if retry_max_seconds is None
+                                  else retry_max_seconds)
+        self.rate_burst = config.OUTBOX_RATE_LIMIT_BURST if rate_burst is None else rate_burst
+        self.rate_per_hour = config.OUTBOX_RATE_LIMIT_PER_HOUR if rate_per_hour is None else rate_per_hour
+        if self.rate_burst < 1 or self.rate_per_hour <= 0:
+            # take_tokens divides by the refill rate, and an empty bucket would never send
+            raise ValueError("The outbox rate limit needs a burst of at least 1 and a refill rate above 0")
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _deliveries(self, messages):
+        """Merge digestible messages per (channel, recipient, kind); returns deliveries in queue order"""
+        deliveries, groups = [], {}
+        for message in messages:
+            if message.kind in self.digests and message.payload:
+                groups.setdefault((message.channel, message.recipient, message.kind), []).append(message)
+            else:
+                deliveries.append(Delivery(message.channel, message.kind, message.recipient, message.body,
+                                           [message]))
+
+        for (channel, recipient, kind), group in groups.items():
+            body = group[0].body if len(group) == 1 else self.digests[kind](group)
+            deliveries.append(Delivery(channel, kind, recipient, body, group))
+
+        return sorted(deliveries, key=lambda delivery: delivery.messages[0].id)
+
+    def _rate_limit(self, conn, deliveries, now):
+        """Deliveries the recipients' buckets allow now; the others are deferred to the next token
+
+        Each channel has its own buckets, so a guardian on WhatsApp and SMS
+        gets the full allowance on both.
+        """
+        by_recipient = {}
+        for delivery in deliveries:
+            by_recipient.setdefault(f"{delivery.channel}:{delivery.recipient}", []).append(delivery)
+
+        allowed, deferred = [], 0
+        for bucket, pending in by_recipient.items():
+            granted, next_token_at = take_tokens(conn, bucket, len(pending), now,
+                                                 self.rate_burst, self.rate_per_hour)
+            allowed.extend(pending[:granted])
+            held = [message.id for delivery in pending[granted:] for message in delivery.messages]
+            defer(conn, held, next_token_at)
+            deferred += len(held)
+
+        return sorted(allowed, key=lambda delivery: delivery.messages[0].id), deferred
+
+    def _transport(self, name):
+        if self.channels is None:
+            return get_channel(name)
+        try:
+            return self.channels[name]
+        except KeyError:
+            raise ValueError(f"Unknown notification channel '{name}'") from None
+
+    def _submit(self, dispatcher, deliveries):
+        """Hand deliveries to the dispatcher, batched per channel; returns (batch, future or error) pairs"""
+        by_channel = {}
+        for delivery in deliveries:
+            by_channel.setdefault(delivery.channel, []).append(delivery)
+
+        jobs = []
+        for name, pending in by_channel.items():
+            try:
+                if self.send is not None:
+                    jobs.extend(([delivery], dispatcher.submit(name, self.send, delivery=delivery))
+                                for delivery in pending)
+                    continue
+                transport = self._transport(name)
+                size = max(1, transport.batch_size)
+                for start in range(0, len(pending), size):
+                    batch = pending[start:start + size]
+                    jobs.append((batch, dispatcher.submit(name, transport.send_batch, deliveries=batch)))
+            except ValueError as e:
+                # A channel with no transport or dispatcher pool; retried, so
+                # configuring it before the attempts run out still delivers
+                jobs.append((pending, e))
+        return jobs
+
+    @staticmethod
+    def _errors(batch, job):
+        """One entry per delivery in the batch: None if it was sent, else the exception"""
+        if isinstance(job, Exception):
+            return [job] * len(batch)
+        try:
+            result = job.result()
+        except Exception as e:
+            # A timed-out send may still have got through; retrying risks a
+            # duplicate, which beats a guardian who never hears about a dose
+            return [e] * len(batch)
+        return result if len(batch) > 1 or isinstance(result, list) else [None]
+
+    def run_once(self):
+        """Deliver one batch of due messages; returns {'sent', 'retrying', 'dead', 'deferred'} message counts"""
+        counts = {'sent': 0, 'retrying': 0, 'dead': 0, 'deferred': 0}
+        now = self.clock.now()
+        with get_connection() as conn:
+            messages = claim_due(conn, now, timedelta(seconds=self.lease_seconds), self.batch_size)
+            if not messages:
+                return counts
+            deliveries, counts['deferred'] = self._rate_limit(conn, self._deliveries(messages), now)
+
+        dispatcher = self.dispatcher or get_dispatcher()
+        sent, failures = [], []
+        for batch, job in self._submit(dispatcher, deliveries):
+            for delivery, error in zip(batch, self._errors(batch, job)):
+                if error is None:
+                    sent.extend(message.id for message in delivery.messages)
+                else:
+                    failures.extend((message.id, message.attempts, error, is_permanent_error(error))
+                                    for message in delivery.messages)
+
+        with get_connection() as conn:
+            mark_sent(conn, sent, self.clock.now())
+            dead = mark_failed(conn, failures, self.clock.now(), self.max_attempts,
+                               self.retry_base_seconds, self.retry_max_seconds)
+
+        for message_id, _, error, _ in failures:
+            if message_id in dead:
+                print(f"☠️ Outbox message {message_id} dead-lettered: {error}")
+            else:
+                print(f"🔁 Outbox message {message_id} failed, will retry: {error}")
+
+        counts.update(sent=len(sent), retrying=len(failures) - len(dead), dead=len(dead))
+        return counts
+
+    def drain(self):
+        """Deliver batches until nothing is due; returns the summed counts"""
+        totals = {'sent': 0, 'retrying': 0, 'dead': 0, 'deferred': 0}
+        while True:
+            counts = self.run_once()
+            for name, count in counts.items():
+                totals[name] += count
+            if sum(counts.values()) < self.batch_size:
+                return totals
+
+    def next_due(self):
+        """When the next pending message is due, or None"""
+        with get_connection() as conn:
+            return next_attempt_at(conn)
+
+    def _seconds_to_next_due(self):
+        due = self.next_due()
+        if due is None:
+            return self.poll_seconds
+        return min(self.poll_seconds, max(0.0, (due - self.clock.now()).total_seconds()))
+
+    def wake(self):
+        """Deliver now instead of at the next poll (called after an enqueue)"""
+        self._wake.set()
+
+    # ----- background thread -----
+
+    def _loop(self):
+        while not self._stop.is_set():
+            # Cleared before draining, so a wake during the drain isn't lost
+            self._wake.clear()
+            try:
+                self.drain()
+                timeout = self._seconds_to_next_due()
+            except Exception as e:
+                print(f"❌ Outbox worker error: {e}")
+                timeout = self.poll_seconds
+            self._wake.wait(timeout)
+
+    def start(self):
+        """Deliver in a background thread until stop()"""
+        global _active_worker
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='dosebuddy-outbox', daemon=True)
+        self._thread.start()
+        _active_worker = self
+        return self
+
+    def stop(self, timeout=5):
+        global _active_worker
+        if _active_worker is self:
+            _active_worker = None
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_active_worker = None
+
+
+def wake_outbox_worker():
+    """Wake this process's running outbox worker, if there is one"""
+    worker = _active_worker
+    if worker is not None:
+        worker.wake()
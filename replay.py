@@ -0,0 +1,260 @@
+"""Replay harness: run the scheduler's jobs through weeks of simulated time.
+
+A SimulatedClock becomes the process-wide clock, notifications are
+recorded instead of sent, and the real EventScheduler from
+scheduler.create_event_scheduler is stepped from event to event against a
+scratch database. A simulated patient takes each reminded dose with
+probability ``take_rate`` (and uses up a tablet), so missed-dose alerts,
+refill alerts and daily summaries come out of the real jobs. Guardian
+messages go through the real outbox, drained by an OutboxWorker after
+every tick, with its coalescing window and rate limits; the clock also
+stops at every time the outbox has a message due. Each tick (one
+run_pending call plus the writes and outbox deliveries it caused) is
+measured for database queries and CPU time.
+
+Usage:
+    python replay.py                            # 4 weeks, 20 medications
+    python replay.py --days 56 --medications 200 --take-rate 0.7
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import clock
+import database
+import db_pool
+from async_db import get_async_database
+from notification_dispatch import set_dispatcher
+from outbox_worker import OutboxWorker
+
+# Notifications whose latency is measured against the dose's due time, by
+# sender (outbox deliveries are named after their message kind)
+DOSE_NOTIFICATIONS = {'_show_notification': 'reminder', 'missed_dose': 'missed alert'}
+
+
+class Notification:
+    """One recorded notification"""
+
+    __slots__ = ('channel', 'sender', 'kwargs', 'sent_at')
+
+    def __init__(self, channel, sender, kwargs, sent_at):
+        self.channel = channel
+        self.sender = sender
+        self.kwargs = kwargs
+        self.sent_at = sent_at
+
+
+class RecordingDispatcher:
+    """Stands in for NotificationDispatcher: records each notification at simulated time"""
+
+    def __init__(self, sim_clock):
+        self.clock = sim_clock
+        self.sent = []
+
+    def submit(self, channel, func, *args, **kwargs):
+        future = Future()
+        if 'deliveries' in kwargs:
+            # A channel batch (Channel.send_batch): one notification per delivery, all sent
+            for delivery in kwargs['deliveries']:
+                self.sent.append(Notification(channel, delivery.kind, {'delivery': delivery}, self.clock.now()))
+            future.set_result([None] * len(kwargs['deliveries']))
+            return future
+
+        sender = kwargs['delivery'].kind if 'delivery' in kwargs else func.__name__
+        self.sent.append(Notification(channel, sender, kwargs, self.clock.now()))
+        future.set_result(True)
+        return future
+
+    def metrics(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class QueryCounter:
+    """sqlite3 trace callback counting statements (trigger bodies excluded) while enabled"""
+
+    def __init__(self):
+        self.count = 0
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        if self.enabled and not sql.startswith('--'):
+            with self._lock:
+                self.count += 1
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _due_at(date, minute_of_day):
+    return datetime.fromisoformat(date) + timedelta(minutes=int(minute_of_day))
+
+
+def _outbox_due_ats(notification):
+    # Missed-dose keys end '...:<date>:<minute_of_day>' (the scheduler prefixes the channel); a
+    # digest covers several
+    for message in notification.kwargs['delivery'].messages:
+        _, date, minute = message.idempotency_key.rsplit(':', 2)
+        yield _due_at(date, minute)
+
+
+def _add_patient(medications, start):
+    """Guardian plus `medications` schedules of 1-3 doses a day, added the day before start"""
+    database.add_guardian("Replay Patient", "Replay Guardian", "+10000000000")
+    for i in range(medications):
+        first = 6 * 60 + (i * 37) % (4 * 60)
+        minutes = [first, first + 6 * 60, first + 12 * 60][:i % 3 + 1]
+        times = ",".join(f"{m // 60:02d}:{m % 60:02d}" for m in minutes)
+        database.add_medication_with_type(f"Med {i}", "10mg", len(minutes), times, 20 + i % 40, "Tablet")
+    database.refresh_dose_instances(start)
+
+
+def run_replay(days=28, medications=20, take_rate=0.8, seed=1, start=datetime(2025, 6, 2),
+               create_scheduler=None):
+    """Replay `days` days against the configured (scratch) database and return the measurements
+
+    create_scheduler() builds the EventScheduler; by default the app's own,
+    with every job. Returns a dict with the recorded notifications, the
+    latencies per dose notification kind and per-tick query/CPU samples.
+    """
+    if create_scheduler is None:
+        from scheduler import create_event_scheduler as create_scheduler
+
+    sim_clock = clock.SimulatedClock(start - timedelta(hours=12))
+    previous_clock = clock.set_clock(sim_clock)
+    dispatcher = RecordingDispatcher(sim_clock)
+    previous_dispatcher = set_dispatcher(dispatcher)
+    pool = db_pool.get_pool()
+    queries = QueryCounter()
+    rng = random.Random(seed)
+
+    try:
+        _add_patient(medications, start)
+        sim_clock.set(start)
+
+        scheduler = create_scheduler()
+        on_reminder = scheduler.on_reminder
+        latencies = {kind: [] for kind in DOSE_NOTIFICATIONS.values()}
+
+        def remind(doses):
+            # Match the reminders sent back to their doses' due times
+            first = len(dispatcher.sent)
+            on_reminder(doses)
+            due_by_name = {dose.name: _due_at(dose.date, dose.minute_of_day) for dose in doses}
+            for notification in dispatcher.sent[first:]:
+                due_at = due_by_name.get(notification.kwargs.get('med_name'))
+                if notification.sender == '_show_notification' and due_at:
+                    latencies['reminder'].append((notification.sent_at - due_at).total_seconds())
+
+            # The patient answers straight away, outside the measured queries
+            queries.enabled = False
+            try:
+                taken = [dose for dose in doses if rng.random() < take_rate]
+                if taken:
+                    database.log_medications_bulk(
+                        [(dose.medication_id, dose.scheduled_time, "Taken", dose.date) for dose in taken])
+                    remaining = {med.id: med.remaining_count for med in database.get_all_medications()}
+                    database.update_tablet_counts(
+                        [(dose.medication_id, max(0, remaining[dose.medication_id] - 1)) for dose in taken])
+            finally:
+                queries.enabled = True
+
+        scheduler.on_reminder = remind
+        scheduler.reload()
+        outbox = OutboxWorker(clock=sim_clock)
+
+        pool.trace = queries
+        end = start + timedelta(days=days)
+        ticks = []
+        wall_start = time.perf_counter()
+
+        while True:
+            due = min((when for when in (scheduler.next_due(), outbox.next_due()) if when is not None),
+                      default=None)
+            if due is None or due > end:
+                break
+            sim_clock.set(max(due, sim_clock.now()))
+
+            queries.count = 0
+            cpu_start = time.process_time()
+            first = len(dispatcher.sent)
+            fired = scheduler.run_pending()
+            # Queued async writes and the outbox deliveries they enqueued belong to this tick
+            get_async_database().flush()
+            outbox.drain()
+            ticks.append((fired, queries.count, time.process_time() - cpu_start))
+
+            for notification in dispatcher.sent[first:]:
+                if DOSE_NOTIFICATIONS.get(notification.sender) == 'missed alert':
+                    latencies['missed alert'].extend(
+                        (notification.sent_at - due_at).total_seconds() for due_at in _outbox_due_ats(notification))
+
+        wall = time.perf_counter() - wall_start
+    finally:
+        pool.trace = None
+        set_dispatcher(previous_dispatcher)
+        clock.set_clock(previous_clock)
+
+    return {
+        'days': days,
+        'medications': medications,
+        'wall_seconds': wall,
+        'notifications': dispatcher.sent,
+        'latencies': {kind: sorted(values) for kind, values in latencies.items()},
+        'ticks': ticks,
+    }
+
+
+def print_report(result):
+    """Print a run_replay result"""
+    ticks = result['ticks']
+    counts = {}
+    for notification in result['notifications']:
+        counts[notification.sender] = counts.get(notification.sender, 0) + 1
+
+    print(f"🎬 Replay: {result['days']} days, {result['medications']} medications, "
+          f"{len(ticks)} ticks in {result['wall_seconds']:.2f}s wall "
+          f"({result['days'] * 86400 / max(result['wall_seconds'], 1e-9):,.0f}x real time)")
+    for sender, count in sorted(counts.items()):
+        print(f"   {sender:<40} {count:>10} sent")
+
+    for kind, values in result['latencies'].items():
+        if values:
+            print(f"   {kind + ' latency p50/p95/p99/max':<40} "
+                  f"{percentile(values, 0.5):>6.0f} / {percentile(values, 0.95):.0f} / "
+                  f"{percentile(values, 0.99):.0f} / {values[-1]:.0f} s")
+
+    query_counts = sorted(queries for _, queries, _ in ticks)
+    cpu = sorted(seconds for _, _, seconds in ticks)
+    print(f"   {'queries per tick p50/p95/max':<40} {percentile(query_counts, 0.5):>6} / "
+          f"{percentile(query_counts, 0.95)} / {query_counts[-1] if query_counts else 0}")
+    print(f"   {'CPU per tick p50/p95/max':<40} {percentile(cpu, 0.5) * 1000:>6.2f} / "
+          f"{percentile(cpu, 0.95) * 1000:.2f} / {(cpu[-1] if cpu else 0) * 1000:.2f} ms")
+
+
+def main():
+    from benchmark import temp_database
+
+    parser = argparse.ArgumentParser(description="Replay the DoseBuddy scheduler through simulated weeks")
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--medications', type=int, default=20)
+    parser.add_argument('--take-rate', type=float, default=0.8, help="chance the patient takes a reminded dose")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with temp_database():
+        print_report(run_replay(args.days, args.medications, args.take_rate, args.seed))
+
+
+if __name__ == "__main__":
+    main()
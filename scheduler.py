@@ -1,149 +1,282 @@
-import schedule
-import time
-from threading import Thread
-from plyer import notification
-import sqlite3
 from datetime import datetime, timedelta
 
+import clock
+import config
+from channels import Delivery, get_channel
+from dose_instances import ALERT_ALERTED, ALERT_REMINDED
+from event_scheduler import EventScheduler
+from notification_dispatch import get_dispatcher
+from scheduler_service import get_scheduler_service, request_reload
 
-def send_notification(med_name, dosage):
-    """Send desktop notification for DoseBuddy"""
+
+def _show_notification(med_name, dosage):
+    """Show the desktop notification (blocking; runs on the dispatcher's desktop channel)"""
     try:
-        notification.notify(
-            title=f"💊 DoseBuddy Reminder: {med_name}",
-            message=f"Time to take {dosage}\nPlease confirm in the app!",
-            timeout=15,
-            app_name="DoseBuddy",
-            app_icon=None
-        )
-        print(f"✅ Notification sent: {med_name} at {datetime.now().strftime('%H:%M')}")
+        get_channel('desktop').send(Delivery(
+            'desktop', 'reminder', None,
+            f"💊 DoseBuddy Reminder: {med_name}\nTime to take {dosage}\nPlease confirm in the app!"
+        ))
+        print(f"✅ Notification sent: {med_name} at {clock.now().strftime('%H:%M')}")
     except Exception as e:
         print(f"❌ Notification error: {e}")
 
 
-def check_missed_medications():
-    """Check for missed medications and send INSTANT WhatsApp alerts after 1 minute"""
-    try:
-        from database import get_guardian_info, get_medication_by_id, log_medication_taken, check_medication_status
+def _dispatch(channel, label, func, **kwargs):
+    """Hand a notification to the dispatcher instead of sending it on the scheduler thread"""
+    def report_error(future):
+        if not future.cancelled() and future.exception():
+            print(f"❌ {label} error: {future.exception()}")
+
+    future = get_dispatcher().submit(channel, func, **kwargs)
+    future.add_done_callback(report_error)
+    return future
+
+
+def send_notification(med_name, dosage):
+    """Queue a desktop notification for DoseBuddy"""
+    _dispatch('desktop', "Notification", _show_notification, med_name=med_name, dosage=dosage)
+
+
+def _report_write_error(future):
+    """Done-callback for queued database writes"""
+    if future.exception():
+        print(f"❌ Error logging missed medications: {future.exception()}")
+
+
+def _instance_key(dose):
+    return (dose.medication_id, dose.date, dose.minute_of_day)
+
+
+def _outbox_key(kind, *parts):
+    """Idempotency key of a guardian message, e.g. 'missed_dose:3:2025-06-01:540'"""
+    return ":".join(str(part) for part in (kind, *parts))
+
+
+def _guardian_recipients(guardian):
+    """(channel, recipient) for each of config.GUARDIAN_CHANNELS the guardian can be reached on"""
+    recipients = []
+    for channel in config.GUARDIAN_CHANNELS:
+        recipient = guardian.email if channel == 'email' else guardian.guardian_phone
+        if recipient:
+            recipients.append((channel, recipient))
+        else:
+            print(f"⚠️ Guardian has no address for the {channel} channel")
+    return recipients
+
+
+def _enqueue_alerts(label, guardian, messages, alerted_doses=(), delay_seconds=0, missed_logs=(),
+                    low_stock_alerts=()):
+    """Queue guardian messages in the durable outbox, once per guardian channel; the outbox worker sends them
+
+    messages holds (idempotency_key, kind, payload) tuples, payload being
+    the templates.py record the message is rendered from. Each channel's
+    copy is rendered in the guardian's locale and time format with the
+    channel's markup, keeps its payload (for digests) and has its key
+    prefixed with the channel, e.g. 'whatsapp:missed_dose:3:2025-06-01:540'.
+    missed_logs are dose log entries and low_stock_alerts
+    (medication_id, date) alerts recorded in the same transaction.
+    The write is queued on the async writer, so the scheduler never waits
+    on it.
+    """
+    from async_db import get_async_database
+    from outbox_worker import wake_outbox_worker
+    from templates import markup_for, render
+    
+    def queued(future):
+        if future.exception():
+            print(f"❌ {label} error: {future.exception()}")
+        else:
+            wake_outbox_worker()
+    
+    style = {'locale': guardian.locale, 'time_format': guardian.time_format}
+    outbox_messages = []
+    for channel, recipient in _guardian_recipients(guardian):
+        markup = markup_for(channel)
+        for key, kind, payload in messages:
+            body = render(kind, payload, guardian.locale, guardian.time_format, markup)
+            outbox_messages.append((_outbox_key(channel, key), kind, recipient, body,
+                                    dict(payload.to_dict(), **style), channel))
+    future = get_async_database().submit('enqueue_outbox', outbox_messages, alerted_doses, delay_seconds,
+                                          missed_logs=missed_logs, low_stock_alerts=low_stock_alerts)
+    future.add_done_callback(queued)
+    return future
+
+
+def _due_instances(due_doses):
+    """Dose instances for a batch of due doses in one indexed lookup, keyed like _instance_key"""
+    from database import get_dose_instances_due
+    
+    instances = get_dose_instances_due(f"{dose.date} {dose.scheduled_time}" for dose in due_doses)
+    return {instance.key: instance for instance in instances}
+
+
+def send_reminders(due_doses):
+    """Desktop reminders for doses whose scheduled time has come
+
+    Doses already logged (e.g. taken early from the app) are skipped.
+    Returns the queued database writes; the dose workers wait on them
+    before completing their leases.
+    """
+    from async_db import get_async_database
+    
+    instances = _due_instances(due_doses)
+    reminded = []
+    
+    for dose in due_doses:
+        instance = instances.get(_instance_key(dose))
+        if instance is not None and instance.status is not None:
+            continue
         
-        conn = sqlite3.connect('data/dosebuddy.db')
-        cursor = conn.execute('SELECT id, name, dosage, times FROM medications')
-        medications = cursor.fetchall()
-        conn.close()
+        send_notification(dose.name, dose.dosage)
+        if instance is not None:
+            reminded.append(instance.key)
+    
+    writes = []
+    if reminded:
+        write = get_async_database().submit('set_dose_instances_alert_state', reminded, ALERT_REMINDED)
+        write.add_done_callback(_report_write_error)
+        writes.append(write)
+    return writes
+
+
+def check_missed_medications(due_doses):
+    """Send INSTANT WhatsApp alerts for doses still not taken 1 minute after their time
+
+    Called by the event scheduler at each dose's missed deadline, and by the
+    dose workers, which wait on the returned database writes (log, catch-up
+    watermark, outbox) before completing their leases.
+    """
+    from async_db import get_async_database
+    from database import get_guardian_info, check_medication_status
+    
+    # Get guardian info
+    guardian = get_guardian_info()
+    if not guardian or not guardian.alerts_enabled:
+        return []
+    
+    patient_name = guardian.patient_name
+    
+    missed_doses = []
+    instances = _due_instances(due_doses)
+    
+    for dose in due_doses:
+        instance = instances.get(_instance_key(dose))
+        if instance is None:
+            # Not generated yet (e.g. right after midnight); ask the log directly
+            status = check_medication_status(dose.medication_id, dose.scheduled_time, dose.date)
+        elif instance.alert_state == ALERT_ALERTED:
+            continue
+        else:
+            status = instance.status
         
-        # Get guardian info
-        guardian = get_guardian_info()
-        if not guardian or guardian[4] != 1:  # whatsapp_enabled check
+        if status != 'Taken':
+            missed_doses.append((dose, status))
+    
+    writes = []
+    
+    if missed_doses:
+        from templates import MissedDose
+        
+        # Queue the INSTANT WhatsApp alerts in the outbox, which retries failed
+        # sends and merges alerts due together into one digest. Unlogged doses
+        # are marked missed in the same transaction (a dose logged in the
+        # meantime, e.g. taken from the app, is left as it is) and count as
+        # alerted once their messages are queued. The write runs on the async
+        # writer thread so a slow commit doesn't hold up the scheduler.
+        messages = [
+            (_outbox_key('missed_dose', *_instance_key(dose)), 'missed_dose',
+             MissedDose(patient_name, f"{dose.name} ({dose.dosage})", dose.date, dose.scheduled_time))
+            for dose, _ in missed_doses
+        ]
+        missed_logs = [(dose.medication_id, dose.scheduled_time, "Missed", dose.date)
+                       for dose, status in missed_doses if status is None]
+        writes.append(_enqueue_alerts("Guardian alert", guardian, messages,
+                                      [_instance_key(dose) for dose, _ in missed_doses],
+                                      config.OUTBOX_COALESCE_SECONDS, missed_logs))
+        
+        for dose, status in missed_doses:
+            if status is None:
+                print(f"⚠️ Medication marked as missed: {dose.name} at {dose.scheduled_time}")
+            print(f"📱⚡ INSTANT guardian alert queued (1 min) for: {dose.name}")
+    
+    # Queued after the log write (writes run in order), so the catch-up
+    # watermark never gets ahead of the logs
+    latest = max(datetime.strptime(f"{dose.date} {dose.scheduled_time}", '%Y-%m-%d %H:%M')
+                 for dose in due_doses)
+    write = get_async_database().submit('advance_missed_watermark', latest)
+    write.add_done_callback(_report_write_error)
+    writes.append(write)
+    return writes
+
+
+def catch_up_missed_medications(now=None):
+    """Log doses missed while the scheduler was down and send one alert for all of them
+
+    Runs when the scheduler starts and when it wakes from a long sleep.
+    """
+    try:
+        from database import catch_up_missed_doses, get_guardian_info
+        
+        missed = catch_up_missed_doses(now)
+        if not missed:
             return
         
-        guardian_phone = guardian[3]
-        patient_name = guardian[1]
+        print(f"⏪ Caught up {len(missed)} missed dose(s) from while the scheduler was down")
         
-        current_time = datetime.now()
-        current_date = current_time.strftime("%Y-%m-%d")
+        guardian = get_guardian_info()
+        if not guardian or not guardian.alerts_enabled:
+            return
         
-        for med in medications:
-            med_id, med_name, med_dosage, times_str = med
-            times_list = times_str.split(',')
+        try:
+            from templates import MissedDoses
             
-            for scheduled_time in times_list:
-                scheduled_time = scheduled_time.strip()
-                
-                try:
-                    scheduled_dt = datetime.strptime(f"{current_date} {scheduled_time}", "%Y-%m-%d %H:%M")
-                except:
-                    continue
-                
-                # Calculate time difference in minutes
-                time_diff = (current_time - scheduled_dt).total_seconds() / 60
-                
-                # ⚡⚡⚡ SUPER FAST: Send alert after just 1 MINUTE!
-                if 1 <= time_diff <= 1.5:  # Between 1-1.5 mins late
-                    status = check_medication_status(med_id, scheduled_time, current_date)
-                    
-                    if status != 'Taken':
-                        # Mark as missed
-                        if status is None:
-                            log_medication_taken(med_id, scheduled_time, "Missed")
-                            print(f"⚠️ Medication marked as missed: {med_name} at {scheduled_time}")
-                        
-                        # Send INSTANT WhatsApp alert
-                        try:
-                            from whatsapp_notifier import send_whatsapp_alert
-                            
-                            send_whatsapp_alert(
-                                guardian_phone=guardian_phone,
-                                patient_name=patient_name,
-                                medication_name=f"{med_name} ({med_dosage})",
-                                scheduled_time=format_time_12hr(scheduled_time)
-                            )
-                            print(f"📱⚡ INSTANT WhatsApp alert sent (1 min) for: {med_name}")
-                        except ImportError:
-                            print("⚠️ WhatsApp notifier not configured")
-                        except Exception as e:
-                            print(f"❌ WhatsApp alert error: {e}")
+            keys = sorted(_instance_key(dose) for dose in missed)
+            payload = MissedDoses(guardian.patient_name,
+                                  [(f"{dose.name} ({dose.dosage})", dose.date, dose.scheduled_time) for dose in missed])
+            # Keyed on the doses it covers, so catching up twice sends one summary
+            key = _outbox_key('missed_doses', _outbox_key(*keys[0]), _outbox_key(*keys[-1]), len(keys))
+            _enqueue_alerts("Catch-up alert", guardian, [(key, 'missed_doses', payload)], keys)
+            print(f"📱 Catch-up guardian alert queued for {len(missed)} dose(s)")
+        except Exception as e:
+            print(f"❌ Catch-up alert error: {e}")
     
     except Exception as e:
-        print(f"❌ Error checking missed medications: {e}")
+        print(f"❌ Error catching up missed medications: {e}")
 
 
 def check_low_stock_medications():
-    """Check for low stock and send alerts"""
+    """Send refill alerts for medications forecast to run out within config.REFILL_LEAD_DAYS"""
     try:
-        from database import get_guardian_info, get_low_stock_medications
+        from database import get_guardian_info, get_medications_to_refill, was_low_stock_alerted
         
         guardian = get_guardian_info()
-        if not guardian or guardian[4] != 1:
+        if not guardian or not guardian.alerts_enabled:
             return
         
-        guardian_phone = guardian[3]
-        patient_name = guardian[1]
+        patient_name = guardian.patient_name
         
-        low_stock_meds = get_low_stock_medications(threshold=10)
+        # Days left come from each medication's recent use, not a fixed count
+        refills = get_medications_to_refill()
         
-        if low_stock_meds:
-            for med in low_stock_meds:
-                conn = sqlite3.connect('data/dosebuddy.db')
-                cursor = conn.execute('''
-                    SELECT id FROM low_stock_alerts 
-                    WHERE medication_id = ? AND alert_date = ?
-                ''', (med[0], datetime.now().strftime('%Y-%m-%d')))
-                
-                already_alerted = cursor.fetchone()
-                conn.close()
+        if refills:
+            today = clock.now().strftime('%Y-%m-%d')
+            for med in refills:
+                already_alerted = was_low_stock_alerted(med.medication_id, today)
                 
-                if not already_alerted and med[6] <= 5:
+                if not already_alerted:
                     try:
-                        from whatsapp_notifier import send_low_stock_alert
+                        from templates import LowStock
                         
-                        send_low_stock_alert(
-                            guardian_phone=guardian_phone,
-                            patient_name=patient_name,
-                            medication_name=f"{med[1]} ({med[2]})",
-                            remaining_count=med[6]
+                        payload = LowStock(patient_name, f"{med.name} ({med.dosage})",
+                                           med.remaining_count, med.days_left)
+                        # Recorded as sent in the outbox transaction; a failed enqueue is retried next check
+                        _enqueue_alerts(
+                            "Low stock alert", guardian,
+                            [(_outbox_key('low_stock', med.medication_id, today), 'low_stock', payload)],
+                            low_stock_alerts=[(med.medication_id, today)]
                         )
                         
-                        conn = sqlite3.connect('data/dosebuddy.db')
-                        
-                        conn.execute('''
-                            CREATE TABLE IF NOT EXISTS low_stock_alerts (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                medication_id INTEGER,
-                                alert_date TEXT
-                            )
-                        ''')
-                        
-                        conn.execute('''
-                            INSERT INTO low_stock_alerts (medication_id, alert_date)
-                            VALUES (?, ?)
-                        ''', (med[0], datetime.now().strftime('%Y-%m-%d')))
-                        
-                        conn.commit()
-                        conn.close()
-                        
-                        print(f"📱 Low stock alert sent for: {med[1]}")
-                    except ImportError:
-                        print("⚠️ WhatsApp notifier not configured")
+                        print(f"📱 Low stock alert queued for: {med.name} (~{med.days_left:.1f} days left)")
                     except Exception as e:
                         print(f"❌ Low stock alert error: {e}")
     
@@ -151,58 +284,28 @@ def check_low_stock_medications():
         print(f"❌ Error checking low stock: {e}")
 
 
-def format_time_12hr(time_str):
-    """Convert 24-hour time to 12-hour format"""
-    try:
-        hour, minute = time_str.strip().split(':')
-        hour = int(hour)
-        period = "AM" if hour < 12 else "PM"
-        if hour == 0:
-            hour = 12
-        elif hour > 12:
-            hour = hour - 12
-        return f"{hour}:{minute} {period}"
-    except:
-        return time_str
-
-
-def schedule_medication(med_id, med_name, dosage, times):
-    """Schedule medication reminders"""
-    times_list = times.split(',')
-    
-    for time_str in times_list:
-        time_str = time_str.strip()
-        try:
-            schedule.every().day.at(time_str).do(
-                send_notification, med_name, dosage
-            )
-            print(f"✅ Scheduled: {med_name} at {time_str}")
-        except Exception as e:
-            print(f"❌ Error scheduling {med_name} at {time_str}: {e}")
-
-
 def daily_summary():
     """Send daily summary at end of day"""
     try:
         from database import get_guardian_info, get_adherence_statistics
         
         guardian = get_guardian_info()
-        if not guardian or guardian[4] != 1:
+        if not guardian or not guardian.alerts_enabled:
             return
         
         stats = get_adherence_statistics(days=1)
         
         if stats['total_doses'] > 0:
             try:
-                from whatsapp_notifier import send_daily_summary
+                from templates import DailySummary
                 
-                send_daily_summary(
-                    guardian_phone=guardian[3],
-                    patient_name=guardian[1],
-                    stats=stats
-                )
+                today = clock.now().strftime('%Y-%m-%d')
+                payload = DailySummary(guardian.patient_name, today, stats.get('taken', 0),
+                                       stats.get('missed', 0), stats.get('adherence_rate', 0))
+                _enqueue_alerts("Daily summary", guardian,
+                                [(_outbox_key('daily_summary', today), 'daily_summary', payload)])
                 
-                print(f"✅ Daily summary sent")
+                print(f"✅ Daily summary queued")
             except Exception as e:
                 print(f"❌ Daily summary error: {e}")
     
@@ -210,96 +313,105 @@ def daily_summary():
         print(f"❌ Error generating daily summary: {e}")
 
 
-def run_scheduler():
-    """Run scheduler in background thread"""
-    print("🔄 Scheduler started...")
+def archive_old_logs():
+    """Move old dose logs out of the hot schedule_log table and prune delivered outbox messages"""
+    try:
+        from archive import archive_old_logs as archive_logs
+        from database import prune_outbox
+        
+        moved = archive_logs()
+        
+        if moved:
+            print(f"📦 Archived {sum(moved.values())} old log(s)")
+        
+        pruned = prune_outbox()
+        if pruned:
+            print(f"📦 Pruned {pruned} delivered outbox message(s)")
     
-    while True:
-        schedule.run_pending()
-        time.sleep(20)  # ⚡ Check every 20 seconds for faster response
+    except Exception as e:
+        print(f"❌ Error archiving logs: {e}")
 
 
-def start_scheduler():
-    """Start scheduler thread with all background tasks"""
-    
-    schedule.clear()
+def refresh_dose_instances():
+    """Generate the new look-ahead day's dose instances and prune old ones"""
+    try:
+        from database import refresh_dose_instances as refresh_instances
+        
+        added = refresh_instances()
+        print(f"📅 Generated {added} dose instance(s)")
     
-    load_all_schedules()
+    except Exception as e:
+        print(f"❌ Error generating dose instances: {e}")
+
+
+def create_event_scheduler():
+    """Build the EventScheduler with dose events and all background jobs (not started)"""
+    from database import get_dose_schedule
     
-    # ⚡⚡⚡ Check for missed medications every 30 SECONDS for 1-minute alerts
-    schedule.every(30).seconds.do(check_missed_medications)
+    if config.DOSE_WORKER_SHARDS:
+        # Sharded dose workers (dose_worker.py) handle reminders and missed doses;
+        # this scheduler only runs the daily jobs
+        event_scheduler = EventScheduler(lambda medication_id=None: [], send_reminders, check_missed_medications)
+    else:
+        # ⚡⚡⚡ Reminders fire at each dose time and missed-dose alerts exactly 1 MINUTE later;
+        # the thread sleeps until the next event instead of polling
+        # Doses whose deadline passed while the scheduler was down are caught up on start
+        # and after long sleeps, with one combined alert
+        event_scheduler = EventScheduler(get_dose_schedule, send_reminders, check_missed_medications,
+                                         on_catch_up=catch_up_missed_medications)
     
     # Check low stock once daily at 9 AM
-    schedule.every().day.at("09:00").do(check_low_stock_medications)
+    event_scheduler.add_daily_job("09:00", check_low_stock_medications)
+    
+    # Generate the look-ahead window's dose instances at midnight
+    event_scheduler.add_daily_job("00:00", refresh_dose_instances)
     
     # Send daily summary at 10 PM
-    schedule.every().day.at("22:00").do(daily_summary)
+    event_scheduler.add_daily_job("22:00", daily_summary)
     
-    scheduler_thread = Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    # Archive old dose logs overnight so the missed-dose checks stay on a small table
+    event_scheduler.add_daily_job("03:00", archive_old_logs)
     
     print("✅ DoseBuddy Scheduler started successfully!")
     print("📅 Loaded medication schedules")
     print("📱 WhatsApp alerts enabled")
     print("🔔 Desktop notifications active")
     print("⚡⚡⚡ SUPER FAST: 1-MINUTE missed medication alerts!")
+    return event_scheduler
 
 
-def load_all_schedules():
-    """Load all medications and schedule them"""
-    try:
-        conn = sqlite3.connect('data/dosebuddy.db')
-        cursor = conn.execute('SELECT id, name, dosage, times FROM medications')
-        medications = cursor.fetchall()
-        conn.close()
-        
-        scheduled_count = 0
-        for med in medications:
-            schedule_medication(med[0], med[1], med[2], med[3])
-            scheduled_count += 1
-        
-        print(f"📋 Loaded {scheduled_count} medication schedule(s)")
+def start_scheduler():
+    """Start this process's scheduler service
     
-    except Exception as e:
-        print(f"❌ Error loading schedules: {e}")
+    Only one process on the host runs the scheduler (see scheduler_service);
+    in any other process this just stands by to take over.
+    """
+    return get_scheduler_service()
+
+
+def load_all_schedules(medication_id=None):
+    """Refresh schedules after a medication is added, changed or removed
+
+    With a medication_id only that medication's reminders are touched;
+    without one every medication is diffed against the database.
+    """
+    # Wakes the scheduler thread (here or in the process that runs it), which
+    # applies the change before its next event
+    request_reload(medication_id)
+    print("📋 Medication schedules reloading")
 
 
 def get_next_scheduled_times():
     """Get next scheduled medication times"""
     try:
-        conn = sqlite3.connect('data/dosebuddy.db')
-        cursor = conn.execute('SELECT name, dosage, times FROM medications')
-        medications = cursor.fetchall()
-        conn.close()
-        
-        current_time = datetime.now()
-        current_date = current_time.strftime("%Y-%m-%d")
-        
-        upcoming = []
-        
-        for med in medications:
-            name, dosage, times_str = med
-            times_list = times_str.split(',')
-            
-            for scheduled_time in times_list:
-                scheduled_time = scheduled_time.strip()
-                try:
-                    scheduled_dt = datetime.strptime(f"{current_date} {scheduled_time}", "%Y-%m-%d %H:%M")
-                    
-                    if scheduled_dt < current_time:
-                        scheduled_dt += timedelta(days=1)
-                    
-                    upcoming.append({
-                        'medication': f"{name} ({dosage})",
-                        'time': scheduled_time,
-                        'datetime': scheduled_dt
-                    })
-                except:
-                    continue
-        
-        upcoming.sort(key=lambda x: x['datetime'])
+        from database import get_upcoming_doses
         
-        return upcoming[:5]
+        # Top 5 straight off the minute-of-day index, already in due order
+        return [{
+            'medication': f"{dose.name} ({dose.dosage})",
+            'time': dose.scheduled_time,
+            'datetime': datetime.fromisoformat(dose.date) + timedelta(minutes=dose.minute_of_day)
+        } for dose in get_upcoming_doses(limit=5)]
     
     except Exception as e:
         print(f"❌ Error getting next scheduled times: {e}")
@@ -308,7 +420,7 @@ def get_next_scheduled_times():
 
 def test_notification():
     """Test notification system"""
-    send_notification("Test Medication", "500mg - This is a test")
+    _show_notification("Test Medication", "500mg - This is a test")
     print("✅ Test notification sent")
 
 
@@ -324,8 +436,8 @@ def test_whatsapp_integration():
             return False
         
         send_whatsapp_alert(
-            guardian_phone=guardian[3],
-            patient_name=guardian[1],
+            guardian_phone=guardian.guardian_phone,
+            patient_name=guardian.patient_name,
             medication_name="Test Medication (500mg)",
             scheduled_time="10:00 AM"
         )
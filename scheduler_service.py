@@ -0,0 +1,340 @@
+"""Host-wide scheduler service.
+
+Only one process per host runs the dose scheduler: whichever holds the
+file lock at ``config.SCHEDULER_LOCK_PATH``. That can be a dedicated
+process::
+
+    python -m scheduler_service
+
+or the first Streamlit process to start (app.py keeps the service in
+``st.cache_resource``, so sessions and reruns share it). Other processes
+stay on standby and take over if the lock holder exits. The lock holder
+also runs the outbox worker that delivers guardian WhatsApp messages
+(see outbox_worker.py).
+
+Processes that don't run the scheduler pass medication changes through
+the schedule_changes table; the running service notices new commits via
+``PRAGMA data_version`` and refreshes only the affected medications. The
+service writes a status snapshot (job counts, next fire times, heartbeat)
+to ``config.SCHEDULER_STATUS_PATH`` for get_scheduler_status().
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import clock
+import config
+from db_pool import get_connection, get_pool
+from notification_dispatch import get_dispatcher_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class SchedulerLock:
+    """Non-blocking exclusive lock on a file, released when the process exits"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """Take the lock if no other process holds it; returns True on success"""
+        if self._file is not None:
+            return True
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        lock_file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+
+def _default_factory():
+    from scheduler import create_event_scheduler
+    return create_event_scheduler()
+
+
+def _default_workers():
+    from outbox_worker import OutboxWorker
+    return [OutboxWorker()]
+
+
+class SchedulerService:
+    """Runs the event scheduler if this process wins the host lock, otherwise stands by
+
+    workers() builds the background workers (start()/stop() objects) that
+    run alongside the scheduler; by default the outbox worker.
+    """
+
+    def __init__(self, factory=None, lock_path=None, status_path=None,
+                 poll_seconds=None, heartbeat_seconds=None, workers=None):
+        self.factory = factory or _default_factory
+        self.workers_factory = workers or _default_workers
+        self.lock = SchedulerLock(lock_path or config.SCHEDULER_LOCK_PATH)
+        self.status_path = status_path or config.SCHEDULER_STATUS_PATH
+        self.poll_seconds = config.SCHEDULER_CHANGE_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.heartbeat_seconds = (config.SCHEDULER_HEARTBEAT_SECONDS if heartbeat_seconds is None
+                                  else heartbeat_seconds)
+
+        self.scheduler = None
+        self.workers = []
+        self.started_at = None
+        self._watch_conn = None
+        self._data_version = None
+        self._last_heartbeat = 0.0
+        self._last_next_due = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_owner(self):
+        """True if this process runs the scheduler"""
+        return self.scheduler is not None
+
+    # ----- lifecycle -----
+
+    def start(self):
+        """Try to become the host's scheduler and start the background watcher"""
+        self.try_acquire()
+        self._thread = threading.Thread(target=self._loop, name='dosebuddy-scheduler-service', daemon=True)
+        self._thread.start()
+        return self
+
+    def try_acquire(self):
+        """Take over scheduling if the lock is free (or already ours); returns is_owner"""
+        if self.is_owner:
+            return True
+        if not self.lock.acquire():
+            return False
+
+        try:
+            self._watch_conn = sqlite3.connect(get_pool().db_path, check_same_thread=False)
+            self._data_version = None
+
+            self.scheduler = self.factory()
+            self.scheduler.start()
+            self.workers = self.workers_factory()
+            for worker in self.workers:
+                worker.start()
+            self.started_at = clock.now()
+            # Changes queued while no scheduler was running (always read: no version seen yet)
+            self._consume_changes()
+        except Exception:
+            self._release()
+            raise
+
+        print(f"✅ Scheduler service running in process {os.getpid()}")
+        self.write_status()
+        return True
+
+    def _release(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        if self.scheduler is not None:
+            self.scheduler.stop(timeout=5)
+            self.scheduler = None
+        if self._watch_conn is not None:
+            self._watch_conn.close()
+            self._watch_conn = None
+        self.lock.release()
+
+    def stop(self):
+        """Stop the watcher and scheduler and release the host lock"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+        was_owner = self.is_owner
+        self._release()
+        if was_owner:
+            self.write_status(running=False)
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_seconds if self.is_owner else self.heartbeat_seconds):
+            try:
+                if not self.is_owner:
+                    self.try_acquire()
+                    continue
+
+                self._consume_changes()
+
+                # Refresh the snapshot when the next fire time moves, and on every heartbeat
+                next_due = self.scheduler.next_due()
+                if (next_due != self._last_next_due
+                        or time.monotonic() - self._last_heartbeat >= self.heartbeat_seconds):
+                    self.write_status()
+            except Exception as e:
+                print(f"❌ Scheduler service error: {e}")
+
+    # ----- schedule changes -----
+
+    def _current_data_version(self):
+        return self._watch_conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _consume_changes(self):
+        """Apply medication changes queued by other processes since the last commit seen"""
+        version = self._current_data_version()
+        if version == self._data_version:
+            return 0
+        self._data_version = version
+
+        with get_connection() as conn:
+            rows = conn.execute('SELECT id, medication_id FROM schedule_changes ORDER BY id').fetchall()
+            if rows:
+                conn.execute('DELETE FROM schedule_changes WHERE id <= ?', (rows[-1][0],))
+
+        for medication_id in {medication_id for _, medication_id in rows}:
+            self.scheduler.notify_changed(medication_id)
+        return len(rows)
+
+    def request_reload(self, medication_id=None):
+        """Refresh one medication's schedule (or all) wherever the scheduler runs"""
+        if self.is_owner:
+            self.scheduler.notify_changed(medication_id)
+            return
+
+        with get_connection() as conn:
+            conn.execute('INSERT INTO schedule_changes (medication_id, requested_at) VALUES (?, ?)',
+                         (medication_id, clock.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    # ----- status -----
+
+    def status(self, running=True):
+        """Snapshot of this process's scheduler"""
+        scheduler = self.scheduler
+        upcoming = scheduler.upcoming() if scheduler else []
+        return {
+            'running': running and scheduler is not None,
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': clock.now().isoformat(),
+            'dose_count': scheduler.dose_count if scheduler else 0,
+            'job_count': scheduler.job_count if scheduler else 0,
+            'next_fire_times': [dict(event, time=event['time'].isoformat()) for event in upcoming],
+            'notifications': get_dispatcher_metrics(),
+        }
+
+    def write_status(self, running=True):
+        """Write the status snapshot atomically for other processes to read"""
+        status = self.status(running)
+
+        directory = os.path.dirname(self.status_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(temp_path, self.status_path)
+
+        self._last_heartbeat = time.monotonic()
+        self._last_next_due = self.scheduler.next_due() if self.scheduler else None
+        return status
+
+
+def get_scheduler_status(status_path=None, heartbeat_seconds=None):
+    """Read the running scheduler's status; 'healthy' is False if it stopped or went quiet"""
+    heartbeat_seconds = config.SCHEDULER_HEARTBEAT_SECONDS if heartbeat_seconds is None else heartbeat_seconds
+
+    try:
+        with open(status_path or config.SCHEDULER_STATUS_PATH) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return {'running': False, 'healthy': False}
+
+    age = (clock.now() - datetime.fromisoformat(status['heartbeat_at'])).total_seconds()
+    status['heartbeat_age_seconds'] = round(age, 1)
+    # Allow a couple of missed heartbeats before calling it unhealthy
+    status['healthy'] = status['running'] and age < heartbeat_seconds * 3
+    return status
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_scheduler_service():
+    """Return this process's SchedulerService, starting it on first use"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = SchedulerService().start()
+    return _service
+
+
+def request_reload(medication_id=None):
+    """Tell the host's scheduler that a medication was added, changed or removed"""
+    if _service is not None:
+        _service.request_reload(medication_id)
+        return
+
+    # This process never started the service; queue the change for whoever runs it
+    with get_connection() as conn:
+        conn.execute('INSERT INTO schedule_changes (medication_id, requested_at) VALUES (?, ?)',
+                     (medication_id, clock.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def main():
+    from database import init_database
+
+    init_database()
+    service = SchedulerService()
+    if not service.lock.acquire():
+        print(f"⚠️ Another process already runs the DoseBuddy scheduler (lock: {service.lock.path})")
+        return 1
+
+    # start() keeps the lock taken above, so no other process can slip in between
+    service.start()
+    print("⏰ DoseBuddy scheduler service started (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping scheduler service")
+    finally:
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+"""Local HTTP stand-in for the messaging APIs, for offline load tests.
+
+Answers two kinds of POST and records every message it receives:
+
+- the Twilio Messages API (form-encoded ``To``/``Body``, as sent by
+  whatsapp_notifier with ``DOSEBUDDY_TWILIO_API_BASE_URL`` pointed here)
+- webhook batches, ``{"messages": [...]}`` JSON (channels.WebhookChannel,
+  and every channel when ``DOSEBUDDY_NOTIFY_STAND_IN`` is this server's URL)
+
+It speaks HTTP/1.1, so clients keep their connections alive as they would
+against the real API. With ``fail_rate`` a share of requests answers 503,
+to exercise the outbox's retries.
+
+Usage:
+    python -m stand_in --port 8025 --out messages.jsonl
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this, Nagle's
+    # algorithm holds the body back until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stand_in = self.server.stand_in
+
+        if stand_in.fail_rate and stand_in.random() < stand_in.fail_rate:
+            stand_in.record_failure()
+            self._answer(503, {'message': 'Service Unavailable'})
+            return
+
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            messages = json.loads(raw)['messages']
+            stand_in.record(messages)
+            self._answer(200, {'received': len(messages)})
+        else:
+            form = parse_qs(raw.decode())
+            stand_in.record([{'channel': 'twilio', 'recipient': form.get('To', [''])[0],
+                              'body': form.get('Body', [''])[0]}])
+            self._answer(201, {'sid': 'SM' + '0' * 32, 'status': 'queued'})
+
+    def _answer(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer:
+    """Recording HTTP server on localhost; use as a context manager or start()/stop()"""
+
+    def __init__(self, port=0, out_path=None, fail_rate=0.0, keep=True, seed=None):
+        self.out_path = out_path
+        self.fail_rate = fail_rate
+        self.keep = keep
+        self.messages = []
+        self.requests = 0
+        self.failures = 0
+        self.counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def record(self, messages):
+        received_at = time.time()
+        with self._lock:
+            self.requests += 1
+            for message in messages:
+                channel = message.get('channel', 'webhook')
+                self.counts[channel] = self.counts.get(channel, 0) + 1
+            if self.keep:
+                self.messages.extend(messages)
+            if self.out_path:
+                with open(self.out_path, 'a', encoding='utf-8') as f:
+                    for message in messages:
+                        f.write(json.dumps(dict(message, received_at=received_at), ensure_ascii=False) + "\n")
+
+    def record_failure(self):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+
+    @property
+    def message_count(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='dosebuddy-stand-in', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the DoseBuddy messaging APIs")
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--out', help="append received messages to this JSON-lines file")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.out, args.fail_rate, keep=False).start()
+    print(f"📨 Stand-in listening on {server.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   {server.message_count} message(s) in {server.requests} request(s), "
+                  f"{server.failures} failed on purpose")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Stock depletion forecast behind the low-stock refill alerts.
+
+Every medication's daily use comes from one set-based query: the Taken
+doses in daily_adherence over the last ``config.STOCK_FORECAST_WINDOW_DAYS``
+full days (or since the medication was added, if later), falling back to
+its dose_times count, or ``frequency``, while there is no Taken history
+yet. days_left is remaining_count divided by that rate.
+
+The result is cached per database until scheduler_state['stock_version']
+moves; triggers from migration 12 bump it whenever stock, schedules or
+Taken counts change, in any process.
+"""
+import threading
+from datetime import timedelta
+
+from models import StockForecast
+
+STOCK_VERSION_KEY = 'stock_version'
+
+FORECAST_STOCK = '''
+    SELECT medication_id, name, dosage, remaining_count, daily_use,
+           CASE WHEN daily_use > 0 THEN MAX(remaining_count, 0) * 1.0 / daily_use END AS days_left
+    FROM (
+        SELECT m.id AS medication_id, m.name, m.dosage, m.remaining_count,
+               CASE WHEN taken.doses > 0
+                    THEN taken.doses * 1.0 / MAX(1, MIN(?, julianday(?) - julianday(m.added_date)))
+                    ELSE COALESCE(NULLIF((SELECT COUNT(*) FROM dose_times dt WHERE dt.medication_id = m.id), 0),
+                                  m.frequency)
+               END AS daily_use
+        FROM medications m
+        LEFT JOIN (
+            SELECT medication_id, SUM(taken) AS doses FROM daily_adherence
+            WHERE date >= ? AND date < ?
+            GROUP BY medication_id
+        ) taken ON taken.medication_id = m.id
+    )
+    ORDER BY days_left IS NULL, days_left, medication_id
+'''
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def stock_version(conn):
+    """Current stock_version, or None before anything was counted"""
+    row = conn.execute('SELECT value FROM scheduler_state WHERE key = ?', (STOCK_VERSION_KEY,)).fetchone()
+    return row[0] if row else None
+
+
+def forecast_stock(conn, today, window_days):
+    """StockForecast for every medication, soonest to run out first
+
+    `today` is a date; the history window is the `window_days` full days
+    before it.
+    """
+    first = (today - timedelta(days=window_days)).isoformat()
+    return StockForecast.fetch_all(conn.execute(FORECAST_STOCK, (window_days, today.isoformat(), first,
+                                                                 today.isoformat())))
+
+
+def cached_forecast(conn, db_path, today, window_days):
+    """forecast_stock, reused until the stock version, day or window changes"""
+    key = (stock_version(conn), today, window_days)
+    with _cache_lock:
+        cached = _cache.get(db_path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+    forecast = forecast_stock(conn, today, window_days)
+    with _cache_lock:
+        _cache[db_path] = (key, forecast)
+    return forecast
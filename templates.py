@@ -0,0 +1,373 @@
+"""Message templates for guardian alerts.
+
+Alert bodies used to be f-strings rebuilt on every send. Here each message
+kind has one template per locale, prepared once per (kind, locale, markup):
+its text is split into static fragments and named fields, checked, and
+joined back into a format string whose bound format_map does each render.
+Payloads are typed records (MissedDose, LowStock, ...) holding the raw
+values; how times and dates look is decided at render time by the
+guardian's locale and time format::
+
+    render('low_stock', LowStock(patient_name="Asha", medication_name="Metformin (500mg)",
+                                 remaining_count=4, days_left=2.0),
+           locale='es', markup=PLAIN)
+
+``markup`` is MARKDOWN for WhatsApp's *bold* and PLAIN (asterisks removed
+from the template text) for SMS, email and webhooks; markup_for(channel)
+picks it. Fragments that repeat across renders are cached: the formatted
+dates and times, and whole static templates such as the daily summary's
+verdict line, so fanning out the 22:00 summary to every guardian costs one
+call per message. Nothing here imports Twilio.
+"""
+from functools import lru_cache
+from string import Formatter
+
+import config
+
+MARKDOWN = 'markdown'
+PLAIN = 'plain'
+
+TIME_FORMATS = ('12h', '24h')
+
+
+class Payload:
+    """Base class for the typed values a message is rendered from"""
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Rebuild a payload from to_dict() output (e.g. an outbox payload); other keys are ignored"""
+        return cls(**{name: values.get(name) for name in cls.__slots__})
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())})"
+
+
+class MissedDose(Payload):
+    """One missed dose; date is 'YYYY-MM-DD' and scheduled_time 'HH:MM'"""
+
+    __slots__ = ('patient_name', 'medication_name', 'date', 'scheduled_time')
+
+    def __init__(self, patient_name, medication_name, date, scheduled_time):
+        self.patient_name = patient_name
+        self.medication_name = medication_name
+        self.date = date
+        self.scheduled_time = scheduled_time
+
+
+class MissedDoses(Payload):
+    """Several missed doses in one alert; doses holds (medication_name, date, scheduled_time)"""
+
+    __slots__ = ('patient_name', 'doses')
+
+    def __init__(self, patient_name, doses):
+        self.patient_name = patient_name
+        self.doses = doses
+
+
+class LowStock(Payload):
+    """A medication running low; days_left is the forecast, or None"""
+
+    __slots__ = ('patient_name', 'medication_name', 'remaining_count', 'days_left')
+
+    def __init__(self, patient_name, medication_name, remaining_count, days_left=None):
+        self.patient_name = patient_name
+        self.medication_name = medication_name
+        self.remaining_count = remaining_count
+        self.days_left = days_left
+
+
+class DailySummary(Payload):
+    """A day's adherence; date is 'YYYY-MM-DD'"""
+
+    __slots__ = ('patient_name', 'date', 'taken', 'missed', 'adherence_rate')
+
+    def __init__(self, patient_name, date, taken, missed, adherence_rate):
+        self.patient_name = patient_name
+        self.date = date
+        self.taken = taken
+        self.missed = missed
+        self.adherence_rate = adherence_rate
+
+
+# Payload type of each message kind, e.g. to rebuild one from an outbox payload
+PAYLOADS = {
+    'missed_dose': MissedDose,
+    'missed_doses': MissedDoses,
+    'low_stock': LowStock,
+    'daily_summary': DailySummary,
+}
+
+# Doses listed in one missed-doses alert before the rest are summed up
+MAX_LISTED_DOSES = 20
+
+LOCALES = {
+    'en': {
+        'time_format': '12h',
+        'date': '{month} {day:02d}, {year}',
+        'months': ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+                   'October', 'November', 'December'),
+        'templates': {
+            'missed_dose': """🚨 *MEDICATION ALERT*
+
+Patient: {patient_name}
+Medication: {medication_name}
+Scheduled Time: {scheduled_time}
+Status: ❌ MISSED
+
+This medication was not taken as scheduled. Please check on the patient.
+
+- DoseBuddy Alert System""",
+            'missed_doses': """🚨 *MISSED MEDICATIONS*
+
+Patient: {patient_name}
+Missed doses: {count}
+
+{lines}
+
+These doses were not logged as taken. Please check on the patient.
+
+- DoseBuddy Alert System""",
+            'missed_doses_line': "• {medication_name} - {date} {scheduled_time}",
+            'missed_doses_more': "• ...and {more} more",
+            'low_stock': """⚠️ *LOW STOCK ALERT*
+
+Patient: {patient_name}
+Medication: {medication_name}
+Remaining: {remaining_count} doses{runs_out}
+
+Please refill the medication soon!
+
+- DoseBuddy Alert System""",
+            'low_stock_runs_out': "\nRuns out in: about {days_left:.0f} day(s)",
+            'daily_summary': """📊 *DAILY SUMMARY*
+
+Patient: {patient_name}
+Date: {date}
+
+✅ Taken: {taken} dose(s)
+❌ Missed: {missed} dose(s)
+📈 Adherence: {adherence_rate}%
+
+{verdict}
+
+- DoseBuddy Daily Report""",
+            'summary_perfect': "🌟 Perfect day!",
+            'summary_good': "✅ Good job!",
+            'summary_poor': "⚠️ Needs improvement",
+        },
+    },
+    'es': {
+        'time_format': '24h',
+        'date': '{day} de {month} de {year}',
+        'months': ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre',
+                   'octubre', 'noviembre', 'diciembre'),
+        'templates': {
+            'missed_dose': """🚨 *ALERTA DE MEDICACIÓN*
+
+Paciente: {patient_name}
+Medicamento: {medication_name}
+Hora prevista: {scheduled_time}
+Estado: ❌ NO TOMADA
+
+Esta medicación no se tomó a la hora prevista. Por favor, compruebe cómo está el paciente.
+
+- Sistema de alertas DoseBuddy""",
+            'missed_doses': """🚨 *MEDICACIONES NO TOMADAS*
+
+Paciente: {patient_name}
+Dosis no tomadas: {count}
+
+{lines}
+
+Estas dosis no se registraron como tomadas. Por favor, compruebe cómo está el paciente.
+
+- Sistema de alertas DoseBuddy""",
+            'missed_doses_line': "• {medication_name} - {date} {scheduled_time}",
+            'missed_doses_more': "• ...y {more} más",
+            'low_stock': """⚠️ *ALERTA DE EXISTENCIAS BAJAS*
+
+Paciente: {patient_name}
+Medicamento: {medication_name}
+Quedan: {remaining_count} dosis{runs_out}
+
+¡Por favor, reponga la medicación pronto!
+
+- Sistema de alertas DoseBuddy""",
+            'low_stock_runs_out': "\nSe acaba en: unos {days_left:.0f} día(s)",
+            'daily_summary': """📊 *RESUMEN DIARIO*
+
+Paciente: {patient_name}
+Fecha: {date}
+
+✅ Tomadas: {taken} dosis
+❌ No tomadas: {missed} dosis
+📈 Cumplimiento: {adherence_rate}%
+
+{verdict}
+
+- Informe diario de DoseBuddy""",
+            'summary_perfect': "🌟 ¡Día perfecto!",
+            'summary_good': "✅ ¡Buen trabajo!",
+            'summary_poor': "⚠️ Necesita mejorar",
+        },
+    },
+}
+
+_FORMATTER = Formatter()
+
+
+def _escape(text):
+    """Literal text as part of a format string"""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class MessageTemplate:
+    """Template text prepared once and filled in with str.format_map
+
+    The text is split into static fragments and (field, format_spec) slots.
+    Fields must be plain names (no attribute or index lookups, conversions
+    or nested specs), so a template can only read the values it is given.
+    The checked pieces are joined back into one format string and its
+    format_map is bound once; render() takes the fields from a dict.
+    """
+
+    __slots__ = ('fields', 'static', '_format')
+
+    def __init__(self, text, markup=MARKDOWN):
+        pieces, fields = [], set()
+        for literal, field, spec, conversion in _FORMATTER.parse(text):
+            if markup == PLAIN:
+                literal = literal.replace("*", "")
+            pieces.append(_escape(literal))
+            if field is None:
+                continue
+            if not field.isidentifier() or conversion or '{' in spec or '}' in spec:
+                raise ValueError(f"Unsupported template field '{field}' in {text[:40]!r}")
+            fields.add(field)
+            pieces.append(f"{{{field}:{spec}}}" if spec else f"{{{field}}}")
+
+        self.fields = frozenset(fields)
+        self._format = "".join(pieces).format_map
+        # A template without fields renders to the same text every time
+        self.static = self._format({}) if not fields else None
+
+    def render(self, values):
+        """Fill the fields from the values dict"""
+        if self.static is not None:
+            return self.static
+        return self._format(values)
+
+
+def _locale(name):
+    return LOCALES.get(name) or LOCALES.get(config.MESSAGE_LOCALE) or LOCALES['en']
+
+
+@lru_cache(maxsize=None)
+def get_template(name, locale=None, markup=MARKDOWN):
+    """The prepared template `name` of a locale (unknown locales fall back to config.MESSAGE_LOCALE)"""
+    return MessageTemplate(_locale(locale)['templates'][name], markup)
+
+
+class _Style:
+    """Everything a render needs for one (locale, time_format, markup), resolved once"""
+
+    __slots__ = ('locale', 'time_format', 'templates', 'verdicts')
+
+    def __init__(self, locale, time_format, markup):
+        settings = _locale(locale)
+        self.locale = locale
+        self.time_format = time_format if time_format in TIME_FORMATS else settings['time_format']
+        self.templates = {name: get_template(name, locale, markup) for name in settings['templates']}
+        self.verdicts = {name: self.templates[name].static
+                         for name in ('summary_perfect', 'summary_good', 'summary_poor')}
+
+
+@lru_cache(maxsize=None)
+def _style(locale, time_format, markup):
+    return _Style(locale, time_format, markup)
+
+
+def markup_for(channel):
+    """MARKDOWN for channels that render WhatsApp's *bold*, PLAIN for the rest"""
+    return MARKDOWN if channel == 'whatsapp' else PLAIN
+
+
+@lru_cache(maxsize=4096)
+def format_time(time_str, time_format='12h'):
+    """'HH:MM' as '9:05 PM' (12h) or '21:05' (24h); anything else is returned as it is"""
+    try:
+        hour, minute = time_str.strip().split(':')
+        hour = int(hour)
+    except (AttributeError, ValueError):
+        return time_str
+    if not (minute.isdigit() and 0 <= hour < 24):
+        return time_str
+
+    if time_format == '24h':
+        return f"{hour:02d}:{minute}"
+    period = "AM" if hour < 12 else "PM"
+    return f"{hour % 12 or 12}:{minute} {period}"
+
+
+@lru_cache(maxsize=1024)
+def format_date(date_str, locale=None):
+    """'YYYY-MM-DD' in the locale's long form, e.g. 'June 01, 2025'"""
+    settings = _locale(locale)
+    year, month, day = (int(part) for part in date_str.split('-'))
+    return settings['date'].format(month=settings['months'][month - 1], day=day, year=year)
+
+
+def _missed_dose_fields(payload, style):
+    return {'patient_name': payload.patient_name, 'medication_name': payload.medication_name,
+            'scheduled_time': format_time(payload.scheduled_time, style.time_format)}
+
+
+def _missed_doses_fields(payload, style):
+    line = style.templates['missed_doses_line']
+    lines = [line.render({'medication_name': name, 'date': date,
+                          'scheduled_time': format_time(scheduled_time, style.time_format)})
+             for name, date, scheduled_time in payload.doses[:MAX_LISTED_DOSES]]
+    if len(payload.doses) > MAX_LISTED_DOSES:
+        lines.append(style.templates['missed_doses_more'].render({'more': len(payload.doses) - MAX_LISTED_DOSES}))
+    return {'patient_name': payload.patient_name, 'count': len(payload.doses), 'lines': "\n".join(lines)}
+
+
+def _low_stock_fields(payload, style):
+    runs_out = ""
+    if payload.days_left is not None:
+        runs_out = style.templates['low_stock_runs_out'].render({'days_left': payload.days_left})
+    return {'patient_name': payload.patient_name, 'medication_name': payload.medication_name,
+            'remaining_count': payload.remaining_count, 'runs_out': runs_out}
+
+
+def _daily_summary_fields(payload, style):
+    adherence = payload.adherence_rate or 0
+    verdict = 'summary_perfect' if adherence == 100 else 'summary_good' if adherence >= 80 else 'summary_poor'
+    return {'patient_name': payload.patient_name, 'date': format_date(payload.date, style.locale),
+            'taken': payload.taken or 0, 'missed': payload.missed or 0, 'adherence_rate': adherence,
+            'verdict': style.verdicts[verdict]}
+
+
+_FIELDS = {
+    'missed_dose': _missed_dose_fields,
+    'missed_doses': _missed_doses_fields,
+    'low_stock': _low_stock_fields,
+    'daily_summary': _daily_summary_fields,
+}
+
+
+def render(kind, payload, locale=None, time_format=None, markup=MARKDOWN):
+    """Message body of a kind ('missed_dose', 'missed_doses', 'low_stock' or 'daily_summary')
+
+    time_format is '12h' or '24h'; None uses the locale's.
+    """
+    style = _style(locale, time_format, markup)
+    return style.templates[kind].render(_FIELDS[kind](payload, style))
@@ -0,0 +1,150 @@
+"""Tests for moving old schedule_log rows into monthly archive tables.
+
+Run with: python -m pytest -q test_archive.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+import clock
+import config
+import db_pool
+import database
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'archive.db'), size=1)
+    database.init_database()
+    database.add_medication_with_type("Paracetamol", "500mg", 1, "09:00", 30, "Tablet")
+    database.add_medication_with_type("Metformin", "850mg", 1, "08:00", 60, "Tablet")
+    yield
+    db_pool.close_all_connections()
+
+
+def days_ago(n):
+    return (clock.now().date() - timedelta(days=n)).isoformat()
+
+
+def write_history():
+    database.log_medications_bulk([
+        (1, "09:00", "Taken", days_ago(200)),
+        (1, "09:00", "Missed", days_ago(120)),
+        (2, "08:00", "Taken", days_ago(120)),
+        (1, "09:00", "Taken", days_ago(5)),
+        (2, "08:00", "Delayed", days_ago(1)),
+    ])
+
+
+def hot_rows():
+    with db_pool.get_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM schedule_log').fetchone()[0]
+
+
+def traced_sql(func, *args):
+    statements = []
+    with db_pool.get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            func(*args)
+        finally:
+            conn.set_trace_callback(None)
+    return ' '.join(statements)
+
+
+def test_archive_moves_only_old_rows(db):
+    write_history()
+
+    moved = archive.archive_old_logs(older_than_days=90)
+
+    assert sum(moved.values()) == 3
+    assert hot_rows() == 2
+    assert database.get_total_logs_count() == 5
+
+
+def test_archiving_twice_is_a_no_op(db):
+    write_history()
+    archive.archive_old_logs(older_than_days=90)
+
+    assert archive.archive_old_logs(older_than_days=90) == {}
+    assert database.get_total_logs_count() == 5
+
+
+def test_rollup_keeps_archived_counts(db):
+    write_history()
+    before = database.get_adherence_statistics(365)
+
+    archive.archive_old_logs(older_than_days=90)
+
+    assert database.get_adherence_statistics(365) == before
+
+    database.rebuild_daily_adherence()
+    assert database.get_adherence_statistics(365) == before
+
+
+def test_history_only_reads_archives_when_needed(db):
+    write_history()
+    archive.archive_old_logs(older_than_days=90)
+
+    recent = traced_sql(database.get_medication_history, 1, 30)
+    assert archive.ARCHIVE_TABLE_PREFIX not in recent
+
+    history = database.get_medication_history(1, 365)
+    assert [log.date for log in history] == [days_ago(5), days_ago(120), days_ago(200)]
+    assert [log.status for log in history] == ['Taken', 'Missed', 'Taken']
+
+
+def test_export_includes_archived_rows(db):
+    write_history()
+    archive.archive_old_logs(older_than_days=90)
+
+    assert len(database.get_export_log_rows()) == 5
+    assert len(database.export_data_to_dict()['schedule_log']) == 5
+
+
+def test_delete_medication_clears_archives(db):
+    write_history()
+    archive.archive_old_logs(older_than_days=90)
+
+    database.delete_medication(1)
+
+    assert database.get_medication_history(1, 365) == []
+    assert database.get_total_logs_count() == 2
+
+
+def test_clear_all_data_drops_archives(db):
+    write_history()
+    archive.archive_old_logs(older_than_days=90)
+
+    database.clear_all_data()
+
+    with db_pool.get_connection() as conn:
+        assert archive.get_archive_tables(conn) == []
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert not any(name.startswith(archive.ARCHIVE_TABLE_PREFIX) for name in tables)
+
+
+def test_cutoff_follows_the_process_clock(db):
+    write_history()
+    previous = clock.set_clock(clock.SimulatedClock(clock.now() + timedelta(days=100)))
+    try:
+        # 100 days later, the rows from 120 days ago are 220 days old but the recent ones only 101-105
+        moved = archive.archive_old_logs(older_than_days=110)
+    finally:
+        clock.set_clock(previous)
+
+    assert sum(moved.values()) == 3
+    assert hot_rows() == 2
+
+
+def test_today_cannot_be_archived(db):
+    with pytest.raises(ValueError):
+        archive.archive_old_logs(older_than_days=0)
+
+
+def test_archive_table_name_rejects_bad_months():
+    assert archive.archive_table_name('2025-03') == 'schedule_log_archive_2025_03'
+    with pytest.raises(ValueError):
+        archive.archive_table_name('2025-03; DROP TABLE medications')
@@ -0,0 +1,92 @@
+"""Tests for the asyncio database facade.
+
+Run with: python -m pytest -q test_async_db.py
+"""
+import asyncio
+import inspect
+import threading
+
+import pytest
+
+import async_db
+import db_pool
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'async.db'), size=4)
+    database.init_database()
+    facade = async_db.AsyncDatabase(readers=2)
+    yield facade
+    facade.close()
+    db_pool.close_all_connections()
+
+
+def test_every_helper_is_classified():
+    helpers = {name for name, func in inspect.getmembers(database, inspect.isfunction)
+               if func.__module__ == 'database' and not name.startswith('_')}
+
+    assert helpers - async_db.WRITE_HELPERS - async_db.READ_HELPERS == {'init_database'}
+    assert not async_db.WRITE_HELPERS & async_db.READ_HELPERS
+
+
+def test_awaitable_helpers_match_sync_results(db):
+    async def scenario():
+        await db.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+        await db.log_medication_taken(1, "09:00", "Taken")
+        return await asyncio.gather(db.get_all_medications(), db.get_adherence_statistics(7))
+
+    medications, stats = asyncio.run(scenario())
+
+    assert medications == database.get_all_medications()
+    assert stats == database.get_adherence_statistics(7)
+
+
+def test_writes_run_in_order_on_one_thread(db, monkeypatch):
+    seen = []
+
+    def record(medication_id, new_count):
+        seen.append((threading.current_thread().name, new_count))
+
+    monkeypatch.setattr(database, 'update_tablet_count', record)
+    futures = [db.submit('update_tablet_count', 1, count) for count in range(50)]
+    for future in futures:
+        future.result(timeout=5)
+
+    assert [count for _, count in seen] == list(range(50))
+    assert {name for name, _ in seen} == {'dosebuddy-db-writer'}
+
+
+def test_errors_reach_the_caller(db):
+    async def scenario():
+        await db.log_medication_taken(1, "09:00", "Taken")
+        # Malformed (medication_id, new_count) pair
+        await db.update_tablet_counts([(1,)])
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
+
+    assert db.metrics()['writes']['errors'] == 1
+
+
+def test_metrics_count_calls(db):
+    async def scenario():
+        await db.get_total_logs_count()
+        await db.get_total_medications_count()
+        await db.log_medication_taken(1, "09:00", "Taken")
+
+    asyncio.run(scenario())
+    metrics = db.metrics()
+
+    assert metrics['reads']['count'] == 2
+    assert metrics['writes']['count'] == 1
+    assert metrics['write_queue_depth'] == 0
+    assert metrics['read_queue_depth'] == 0
+
+
+def test_unknown_helper_is_rejected(db):
+    with pytest.raises(AttributeError):
+        db.drop_everything
+    with pytest.raises(AttributeError):
+        db.submit('init_database')
@@ -0,0 +1,114 @@
+"""Tests for logging doses missed while the scheduler was down.
+
+Run with: python -m pytest -q test_catch_up.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import db_pool
+import database
+from clock import SimulatedClock
+from event_scheduler import EventScheduler
+from models import DoseTime
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'catch_up.db'), size=1)
+    database.init_database()
+    database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+    database.add_medication_with_type("Metformin", "850mg", 1, "08:00", 60, "Tablet")
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = '2025-05-01'")
+    yield
+    db_pool.close_all_connections()
+
+
+def logs():
+    with db_pool.get_connection() as conn:
+        return conn.execute('''
+            SELECT medication_id, date, scheduled_time, status FROM schedule_log
+            ORDER BY date, scheduled_time, medication_id
+        ''').fetchall()
+
+
+def test_first_run_only_sets_the_watermark(db):
+    assert database.catch_up_missed_doses(datetime(2025, 6, 1, 12, 0)) == []
+
+    assert logs() == []
+    assert database.get_missed_watermark() == datetime(2025, 6, 1, 11, 58)
+
+
+def test_unlogged_doses_since_the_watermark_are_logged_as_missed(db):
+    database.advance_missed_watermark(datetime(2025, 6, 1, 8, 30))
+    database.log_medications_bulk([(1, "09:00", "Taken", "2025-06-01")])
+
+    missed = database.catch_up_missed_doses(datetime(2025, 6, 2, 9, 0, 30))
+
+    # 09:00 on the 2nd is still inside its one-minute grace period
+    assert [(d.medication_id, d.date, d.scheduled_time) for d in missed] == [
+        (1, '2025-06-01', '21:00'),
+        (2, '2025-06-02', '08:00'),
+    ]
+    assert logs() == [
+        (1, '2025-06-01', '09:00', 'Taken'),
+        (1, '2025-06-01', '21:00', 'Missed'),
+        (2, '2025-06-02', '08:00', 'Missed'),
+    ]
+    assert database.get_missed_watermark() == datetime(2025, 6, 2, 8, 59)
+
+
+def test_catch_up_is_idempotent(db):
+    database.advance_missed_watermark(datetime(2025, 6, 1, 0, 0))
+    assert len(database.catch_up_missed_doses(datetime(2025, 6, 1, 23, 0))) == 3
+
+    database.advance_missed_watermark(datetime(2025, 6, 1, 0, 0))
+    assert database.catch_up_missed_doses(datetime(2025, 6, 1, 23, 0)) == []
+    assert len(logs()) == 3
+
+
+def test_long_downtime_is_bounded_by_max_days(db):
+    database.advance_missed_watermark(datetime(2025, 5, 2, 0, 0))
+
+    missed = database.catch_up_missed_doses(datetime(2025, 6, 10, 7, 0), max_days=2)
+
+    assert sorted({d.date for d in missed}) == ['2025-06-08', '2025-06-09']
+
+
+def test_doses_before_the_medication_was_added_are_skipped(db):
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = '2025-06-01' WHERE id = 2")
+    database.advance_missed_watermark(datetime(2025, 5, 31, 23, 0))
+
+    missed = database.catch_up_missed_doses(datetime(2025, 6, 1, 23, 0))
+
+    assert {d.medication_id for d in missed} == {1}
+
+
+def test_watermark_never_moves_back(db):
+    database.advance_missed_watermark(datetime(2025, 6, 1, 9, 0))
+    database.advance_missed_watermark(datetime(2025, 6, 1, 8, 0))
+
+    assert database.get_missed_watermark() == datetime(2025, 6, 1, 9, 0)
+
+
+def test_scheduler_hands_late_doses_to_catch_up():
+    clock = SimulatedClock(datetime(2025, 6, 1, 8, 30))
+    fired, catch_ups = [], []
+    scheduler = EventScheduler(
+        lambda: [DoseTime(medication_id=1, minute_of_day=9 * 60, name="Med", dosage="10mg")],
+        lambda doses: fired.append('reminder'), lambda doses: fired.append('missed'),
+        clock=clock, on_catch_up=catch_ups.append)
+    scheduler.reload()
+
+    # Machine slept through the dose and two more days
+    clock.set(datetime(2025, 6, 3, 12, 0))
+    scheduler.run_pending()
+
+    assert fired == []
+    assert catch_ups == [datetime(2025, 6, 3, 12, 0)]
+    # Next events are tomorrow, not a replay of the skipped days
+    assert scheduler.next_due() == datetime(2025, 6, 4, 9, 0)
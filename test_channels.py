@@ -0,0 +1,192 @@
+"""Tests for the notification channel registry and the local stand-in transports.
+
+Deliveries go to a stand_in.StandInServer on localhost or to recording
+channels, so nothing leaves the machine.
+
+Run with: python -m pytest -q test_channels.py
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+import channels
+import clock
+import config
+import database
+import db_pool
+import scheduler
+from async_db import close_async_database, get_async_database
+from channels import Delivery, RecordingChannel, WebhookChannel, get_channel, stand_in_channels
+from models import StockForecast
+from notification_dispatch import NotificationDispatcher
+from outbox_worker import OutboxWorker
+from stand_in import StandInServer
+from templates import LowStock
+
+NOW = datetime(2025, 6, 1, 9, 0)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'channels.db'), size=2)
+    database.init_database()
+    yield
+    close_async_database()
+    db_pool.close_all_connections()
+
+
+@pytest.fixture
+def sim_clock():
+    sim_clock = clock.SimulatedClock(NOW)
+    previous = clock.set_clock(sim_clock)
+    yield sim_clock
+    clock.set_clock(previous)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = NotificationDispatcher({name: (2, 5, 100) for name in ('whatsapp', 'sms', 'email', 'webhook')})
+    yield dispatcher
+    dispatcher.close()
+
+
+@pytest.fixture
+def server():
+    with StandInServer() as server:
+        yield server
+
+
+@pytest.fixture
+def registry():
+    previous = channels.set_channels(channels.default_channels())
+    yield
+    channels.set_channels(previous)
+
+
+def delivery(i, channel='webhook'):
+    return Delivery(channel, 'low_stock', f"+1{i:010d}", f"Refill {i}")
+
+
+def test_registry_looks_up_and_replaces_channels(registry):
+    assert channels.registered_channels() == ['desktop', 'email', 'sms', 'webhook', 'whatsapp']
+    with pytest.raises(ValueError):
+        get_channel('pager')
+
+    pager = RecordingChannel('pager')
+    assert channels.register_channel(pager) is None
+    assert get_channel('pager') is pager
+
+
+def test_use_stand_in_records_every_channel_to_a_file(registry, tmp_path):
+    path = tmp_path / 'sent.jsonl'
+    previous = channels.use_stand_in(str(path))
+    try:
+        get_channel('whatsapp').send(delivery(1, 'whatsapp'))
+        assert get_channel('email').send_batch([delivery(2, 'email'), delivery(3, 'email')]) == [None, None]
+        # Batch sizes carry over to the stand-ins
+        assert get_channel('email').batch_size == config.EMAIL_BATCH_SIZE
+    finally:
+        channels.set_channels(previous)
+
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [(line['channel'], line['body']) for line in lines] == [
+        ('whatsapp', "Refill 1"), ('email', "Refill 2"), ('email', "Refill 3")]
+    assert isinstance(get_channel('whatsapp'), channels.WhatsAppChannel)
+
+
+def test_webhook_batch_is_one_request(server):
+    webhook = WebhookChannel('webhook', server.url, batch_size=10)
+
+    assert webhook.send_batch([delivery(i) for i in range(10)]) == [None] * 10
+    webhook.send(delivery(10))
+
+    assert server.requests == 2
+    assert [message['body'] for message in server.messages] == [f"Refill {i}" for i in range(11)]
+
+
+def test_stand_in_failures_raise():
+    with StandInServer(fail_rate=1.0) as server:
+        with pytest.raises(ConnectionError):
+            WebhookChannel('webhook', server.url).send(delivery(1))
+
+    assert (server.failures, server.messages) == (1, [])
+
+
+def test_worker_batches_each_channel_up_to_its_batch_size(db, sim_clock, dispatcher, server):
+    transports = stand_in_channels({'whatsapp': RecordingChannel('whatsapp'),
+                                    'email': RecordingChannel('email', batch_size=5)}, server.url)
+    database.enqueue_outbox(
+        [(f"{name}:low_stock:{i}", 'low_stock', f"+1{i:010d}", f"Refill {i}", None, name)
+         for i in range(10) for name in ('whatsapp', 'email')]
+    )
+
+    worker = OutboxWorker(channels=transports, dispatcher=dispatcher, clock=sim_clock, rate_burst=100)
+    assert worker.drain()['sent'] == 20
+
+    # Ten WhatsApp requests, two email batches of five
+    assert server.requests == 12
+    assert server.counts == {'whatsapp': 10, 'email': 10}
+
+
+def test_partial_batch_failures_are_retried_alone(db, sim_clock, dispatcher):
+    class Flaky(RecordingChannel):
+        def send_batch(self, deliveries):
+            super().send_batch(deliveries)
+            return [ConnectionError("bounced") if d.recipient.endswith('1') else None for d in deliveries]
+
+    database.enqueue_outbox([(f"email:low_stock:{i}", 'low_stock', f"+{i}", "Refill", None, 'email')
+                             for i in range(3)])
+    worker = OutboxWorker(channels={'email': Flaky('email', batch_size=10)}, dispatcher=dispatcher,
+                          clock=sim_clock, rate_burst=100)
+
+    assert worker.run_once() == {'sent': 2, 'retrying': 1, 'dead': 0, 'deferred': 0}
+
+
+def test_messages_for_an_unknown_channel_wait_for_retry(db, sim_clock, dispatcher):
+    database.enqueue_outbox([('pager:low_stock:1', 'low_stock', "+1", "Refill", None, 'pager')])
+    worker = OutboxWorker(channels={}, dispatcher=dispatcher, clock=sim_clock)
+
+    assert worker.run_once()['retrying'] == 1
+    assert database.get_outbox_counts()['pending'] == 1
+
+
+def test_alerts_fan_out_to_every_guardian_channel(db, sim_clock, monkeypatch):
+    monkeypatch.setattr(config, 'GUARDIAN_CHANNELS', ['whatsapp', 'email', 'sms'])
+    database.add_guardian("Patient", "Guardian", "+10000000000", email="guardian@example.com")
+    guardian = database.get_guardian_info()
+
+    scheduler._enqueue_alerts("Test", guardian, [('low_stock:1:2025-06-01', 'low_stock',
+                                                 LowStock("Patient", "Metformin", 4, 2.0))])
+    get_async_database().flush()
+
+    with db_pool.get_connection() as conn:
+        rows = conn.execute('SELECT channel, recipient, idempotency_key, body FROM outbox ORDER BY id').fetchall()
+    assert [row[:3] for row in rows] == [('whatsapp', "+10000000000", 'whatsapp:low_stock:1:2025-06-01'),
+                                         ('email', "guardian@example.com", 'email:low_stock:1:2025-06-01'),
+                                         ('sms', "+10000000000", 'sms:low_stock:1:2025-06-01')]
+    # WhatsApp gets *bold* markup, the others plain text
+    assert [row[3].split("\n")[0] for row in rows] == ["⚠️ *LOW STOCK ALERT*", "⚠️ LOW STOCK ALERT",
+                                                       "⚠️ LOW STOCK ALERT"]
+
+
+def test_low_stock_alert_is_recorded_only_once_queued(db, sim_clock, monkeypatch):
+    database.add_medication_with_type("Metformin", "500mg", 1, "09:00", 2, "Tablet")
+    database.add_guardian("Patient", "Guardian", "+10000000000")
+    monkeypatch.setattr(database, 'get_medications_to_refill', lambda: [StockForecast(
+        medication_id=1, name="Metformin", dosage="500mg", remaining_count=2, daily_use=1.0, days_left=2.0)])
+    enqueue_outbox = database.enqueue_outbox
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(database, 'enqueue_outbox', unavailable)
+    scheduler.check_low_stock_medications()
+    get_async_database().flush()
+    assert not database.was_low_stock_alerted(1, '2025-06-01')
+
+    monkeypatch.setattr(database, 'enqueue_outbox', enqueue_outbox)
+    scheduler.check_low_stock_medications()
+    get_async_database().flush()
+    assert database.was_low_stock_alerted(1, '2025-06-01')
+    assert database.get_outbox_counts()['pending'] == 1
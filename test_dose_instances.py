@@ -0,0 +1,148 @@
+"""Tests for the materialized dose_instances table.
+
+Run with: python -m pytest -q test_dose_instances.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import db_pool
+import database
+from dose_instances import ALERT_ALERTED, ALERT_PENDING, ALERT_REMINDED, materialize_dose_instances
+
+DAY = datetime(2025, 6, 1)
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'instances.db'), size=1)
+    database.init_database()
+    database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+    database.add_medication_with_type("Metformin", "850mg", 1, "08:00", 60, "Tablet")
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = '2025-05-01'")
+    yield
+    db_pool.close_all_connections()
+
+
+def instances(date):
+    return [(i.medication_id, i.scheduled_time, i.status, i.alert_state)
+            for i in database.get_dose_instances_for_day(date)]
+
+
+def test_refresh_generates_today_and_look_ahead(db):
+    assert database.refresh_dose_instances(DAY) == 6
+    assert database.refresh_dose_instances(DAY) == 0
+
+    assert instances('2025-06-01') == [
+        (2, '08:00', None, ALERT_PENDING),
+        (1, '09:00', None, ALERT_PENDING),
+        (1, '21:00', None, ALERT_PENDING),
+    ]
+    assert len(instances('2025-06-02')) == 3
+    assert instances('2025-06-03') == []
+
+
+def test_existing_logs_are_picked_up(db):
+    database.log_medications_bulk([(1, "09:00", "Taken", "2025-06-01")])
+
+    database.refresh_dose_instances(DAY)
+
+    assert instances('2025-06-01')[1] == (1, '09:00', 'Taken', ALERT_PENDING)
+
+
+def test_logging_updates_the_instance(db):
+    database.refresh_dose_instances(DAY)
+
+    database.log_medications_bulk([(1, "21:00", "Missed", "2025-06-01"), (2, "Manual", "Taken", "2025-06-01")])
+    database.log_medications_bulk([(1, "21:00", "Taken", "2025-06-01")], overwrite=False)
+    assert [status for _, _, status, _ in instances('2025-06-01')] == [None, None, 'Missed']
+
+    database.log_medications_bulk([(1, "21:00", "Taken", "2025-06-01")])
+    assert [status for _, _, status, _ in instances('2025-06-01')] == [None, None, 'Taken']
+
+
+def test_medication_added_today_starts_after_now(db):
+    now = datetime.now()
+    earlier, later = now - timedelta(minutes=2), now + timedelta(minutes=2)
+    if earlier.date() != now.date() or later.date() != now.date():
+        pytest.skip("too close to midnight")
+
+    medication_id = database.add_medication_with_type(
+        "Ibuprofen", "200mg", 2, f"{earlier:%H:%M},{later:%H:%M}", 10, "Tablet")
+
+    today = [i.scheduled_time for i in database.get_dose_instances_for_day() if i.medication_id == medication_id]
+    assert today == [f"{later:%H:%M}"]
+
+
+def test_alert_state_only_moves_forward(db):
+    database.refresh_dose_instances(DAY)
+    key = (1, '2025-06-01', 9 * 60)
+
+    database.set_dose_instances_alert_state([key], ALERT_ALERTED)
+    database.set_dose_instances_alert_state([key], ALERT_REMINDED)
+
+    assert database.get_dose_instances_due(['2025-06-01 09:00'])[0].alert_state == ALERT_ALERTED
+    with pytest.raises(ValueError):
+        database.set_dose_instances_alert_state([key], 'sent')
+
+
+def test_upcoming_skips_logged_doses_and_wraps_to_tomorrow(db):
+    database.refresh_dose_instances(DAY)
+    database.log_medications_bulk([(1, "21:00", "Taken", "2025-06-01")])
+
+    upcoming = database.get_upcoming_dose_instances(limit=3, now=DAY.replace(hour=12))
+
+    assert [i.due_at for i in upcoming] == ['2025-06-02 08:00', '2025-06-02 09:00', '2025-06-02 21:00']
+
+
+def test_old_instances_are_pruned(db):
+    database.refresh_dose_instances(DAY)
+
+    database.refresh_dose_instances(DAY + timedelta(days=config.DOSE_INSTANCE_RETENTION_DAYS + 1))
+
+    assert instances('2025-06-01') == []
+
+
+def test_deleting_a_medication_removes_its_instances(db):
+    database.refresh_dose_instances(DAY)
+
+    database.delete_medication(1)
+
+    assert instances('2025-06-01') == [(2, '08:00', None, ALERT_PENDING)]
+
+
+def test_streak_counts_days_with_every_dose_taken(db):
+    medication_id = database.add_medication_with_type("Vitamin D", "1000IU", 1, "00:00", 30, "Tablet")
+    with db_pool.get_connection() as conn:
+        conn.execute('DELETE FROM medications WHERE id != ?', (medication_id,))
+        conn.execute("UPDATE medications SET added_date = '2000-01-01'")
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        materialize_dose_instances(conn, today - timedelta(days=5), 5)
+
+    days_ago = lambda n: (today - timedelta(days=n)).strftime('%Y-%m-%d')
+    database.log_medications_bulk([(medication_id, "00:00", "Taken", days_ago(n)) for n in (0, 1, 2, 4)])
+
+    # Three days ago was never logged, which ends the streak
+    assert database.get_medication_streak() == 3
+
+
+def test_upcoming_doses_span_days_and_skip_logged(db):
+    database.refresh_dose_instances(DAY)
+    database.log_medications_bulk([(1, "21:00", "Taken", "2025-06-01"), (2, "08:00", "Taken", "2025-06-02")])
+
+    upcoming = database.get_upcoming_doses(limit=5, now=DAY.replace(hour=12))
+
+    assert [(d.date, d.scheduled_time, d.medication_id) for d in upcoming] == [
+        ('2025-06-02', '09:00', 1), ('2025-06-02', '21:00', 1),
+        ('2025-06-03', '08:00', 2), ('2025-06-03', '09:00', 1), ('2025-06-03', '21:00', 1),
+    ]
+    assert upcoming[0].name == "Paracetamol"
+
+
+def test_upcoming_doses_for_one_medication_within_the_horizon(db):
+    upcoming = database.get_upcoming_doses(limit=10, now=DAY.replace(hour=8), medication_id=2, days=3)
+
+    assert [(d.date, d.scheduled_time) for d in upcoming] == [('2025-06-02', '08:00'), ('2025-06-03', '08:00')]
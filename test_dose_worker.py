@@ -0,0 +1,158 @@
+"""Tests for sharded dose workers leasing dose_instances.
+
+Run with: python -m pytest -q test_dose_worker.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import db_pool
+import database
+import scheduler
+from async_db import close_async_database
+from clock import SimulatedClock
+from dose_instances import ALERT_ALERTED, ALERT_PENDING, ALERT_REMINDED, claim_dose_instances
+from dose_worker import DoseWorker
+
+DAY = datetime(2025, 6, 1)
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'workers.db'), size=1)
+    database.init_database()
+    for name in ("Paracetamol", "Metformin", "Aspirin", "Vitamin D"):
+        database.add_medication_with_type(name, "10mg", 1, "09:00", 30, "Tablet")
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = '2025-05-01'")
+    database.refresh_dose_instances(DAY)
+    yield
+    close_async_database()
+    db_pool.close_all_connections()
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, doses):
+        if self.fail:
+            raise RuntimeError("gateway down")
+        self.calls.append(sorted((d.medication_id, d.name, d.date, d.scheduled_time) for d in doses))
+
+
+def worker(clock, shard=0, shards=1, **kwargs):
+    kwargs.setdefault('lease_seconds', 60)
+    kwargs.setdefault('orphan_seconds', 120)
+    return DoseWorker(shard, shards, on_reminder=kwargs.pop('on_reminder', Recorder()),
+                      on_missed=kwargs.pop('on_missed', Recorder()), clock=clock,
+                      worker_id=f'worker-{shard}', **kwargs)
+
+
+def alert_states():
+    return {i.medication_id: i.alert_state for i in database.get_dose_instances_for_day('2025-06-01')}
+
+
+def test_each_shard_reminds_only_its_medications(db):
+    clock = SimulatedClock(DAY.replace(hour=9))
+    workers = [worker(clock, shard, 2) for shard in range(2)]
+
+    assert [w.run_once() for w in workers] == [2, 2]
+
+    assert [[d[0] for d in w.on_reminder.calls[0]] for w in workers] == [[2, 4], [1, 3]]
+    assert set(alert_states().values()) == {ALERT_REMINDED}
+
+
+def test_reminder_then_missed_alert(db):
+    clock = SimulatedClock(DAY.replace(hour=9))
+    w = worker(clock)
+    w.run_once()
+    database.log_medications_bulk([(1, "09:00", "Taken", "2025-06-01")])
+
+    clock.advance(timedelta(minutes=2))
+    assert w.run_once() == 3
+
+    assert w.on_reminder.calls == [[(1, "Paracetamol", "2025-06-01", "09:00"),
+                                    (2, "Metformin", "2025-06-01", "09:00"),
+                                    (3, "Aspirin", "2025-06-01", "09:00"),
+                                    (4, "Vitamin D", "2025-06-01", "09:00")]]
+    assert [d[0] for d in w.on_missed.calls[0]] == [2, 3, 4]
+    assert alert_states() == {1: ALERT_REMINDED, 2: ALERT_ALERTED, 3: ALERT_ALERTED, 4: ALERT_ALERTED}
+
+    # Nothing is handled twice
+    clock.advance(timedelta(minutes=5))
+    assert w.run_once() == 0
+
+
+def test_lease_of_a_crashed_worker_expires(db):
+    now = DAY.replace(hour=9)
+    with db_pool.get_connection() as conn:
+        keys = claim_dose_instances(conn, 'crashed', (ALERT_PENDING,), now, now, 0, 1,
+                                    now - timedelta(minutes=2), now, timedelta(seconds=60), 10)
+    assert len(keys) == 4
+
+    clock = SimulatedClock(now + timedelta(seconds=30))
+    w = worker(clock)
+    assert w.run_once() == 0
+
+    # By now the doses are overdue, so they go straight to the missed alert
+    clock.advance(timedelta(seconds=31))
+    assert w.run_once() == 4
+    assert w.on_reminder.calls == []
+    assert set(alert_states().values()) == {ALERT_ALERTED}
+
+
+def test_other_workers_adopt_an_orphaned_shard(db):
+    clock = SimulatedClock(DAY.replace(hour=9, minute=1))
+    w = worker(clock, 0, 2, orphan_seconds=120)
+
+    # Shard 1 never runs: its doses are missed, but only shard 0 may claim them at first
+    assert w.run_once() == 2
+    assert alert_states() == {1: ALERT_PENDING, 2: ALERT_ALERTED, 3: ALERT_PENDING, 4: ALERT_ALERTED}
+
+    clock.advance(timedelta(minutes=2))
+    assert w.run_once() == 2
+    assert [d[0] for d in w.on_missed.calls[-1]] == [1, 3]
+
+
+def test_failed_handler_keeps_the_lease(db):
+    clock = SimulatedClock(DAY.replace(hour=9))
+    failing = worker(clock, on_reminder=Recorder(fail=True), lease_seconds=60)
+
+    assert failing.run_once() == 0
+    assert set(alert_states().values()) == {ALERT_PENDING}
+
+    retry = DoseWorker(0, 1, on_reminder=Recorder(), on_missed=Recorder(), clock=clock, worker_id='retry')
+    assert retry.run_once() == 0
+
+    clock.advance(timedelta(seconds=61))
+    assert retry.run_once() == 4
+
+
+def test_failed_outbox_write_keeps_the_lease(db, monkeypatch):
+    database.add_guardian("Patient", "Guardian", "+10000000000")
+    enqueue_outbox = database.enqueue_outbox
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(database, 'enqueue_outbox', unavailable)
+    clock = SimulatedClock(DAY.replace(hour=9, minute=2))
+    w = worker(clock, on_missed=scheduler.check_missed_medications, lease_seconds=60)
+
+    assert w.run_once() == 0
+    assert set(alert_states().values()) == {ALERT_PENDING}
+
+    monkeypatch.setattr(database, 'enqueue_outbox', enqueue_outbox)
+    clock.advance(timedelta(seconds=61))
+    assert w.run_once() == 4
+    assert set(alert_states().values()) == {ALERT_ALERTED}
+    assert database.get_outbox_counts()['pending'] == 4
+
+
+def test_shard_must_be_in_range():
+    with pytest.raises(ValueError):
+        DoseWorker(2, 2, on_reminder=print, on_missed=print)
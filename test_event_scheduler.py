@@ -0,0 +1,256 @@
+"""Tests for the heap-based dose event scheduler, driven by a simulated clock.
+
+Run with: python -m pytest -q test_event_scheduler.py
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from clock import SimulatedClock
+from event_scheduler import EventScheduler
+from models import DoseTime
+
+START = datetime(2025, 6, 1, 8, 30)
+
+
+def dose(medication_id, time_str, name="Med"):
+    hour, minute = map(int, time_str.split(':'))
+    return DoseTime(medication_id=medication_id, minute_of_day=hour * 60 + minute, name=name, dosage="10mg")
+
+
+class Harness:
+    """Event scheduler on a simulated clock that records what fired and when"""
+
+    def __init__(self, doses, start=START):
+        self.doses = list(doses)
+        self.clock = SimulatedClock(start)
+        self.fired = []
+        self.loads = []
+        self.scheduler = EventScheduler(self.load_doses, self.record('reminder'), self.record('missed'),
+                                        clock=self.clock)
+        self.scheduler.reload()
+
+    def load_doses(self, medication_id=None):
+        self.loads.append(medication_id)
+        return [d for d in self.doses if medication_id in (None, d.medication_id)]
+
+    def record(self, kind):
+        def handler(doses):
+            for d in doses:
+                self.fired.append((kind, self.clock.now(), d.medication_id, d.date, d.scheduled_time))
+        return handler
+
+
+def test_events_fire_exactly_on_time():
+    harness = Harness([dose(1, "09:00"), dose(2, "21:30")])
+
+    harness.scheduler.run_until(START.replace(hour=23))
+
+    assert harness.fired == [
+        ('reminder', datetime(2025, 6, 1, 9, 0), 1, '2025-06-01', '09:00'),
+        ('missed', datetime(2025, 6, 1, 9, 1), 1, '2025-06-01', '09:00'),
+        ('reminder', datetime(2025, 6, 1, 21, 30), 2, '2025-06-01', '21:30'),
+        ('missed', datetime(2025, 6, 1, 21, 31), 2, '2025-06-01', '21:30'),
+    ]
+
+
+def test_worker_sleeps_until_the_earliest_event():
+    harness = Harness([dose(1, "09:00"), dose(2, "08:45")])
+
+    assert harness.scheduler.next_due() == datetime(2025, 6, 1, 8, 45)
+    assert harness.scheduler.seconds_until_next() == 15 * 60
+
+    harness.clock.set(datetime(2025, 6, 1, 8, 44, 59))
+    assert harness.scheduler.run_pending() == 0
+
+
+def test_doses_sharing_a_time_fire_together():
+    batches = []
+    clock = SimulatedClock(START)
+    scheduler = EventScheduler(lambda: [dose(1, "09:00"), dose(2, "09:00")], lambda doses: None,
+                               lambda doses: batches.append([d.medication_id for d in doses]), clock=clock)
+    scheduler.reload()
+
+    scheduler.run_until(START.replace(hour=10))
+
+    assert batches == [[1, 2]]
+
+
+def test_events_repeat_daily():
+    harness = Harness([dose(1, "09:00")])
+
+    harness.scheduler.run_until(START + timedelta(days=2))
+
+    missed_dates = [date for kind, _, _, date, _ in harness.fired if kind == 'missed']
+    assert missed_dates == ['2025-06-01', '2025-06-02']
+
+
+def test_missed_deadline_after_midnight_keeps_the_dose_date():
+    harness = Harness([dose(1, "23:59")])
+
+    harness.scheduler.run_until(datetime(2025, 6, 2, 0, 5))
+
+    assert harness.fired[-1] == ('missed', datetime(2025, 6, 2, 0, 0), 1, '2025-06-01', '23:59')
+
+
+def test_started_after_reminder_still_tracks_the_deadline():
+    harness = Harness([dose(1, "08:30")], start=START + timedelta(seconds=20))
+
+    harness.scheduler.run_until(START.replace(hour=9))
+
+    assert [kind for kind, *_ in harness.fired] == ['missed']
+
+
+def test_reload_picks_up_medication_changes():
+    harness = Harness([dose(1, "09:00")])
+
+    harness.doses = [dose(2, "10:00")]
+    harness.scheduler.reload()
+    harness.scheduler.run_until(START.replace(hour=11))
+
+    assert {medication_id for _, _, medication_id, _, _ in harness.fired} == {2}
+
+
+def test_daily_jobs_run_and_survive_reload():
+    runs = []
+    harness = Harness([])
+    harness.scheduler.add_daily_job("22:00", lambda: runs.append(harness.clock.now()))
+    harness.scheduler.reload()
+
+    harness.scheduler.run_until(START + timedelta(days=1))
+
+    assert runs == [datetime(2025, 6, 1, 22, 0)]
+
+
+def test_failing_handler_does_not_stop_other_events(capsys):
+    clock = SimulatedClock(START)
+    fired = []
+
+    def broken(doses):
+        raise RuntimeError("twilio down")
+
+    scheduler = EventScheduler(lambda: [dose(1, "09:00")], lambda doses: fired.append('reminder'), broken,
+                               clock=clock)
+    scheduler.reload()
+    scheduler.add_daily_job("09:30", lambda: fired.append('job'))
+
+    scheduler.run_until(START.replace(hour=10))
+
+    assert fired == ['reminder', 'job']
+    assert "twilio down" in capsys.readouterr().out
+
+
+def test_invalid_job_time_is_rejected():
+    with pytest.raises(ValueError):
+        Harness([]).scheduler.add_daily_job("25:00", lambda: None)
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_worker_thread_wakes_when_clock_reaches_event():
+    harness = Harness([dose(1, "09:00")])
+    scheduler = harness.scheduler
+    scheduler.start()
+    try:
+        # The worker is asleep until the clock moves; nothing fires early
+        time.sleep(0.05)
+        assert harness.fired == []
+
+        started = time.monotonic()
+        harness.clock.set(datetime(2025, 6, 1, 9, 0))
+        assert wait_for(lambda: len(harness.fired) == 1)
+        assert time.monotonic() - started < 1.0
+    finally:
+        scheduler.stop(timeout=2)
+
+    assert not scheduler.running
+
+
+def test_notify_changed_wakes_worker_to_reload():
+    harness = Harness([])
+    reloaded = threading.Event()
+    load = harness.scheduler.load_doses
+
+    def load_doses():
+        reloaded.set()
+        return load()
+
+    harness.scheduler.start()
+    harness.scheduler.load_doses = load_doses
+    try:
+        harness.doses = [dose(1, "08:45")]
+        harness.scheduler.notify_changed()
+        assert reloaded.wait(1.0)
+        assert wait_for(lambda: harness.scheduler.next_due() == datetime(2025, 6, 1, 8, 45))
+    finally:
+        harness.scheduler.stop(timeout=2)
+
+
+def test_reloading_unchanged_doses_does_not_duplicate_events():
+    harness = Harness([dose(1, "09:00"), dose(2, "09:00")])
+
+    for _ in range(3):
+        assert harness.scheduler.reload() == (0, 0, 0)
+    harness.scheduler.run_until(START.replace(hour=10))
+
+    assert len(harness.fired) == 4
+
+
+def test_refreshing_one_medication_leaves_the_others_alone():
+    harness = Harness([dose(1, "09:00"), dose(2, "12:00")])
+    entries_before = {entry for entry in harness.scheduler._heap if entry[3][0] == 2}
+
+    harness.doses = [dose(1, "10:00"), dose(2, "12:00")]
+    assert harness.scheduler.reload(1) == (1, 0, 1)
+
+    assert harness.loads[-1] == 1
+    assert {entry for entry in harness.scheduler._heap if entry[3][0] == 2} == entries_before
+
+    harness.scheduler.run_until(START.replace(hour=13))
+    assert [(kind, t.hour, t.minute) for kind, t, *_ in harness.fired if kind == 'reminder'] == \
+        [('reminder', 10, 0), ('reminder', 12, 0)]
+
+
+def test_renamed_dose_keeps_its_events():
+    harness = Harness([dose(1, "09:00", name="Old")])
+
+    harness.doses = [dose(1, "09:00", name="New")]
+    assert harness.scheduler.reload(1) == (0, 1, 0)
+
+    names = []
+    harness.scheduler.on_reminder = lambda doses: names.extend(d.name for d in doses)
+    harness.scheduler.run_until(START.replace(hour=10))
+    assert names == ["New"]
+
+
+def test_removed_medication_events_are_skipped_and_compacted():
+    harness = Harness([dose(i, "09:00") for i in range(1, 11)])
+
+    for medication_id in range(1, 10):
+        harness.scheduler.remove_medication(medication_id)
+
+    assert harness.scheduler.dose_count == 1
+    assert len(harness.scheduler._heap) < 20
+
+    harness.scheduler.run_until(START.replace(hour=10))
+    assert {medication_id for _, _, medication_id, _, _ in harness.fired} == {10}
+
+
+def test_notify_changed_refreshes_only_that_medication():
+    harness = Harness([dose(1, "09:00")])
+    harness.scheduler.start()
+    try:
+        harness.doses.append(dose(2, "08:45"))
+        harness.scheduler.notify_changed(2)
+        assert wait_for(lambda: harness.scheduler.dose_count == 2)
+        # Initial load, start(), then just the changed medication
+        assert harness.loads == [None, None, 2]
+    finally:
+        harness.scheduler.stop(timeout=2)
@@ -0,0 +1,111 @@
+"""Tests for the text and integer schedule_log storage modes.
+
+Run with: python -m pytest -q test_log_storage.py
+"""
+from datetime import datetime
+
+import pytest
+
+import config
+import db_pool
+import database
+import log_storage
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'storage.db'), size=1)
+    database.init_database()
+    database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+    yield
+    db_pool.close_all_connections()
+
+
+def all_logs():
+    with db_pool.get_connection() as conn:
+        return conn.execute('''
+            SELECT id, medication_id, date, scheduled_time, actual_time, status
+            FROM schedule_log ORDER BY id
+        ''').fetchall()
+
+
+def convert(name):
+    with db_pool.get_connection() as conn:
+        return log_storage.convert_log_storage(conn, name)
+
+
+def write_logs():
+    database.log_medications_bulk([
+        (1, "09:00", "Taken", "2025-01-01"),
+        (1, "21:00", "Missed", "2025-01-01"),
+        (1, "09:00", "Delayed", "2025-03-15"),
+    ])
+    database.log_medication_taken(1, "Manual", "Taken")
+
+
+def test_conversion_round_trip_keeps_rows(db):
+    write_logs()
+    before = all_logs()
+
+    assert convert('integer')
+    assert log_storage.get_log_storage() is log_storage.INTEGER
+    assert all_logs() == before
+
+    assert convert('text')
+    assert log_storage.get_log_storage() is log_storage.TEXT
+    assert all_logs() == before
+
+
+def test_converting_to_current_mode_is_a_no_op(db):
+    assert not convert('text')
+
+
+def test_integer_mode_stores_integers(db):
+    convert('integer')
+    write_logs()
+
+    with db_pool.get_connection() as conn:
+        row = conn.execute("SELECT day, minute FROM schedule_log WHERE date = '2025-03-15'").fetchone()
+    assert row == (log_storage.to_epoch_day('2025-03-15'), 540)
+    assert database.check_medication_status(1, "Manual", datetime.now().strftime('%Y-%m-%d')) == 'Taken'
+
+
+def test_rollup_follows_writes_after_conversion(db):
+    convert('integer')
+    write_logs()
+    database.log_medications_bulk([(1, "21:00", "Taken", "2025-01-01")])
+
+    rollup = database.get_daily_adherence(100000)
+    assert rollup[:2] == [('2025-01-01', 'Taken', 2), ('2025-03-15', 'Delayed', 1)]
+
+
+def test_ids_are_not_reused_after_conversion(db):
+    write_logs()
+    database.delete_medication(1)
+
+    convert('integer')
+    database.log_medication_taken(1, "09:00", "Taken")
+
+    assert all_logs()[0][0] == 5
+
+
+def test_unparseable_time_is_rejected(db):
+    convert('integer')
+
+    with pytest.raises(ValueError):
+        database.log_medication_taken(1, "morning", "Taken")
+
+
+def test_init_database_applies_configured_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_STORAGE', 'integer')
+    db_pool.configure_pool(str(tmp_path / 'configured.db'), size=1)
+    database.init_database()
+
+    with db_pool.get_connection() as conn:
+        assert log_storage.detect_log_storage(conn) is log_storage.INTEGER
+    db_pool.close_all_connections()
+
+
+def test_unknown_mode_is_rejected(db):
+    with pytest.raises(ValueError):
+        convert('binary')
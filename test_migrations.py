@@ -0,0 +1,104 @@
+"""Tests for the PRAGMA user_version migration engine.
+
+Run with: python -m pytest -q test_migrations.py
+"""
+import sqlite3
+
+import pytest
+
+import db_pool
+import database
+import migrations
+from migrations import get_schema_version, latest_version, migrate
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'migrate.db'), size=1)
+    with db_pool.get_connection() as conn:
+        yield conn
+    db_pool.close_all_connections()
+
+
+def create_legacy_schema(conn):
+    """Schema as shipped before med_type, indexes and migrations existed"""
+    conn.execute('''
+        CREATE TABLE medications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, dosage TEXT NOT NULL,
+            frequency INTEGER NOT NULL, times TEXT NOT NULL, total_count INTEGER NOT NULL,
+            remaining_count INTEGER NOT NULL, added_date TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE schedule_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, medication_id INTEGER NOT NULL,
+            scheduled_time TEXT NOT NULL, actual_time TEXT, status TEXT NOT NULL, date TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO medications (name, dosage, frequency, times, total_count, remaining_count, added_date)
+        VALUES ('Aspirin', '75mg', 1, '09:00', 30, 30, '2025-01-01')
+    ''')
+    for status in ('Missed', 'Taken'):
+        conn.execute('''
+            INSERT INTO schedule_log (medication_id, scheduled_time, status, date)
+            VALUES (1, '09:00', ?, '2025-01-02')
+        ''', (status,))
+    conn.commit()
+
+
+def test_fresh_database_reaches_latest_version(conn):
+    applied = migrate(conn)
+
+    assert [version for version, _ in applied] == [m[0] for m in migrations.MIGRATIONS]
+    assert get_schema_version(conn) == latest_version()
+
+
+def test_migrate_is_a_no_op_when_current(conn):
+    migrate(conn)
+
+    assert migrate(conn) == []
+
+
+def test_legacy_database_is_upgraded(conn):
+    create_legacy_schema(conn)
+
+    migrate(conn)
+
+    med_type = conn.execute('SELECT med_type FROM medications').fetchone()[0]
+    assert med_type == 'Tablet'
+
+    # Duplicate dose rows collapse to the latest before the unique index is built
+    rows = conn.execute('SELECT status FROM schedule_log').fetchall()
+    assert rows == [('Taken',)]
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'low_stock_alerts', 'prescriptions', 'guardian'} <= tables
+
+
+def test_failed_migration_rolls_back(conn, monkeypatch):
+    def broken(conn):
+        conn.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError("boom")
+
+    migrate(conn)
+    version = latest_version()
+    monkeypatch.setattr(migrations, 'MIGRATIONS',
+                        migrations.MIGRATIONS + [(version + 1, "Broken", broken)])
+
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+
+    assert get_schema_version(conn) == version
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute('SELECT * FROM half_done')
+
+
+def test_init_database_runs_migrations_once(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'init.db'), size=1)
+    database.init_database()
+    database.init_database()
+
+    with db_pool.get_connection() as conn:
+        assert get_schema_version(conn) == latest_version()
+    db_pool.close_all_connections()
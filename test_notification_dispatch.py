@@ -0,0 +1,117 @@
+"""Tests for background notification delivery.
+
+Run with: python -m pytest -q test_notification_dispatch.py
+"""
+import threading
+import time
+
+import pytest
+
+from notification_dispatch import NotificationDispatcher, NotificationQueueFull
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = NotificationDispatcher({'desktop': (1, 5, 10), 'whatsapp': (2, 0.2, 2)})
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_submit_returns_before_delivery(dispatcher):
+    release = threading.Event()
+    future = dispatcher.submit('whatsapp', lambda phone: release.wait(5) and phone, phone='+100')
+
+    assert not future.done()
+    release.set()
+    assert future.result(5) == '+100'
+    assert dispatcher.metrics()['whatsapp']['count'] == 1
+
+
+def test_concurrency_is_limited_per_channel(dispatcher):
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def send():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    futures = [dispatcher.submit('desktop', send) for _ in range(5)]
+    for future in futures:
+        future.result(5)
+
+    assert peak[0] == 1
+    assert dispatcher.metrics()['desktop']['max_wait_ms'] > 0
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_slow_delivery_times_out_and_frees_its_slot(dispatcher):
+    release = threading.Event()
+    slow = [dispatcher.submit('whatsapp', release.wait, 5) for _ in range(2)]
+
+    for future in slow:
+        with pytest.raises(TimeoutError):
+            future.result(5)
+    # Both slots went to fresh threads while the stuck calls run on
+    assert dispatcher.submit('whatsapp', lambda: 'sent').result(1) == 'sent'
+    metrics = dispatcher.metrics()['whatsapp']
+    assert (metrics['timeouts'], metrics['in_flight'], metrics['hung']) == (2, 0, 2)
+
+    release.set()
+    assert wait_for(lambda: dispatcher.metrics()['whatsapp']['hung'] == 0)
+
+
+def test_hung_threads_are_capped_at_the_concurrency(dispatcher):
+    release = threading.Event()
+    for timeouts in (2, 4):
+        for _ in range(2):
+            dispatcher.submit('whatsapp', release.wait, 5)
+        assert wait_for(lambda: dispatcher.metrics()['whatsapp']['timeouts'] == timeouts)
+    metrics = dispatcher.metrics()['whatsapp']
+    # The last two timed out but keep their slots, as no more threads may be left behind
+    assert (metrics['hung'], metrics['in_flight']) == (2, 2)
+    queued = dispatcher.submit('whatsapp', lambda: 'sent')
+    assert not queued.done()
+
+    release.set()
+    assert queued.result(5) == 'sent'
+
+
+def test_full_queue_drops_instead_of_blocking(dispatcher):
+    release = threading.Event()
+    for _ in range(2):
+        dispatcher.submit('whatsapp', release.wait, 5)
+    while dispatcher.metrics()['whatsapp']['in_flight'] < 2:
+        time.sleep(0.001)
+    for _ in range(2):
+        dispatcher.submit('whatsapp', release.wait, 5)
+
+    dropped = dispatcher.submit('whatsapp', lambda: 'sent')
+
+    with pytest.raises(NotificationQueueFull):
+        dropped.result(0)
+    assert dispatcher.metrics()['whatsapp']['dropped'] == 1
+    release.set()
+
+
+def test_errors_reach_the_future(dispatcher):
+    def fail():
+        raise ConnectionError("twilio down")
+
+    with pytest.raises(ConnectionError):
+        dispatcher.submit('whatsapp', fail).result(5)
+    assert dispatcher.metrics()['whatsapp']['errors'] == 1
+
+
+def test_unknown_channel(dispatcher):
+    with pytest.raises(ValueError):
+        dispatcher.submit('sms', print)
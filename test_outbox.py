@@ -0,0 +1,241 @@
+"""Tests for the guardian message outbox and its delivery worker.
+
+Messages are delivered through a real NotificationDispatcher with a
+recording send function, on a simulated clock so backoff, rate limits and
+the coalescing window can be stepped.
+
+Run with: python -m pytest -q test_outbox.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import clock
+import database
+import db_pool
+from notification_dispatch import NotificationDispatcher
+from outbox import CLAIM_OUTBOX, claim_due, take_tokens
+from outbox_worker import OutboxWorker
+
+NOW = datetime(2025, 6, 1, 9, 0)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'outbox.db'), size=2)
+    database.init_database()
+    yield
+    db_pool.close_all_connections()
+
+
+@pytest.fixture
+def sim_clock():
+    sim_clock = clock.SimulatedClock(NOW)
+    previous = clock.set_clock(sim_clock)
+    yield sim_clock
+    clock.set_clock(previous)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = NotificationDispatcher({'whatsapp': (2, 5, 100)})
+    yield dispatcher
+    dispatcher.close()
+
+
+class Sender:
+    """Records deliveries; raises the next queued errors first"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def __call__(self, delivery):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((delivery.recipient, delivery.body))
+        return f"SM{len(self.sent)}"
+
+
+class RejectedNumber(Exception):
+    status = 400
+
+
+def message(key, body="Dose missed", recipient="+10000000000", payload=None):
+    return (key, key.split(':')[0], recipient, body, payload)
+
+
+def make_worker(sender, dispatcher, sim_clock, **settings):
+    settings = {'max_attempts': 3, 'retry_base_seconds': 30, 'retry_max_seconds': 3600,
+                'rate_burst': 100, 'rate_per_hour': 3600, **settings}
+    return OutboxWorker(send=sender, dispatcher=dispatcher, clock=sim_clock, **settings)
+
+
+def outbox_row(key):
+    with db_pool.get_connection() as conn:
+        return conn.execute('SELECT status, attempts, next_attempt_at, last_error FROM outbox '
+                            'WHERE idempotency_key = ?', (key,)).fetchone()
+
+
+def test_enqueue_is_idempotent(db, sim_clock):
+    assert database.enqueue_outbox([message('missed_dose:1:2025-06-01:540'),
+                                    message('missed_dose:2:2025-06-01:540')]) == 2
+    assert database.enqueue_outbox([message('missed_dose:1:2025-06-01:540', "Again")]) == 0
+
+    assert database.get_outbox_counts()['pending'] == 2
+
+
+def test_enqueue_marks_doses_alerted_in_the_same_write(db, sim_clock):
+    database.add_medication_with_type("Paracetamol", "500mg", 1, "09:30", 30, "Tablet")
+    key = (1, '2025-06-01', 570)
+
+    database.enqueue_outbox([message('missed_dose:1:2025-06-01:570')], [key])
+
+    [instance] = database.get_dose_instances_for_day('2025-06-01')
+    assert instance.alert_state == 'alerted'
+
+
+def test_worker_delivers_and_marks_sent(db, sim_clock, dispatcher):
+    sender = Sender()
+    database.enqueue_outbox([message(f'missed_dose:{i}:2025-06-01:540', f"Dose {i}") for i in range(5)])
+
+    assert make_worker(sender, dispatcher, sim_clock).drain() == {'sent': 5, 'retrying': 0, 'dead': 0,
+                                                                  'deferred': 0}
+
+    assert sorted(body for _, body in sender.sent) == [f"Dose {i}" for i in range(5)]
+    assert database.get_outbox_counts() == {'pending': 0, 'sent': 5, 'dead': 0, 'oldest_pending_at': None}
+    # Nothing left to send
+    assert make_worker(sender, dispatcher, sim_clock).run_once()['sent'] == 0
+
+
+def test_failures_back_off_exponentially(db, sim_clock, dispatcher):
+    sender = Sender(ConnectionError("Twilio down"), ConnectionError("Twilio down"))
+    worker = make_worker(sender, dispatcher, sim_clock)
+    database.enqueue_outbox([message('daily_summary:2025-06-01')])
+
+    assert worker.run_once()['retrying'] == 1
+    assert outbox_row('daily_summary:2025-06-01') == ('pending', 1, '2025-06-01 09:00:30', 'Twilio down')
+
+    # Not due again until the backoff is over
+    sim_clock.advance(timedelta(seconds=29))
+    assert worker.run_once()['retrying'] == 0
+    sim_clock.advance(timedelta(seconds=1))
+    assert worker.run_once()['retrying'] == 1
+    assert outbox_row('daily_summary:2025-06-01')[:3] == ('pending', 2, '2025-06-01 09:01:30')
+
+    sim_clock.advance(timedelta(minutes=1))
+    assert worker.run_once()['sent'] == 1
+    assert outbox_row('daily_summary:2025-06-01')[0] == 'sent'
+
+
+def test_dead_letters_after_max_attempts_and_can_be_requeued(db, sim_clock, dispatcher):
+    sender = Sender(*[ConnectionError("Twilio down")] * 3)
+    worker = make_worker(sender, dispatcher, sim_clock, retry_base_seconds=0)
+    database.enqueue_outbox([message('low_stock:1:2025-06-01')])
+
+    for _ in range(3):
+        worker.run_once()
+
+    assert outbox_row('low_stock:1:2025-06-01')[:2] == ('dead', 3)
+    [dead] = database.get_dead_letters()
+    assert (dead.kind, dead.last_error) == ('low_stock', 'Twilio down')
+
+    assert database.requeue_dead_letters() == 1
+    assert worker.drain()['sent'] == 1
+    assert database.get_outbox_counts()['dead'] == 0
+
+
+def test_permanent_errors_dead_letter_at_once(db, sim_clock, dispatcher):
+    worker = make_worker(Sender(RejectedNumber("Invalid 'To' number")), dispatcher, sim_clock)
+    database.enqueue_outbox([message('missed_dose:1:2025-06-01:540')])
+
+    assert worker.run_once()['dead'] == 1
+    assert outbox_row('missed_dose:1:2025-06-01:540')[:2] == ('dead', 1)
+
+
+def test_missed_dose_alerts_for_one_guardian_merge_into_a_digest(db, sim_clock, dispatcher):
+    sender = Sender()
+    digests = {'missed_dose': lambda messages: " + ".join(m.body for m in messages)}
+    database.enqueue_outbox([
+        message(f'missed_dose:{i}:2025-06-01:540', f"Dose {i}", payload={'medication_name': f"Med {i}"})
+        for i in range(3)
+    ] + [
+        message('missed_dose:9:2025-06-01:540', "Other guardian", recipient="+20000000000", payload={}),
+        message('daily_summary:2025-06-01', "Summary"),
+    ], delay_seconds=10)
+
+    worker = make_worker(sender, dispatcher, sim_clock, digests=digests)
+    # Held back for the coalescing window
+    assert worker.run_once()['sent'] == 0
+    sim_clock.advance(timedelta(seconds=10))
+
+    assert worker.run_once()['sent'] == 5
+    assert sorted(sender.sent) == [("+10000000000", "Dose 0 + Dose 1 + Dose 2"),
+                                   ("+10000000000", "Summary"),
+                                   ("+20000000000", "Other guardian")]
+    assert database.get_outbox_counts()['sent'] == 5
+
+
+def test_rate_limit_defers_per_recipient(db, sim_clock, dispatcher):
+    sender = Sender()
+    worker = make_worker(sender, dispatcher, sim_clock, rate_burst=2, rate_per_hour=60)
+    database.enqueue_outbox([message(f'low_stock:{i}:2025-06-01', f"Refill {i}") for i in range(4)] +
+                            [message('low_stock:9:2025-06-01', "Refill", recipient="+20000000000")])
+
+    assert worker.run_once() == {'sent': 3, 'retrying': 0, 'dead': 0, 'deferred': 2}
+    # Deferred to the next token, a minute later, without using an attempt
+    assert outbox_row('low_stock:2:2025-06-01')[:3] == ('pending', 0, '2025-06-01 09:01:00')
+
+    sim_clock.advance(timedelta(seconds=59))
+    assert worker.run_once()['sent'] == 0
+    sim_clock.advance(timedelta(seconds=1))
+    assert worker.run_once() == {'sent': 1, 'retrying': 0, 'dead': 0, 'deferred': 1}
+    sim_clock.advance(timedelta(minutes=1))
+    assert worker.run_once()['sent'] == 1
+    assert len(sender.sent) == 5
+
+
+def test_rate_limit_without_refill_is_rejected(dispatcher, sim_clock):
+    for burst, per_hour in ((3, 0), (0, 12)):
+        with pytest.raises(ValueError):
+            make_worker(Sender(), dispatcher, sim_clock, rate_burst=burst, rate_per_hour=per_hour)
+
+
+def test_token_bucket_bounds_messages_per_hour(db):
+    sent = 0
+    with db_pool.get_connection() as conn:
+        for minute in range(60):
+            granted, _ = take_tokens(conn, "+10000000000", 10, NOW + timedelta(minutes=minute), 3, 12)
+            sent += granted
+
+    assert sent == 3 + 11
+
+
+def test_claimed_messages_come_back_when_the_lease_expires(db, sim_clock):
+    database.enqueue_outbox([message('missed_dose:1:2025-06-01:540')])
+
+    with db_pool.get_connection() as conn:
+        assert len(claim_due(conn, NOW, timedelta(minutes=5), 10)) == 1
+        # A second worker finds nothing while the lease holds...
+        assert claim_due(conn, NOW + timedelta(minutes=4), timedelta(minutes=5), 10) == []
+        # ...and takes over after the first one died without finishing
+        [retried] = claim_due(conn, NOW + timedelta(minutes=5), timedelta(minutes=5), 10)
+    assert retried.attempts == 0
+
+
+def test_prune_keeps_pending_and_recent_messages(db, sim_clock, dispatcher):
+    database.enqueue_outbox([message('daily_summary:2025-05-01')])
+    make_worker(Sender(), dispatcher, sim_clock).drain()
+    database.enqueue_outbox([message('daily_summary:2025-06-01')])
+
+    assert database.prune_outbox(NOW + timedelta(days=29)) == 0
+    assert database.prune_outbox(NOW + timedelta(days=31)) == 1
+    assert database.get_outbox_counts()['pending'] == 1
+
+
+def test_claim_uses_the_pending_index(db):
+    with db_pool.get_connection() as conn:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + CLAIM_OUTBOX, ('', '', 1))]
+
+    assert any('idx_outbox_due' in line for line in plan)
+    assert not any(line.startswith('SCAN outbox') for line in plan)
@@ -0,0 +1,110 @@
+"""Query plan regression tests for the schedule_log and rollup helpers.
+
+Each helper is run against a scratch database with a trace callback that
+records the SQL it executes. Every captured statement is then fed to
+EXPLAIN QUERY PLAN, and the test fails if SQLite plans a full scan of
+schedule_log, daily_adherence, dose_times or dose_instances instead of
+using an index.
+
+Run with: python -m pytest -q test_query_plans.py
+"""
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import db_pool
+import database
+from migrations import SCHEDULE_LOG_INDEXES
+
+TABLES = ('schedule_log', 'daily_adherence', 'dose_times', 'dose_instances')
+
+# Any "SCAN schedule_log" / "SCAN sl" line, even over a covering index,
+# reads every row; only SEARCH plans are bounded by the filter
+FULL_SCAN = re.compile(r'^SCAN (schedule_log|sl|daily_adherence|dose_times|dt|dose_instances|di)\b')
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'plans.db'), size=1)
+    database.init_database()
+
+    database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+    database.add_medication_with_type("Metformin", "850mg", 1, "08:00", 60, "Tablet")
+    database.log_medication_taken(1, "09:00", "Taken")
+    database.log_medication_taken(2, "08:00", "Missed")
+
+    yield
+    db_pool.close_all_connections()
+
+
+def capture_statements(func, *args):
+    """Run a helper and return the SQL statements it executed"""
+    statements = []
+    with db_pool.get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            func(*args)
+        finally:
+            conn.set_trace_callback(None)
+    return [sql for sql in statements if any(table in sql for table in TABLES)]
+
+
+def full_scans(sql):
+    """Return the plan lines that scan a whole table"""
+    with db_pool.get_connection() as conn:
+        details = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+
+    # Walking an index in ORDER BY order stops after LIMIT rows, so it is
+    # bounded as long as SQLite doesn't need a temp b-tree to sort first
+    ordered_limit = LIMIT.search(sql) and not any('TEMP B-TREE' in detail for detail in details)
+
+    return [detail for detail in details
+            if FULL_SCAN.match(detail) and not (ordered_limit and 'USING' in detail)]
+
+
+NOW = datetime.now()
+TODAY = NOW.strftime('%Y-%m-%d')
+
+HELPERS = [
+    (database.log_medication_taken, (1, "21:00", "Taken")),
+    (database.check_medication_status, (1, "09:00", TODAY)),
+    (database.get_adherence_data, (7,)),
+    (database.get_daily_adherence, (7,)),
+    (database.get_medication_history, (1, 30)),
+    (database.get_missed_medications_today, ()),
+    (database.get_recent_missed_doses, (10,)),
+    (database.get_adherence_statistics, (30,)),
+    (database.get_medication_streak, ()),
+    (database.get_doses_due_between, (NOW - timedelta(minutes=90), NOW)),
+    (database.get_doses_from_minute, (540, 5)),
+    (database.get_dose_schedule, (1,)),
+    (database.get_dose_instances_for_day, (TODAY,)),
+    (database.get_dose_instances_due, ([f"{TODAY} 09:00", f"{TODAY} 21:00"],)),
+    (database.get_upcoming_dose_instances, (5,)),
+    (database.get_upcoming_doses, (5, NOW)),
+    (database.get_upcoming_doses, (5, NOW, 1, 3)),
+    (database.get_stock_forecast, (NOW.date() + timedelta(days=1),)),
+    (database.set_dose_instances_alert_state, ([(1, TODAY, 540)], 'alerted')),
+    (database.delete_medication, (2,)),
+]
+
+
+@pytest.mark.parametrize('func, args', HELPERS, ids=[func.__name__ for func, _ in HELPERS])
+def test_helper_uses_index(db, func, args):
+    statements = capture_statements(func, *args)
+    assert statements, f"{func.__name__} issued no log or rollup queries"
+
+    for sql in statements:
+        assert not full_scans(sql), f"{func.__name__} scans a whole table:\n{sql}"
+
+
+def test_managed_indexes_exist(db):
+    with db_pool.get_connection() as conn:
+        names = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'schedule_log'"
+        )}
+    assert set(SCHEDULE_LOG_INDEXES) <= names
@@ -0,0 +1,87 @@
+"""Tests for the simulated-clock replay harness.
+
+These drive the harness with a small EventScheduler whose handlers notify
+the way the app's scheduler does: desktop reminders through the
+dispatcher, missed-dose alerts through the outbox.
+
+Run with: python -m pytest -q test_replay.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import clock
+import database
+import db_pool
+from async_db import close_async_database
+from event_scheduler import EventScheduler
+from notification_dispatch import get_dispatcher
+from replay import run_replay
+
+START = datetime(2025, 6, 2)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'replay.db'), size=4)
+    database.init_database()
+    yield
+    close_async_database()
+    db_pool.close_all_connections()
+
+
+def _show_notification(med_name, dosage):
+    raise AssertionError("the harness must record, not send")
+
+
+def create_scheduler():
+    def remind(doses):
+        for dose in doses:
+            get_dispatcher().submit('desktop', _show_notification, med_name=dose.name, dosage=dose.dosage)
+
+    def check_missed(doses):
+        database.enqueue_outbox([
+            (f"missed_dose:{dose.medication_id}:{dose.date}:{dose.minute_of_day}", 'missed_dose',
+             "+10000000000", f"Missed {dose.name}")
+            for dose in doses
+            if database.check_medication_status(dose.medication_id, dose.scheduled_time, dose.date) != 'Taken'
+        ])
+
+    scheduler = EventScheduler(database.get_dose_schedule, remind, check_missed)
+    scheduler.add_daily_job("00:00", database.refresh_dose_instances)
+    return scheduler
+
+
+def test_weeks_of_alerts_replay_in_simulated_time(db):
+    result = run_replay(days=14, medications=6, take_rate=0.5, start=START, create_scheduler=create_scheduler)
+
+    senders = [n.sender for n in result['notifications']]
+    # Six medications with 1, 2 and 3 doses a day
+    assert senders.count('_show_notification') == 14 * 12
+    assert 0 < senders.count('missed_dose') < 14 * 12
+    # The outbox is drained every tick
+    assert database.get_outbox_counts()['pending'] == 0
+    assert all(n.sent_at <= START + timedelta(days=14) for n in result['notifications'])
+
+    assert set(result['latencies']['reminder']) == {0}
+    assert set(result['latencies']['missed alert']) == {60}
+    assert result['wall_seconds'] < 60
+
+
+def test_ticks_report_queries_and_cpu(db):
+    result = run_replay(days=2, medications=3, take_rate=1.0, start=START, create_scheduler=create_scheduler)
+
+    assert result['latencies']['missed alert'] == []
+    fired, queries, cpu = zip(*result['ticks'])
+    assert all(count >= 1 for count in fired)
+    assert max(queries) > 0
+    assert all(seconds >= 0 for seconds in cpu)
+
+
+def test_clock_and_dispatcher_are_restored(db):
+    before = clock.get_clock()
+
+    run_replay(days=1, medications=1, start=START, create_scheduler=create_scheduler)
+
+    assert clock.get_clock() is before
+    assert abs(clock.now() - datetime.now()) < timedelta(seconds=5)
@@ -0,0 +1,83 @@
+"""Tests that the daily_adherence rollup matches the raw schedule_log.
+
+Run with: python -m pytest -q test_rollup.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_pool
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'rollup.db'), size=1)
+    database.init_database()
+    yield
+    db_pool.close_all_connections()
+
+
+def days_ago(n):
+    return (datetime.now() - timedelta(days=n)).strftime('%Y-%m-%d')
+
+
+def raw_counts(days):
+    """Aggregate straight from schedule_log, the way the readers used to"""
+    with db_pool.get_connection() as conn:
+        return conn.execute('''
+            SELECT date, status, COUNT(*) FROM schedule_log
+            WHERE date >= date('now', '-{} days')
+            GROUP BY date, status ORDER BY date
+        '''.format(days)).fetchall()
+
+
+def write_history():
+    database.log_medications_bulk([
+        (1, "09:00", "Taken", days_ago(3)),
+        (1, "21:00", "Missed", days_ago(3)),
+        (2, "08:00", "Taken", days_ago(2)),
+        (1, "09:00", "Taken", days_ago(1)),
+        (2, "08:00", "Delayed", days_ago(1)),
+    ])
+    # Status changes move the count from one column to another
+    database.log_medications_bulk([(1, "21:00", "Taken", days_ago(3))])
+    database.log_medication_taken(1, "09:00", "Missed")
+    database.log_medication_taken(1, "09:00", "Taken")
+
+
+def test_daily_adherence_matches_raw_log(db):
+    write_history()
+
+    assert database.get_daily_adherence(7) == raw_counts(7)
+
+
+def test_adherence_statistics_match_raw_log(db):
+    write_history()
+
+    stats = database.get_adherence_statistics(7)
+    rows = raw_counts(7)
+    assert stats['total_doses'] == sum(count for _, _, count in rows)
+    assert stats['taken'] == sum(count for _, status, count in rows if status == 'Taken')
+    assert stats['delayed'] == 1
+    assert dict(database.get_adherence_data(7)) == {'Taken': 5, 'Delayed': 1}
+
+
+def test_rebuild_restores_rollup(db):
+    write_history()
+    expected = database.get_daily_adherence(7)
+
+    with db_pool.get_connection() as conn:
+        conn.execute('DELETE FROM daily_adherence')
+    assert database.get_daily_adherence(7) == []
+
+    database.rebuild_daily_adherence()
+    assert database.get_daily_adherence(7) == expected
+
+
+def test_delete_medication_clears_rollup(db):
+    write_history()
+
+    database.delete_medication(2)
+
+    assert database.get_daily_adherence(7) == raw_counts(7)
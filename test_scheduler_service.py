@@ -0,0 +1,160 @@
+"""Tests for the host-wide scheduler service.
+
+Run with: python -m pytest -q test_scheduler_service.py
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_pool
+import database
+import scheduler_service
+from clock import SimulatedClock
+from event_scheduler import EventScheduler
+from models import DoseTime
+from scheduler_service import SchedulerService, get_scheduler_status
+
+START = datetime(2025, 6, 1, 8, 30)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_pool.configure_pool(str(tmp_path / 'service.db'), size=2)
+    database.init_database()
+    yield
+    db_pool.close_all_connections()
+
+
+class FakeSchedulers:
+    """Factory of event schedulers on a simulated clock that records dose loads"""
+
+    def __init__(self):
+        self.created = []
+        self.loads = []
+
+    def load_doses(self, medication_id=None):
+        self.loads.append(medication_id)
+        return [DoseTime(medication_id=1, minute_of_day=9 * 60, name="Med", dosage="10mg")]
+
+    def __call__(self):
+        scheduler = EventScheduler(self.load_doses, lambda doses: None, lambda doses: None,
+                                   clock=SimulatedClock(START))
+        scheduler.add_daily_job("22:00", lambda: None)
+        self.created.append(scheduler)
+        return scheduler
+
+
+def make_service(tmp_path, factory):
+    return SchedulerService(factory, lock_path=str(tmp_path / 'scheduler.lock'),
+                            status_path=str(tmp_path / 'status.json'),
+                            poll_seconds=0.01, heartbeat_seconds=0.05)
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_only_one_process_runs_the_scheduler(db, tmp_path):
+    factory = FakeSchedulers()
+    first = make_service(tmp_path, factory).start()
+    second = make_service(tmp_path, factory).start()
+    try:
+        assert first.is_owner
+        assert not second.is_owner
+        assert len(factory.created) == 1
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_start_keeps_a_lock_taken_beforehand(db, tmp_path):
+    factory = FakeSchedulers()
+    service = make_service(tmp_path, factory)
+    assert service.lock.acquire()
+    lock_file = service.lock._file
+
+    other = make_service(tmp_path, factory).start()
+    service.start()
+    try:
+        assert service.is_owner and not other.is_owner
+        assert service.lock._file is lock_file
+    finally:
+        service.stop()
+        other.stop()
+
+
+def test_standby_takes_over_when_the_owner_stops(db, tmp_path):
+    factory = FakeSchedulers()
+    first = make_service(tmp_path, factory).start()
+    second = make_service(tmp_path, factory).start()
+    try:
+        first.stop()
+        assert not first.is_owner
+        assert wait_for(lambda: second.is_owner)
+        assert len(factory.created) == 2
+    finally:
+        second.stop()
+
+
+def test_reload_requests_from_other_processes_reach_the_owner(db, tmp_path):
+    factory = FakeSchedulers()
+    owner = make_service(tmp_path, factory).start()
+    standby = make_service(tmp_path, factory).start()
+    try:
+        standby.request_reload(7)
+        standby.request_reload(7)
+
+        assert wait_for(lambda: 7 in factory.loads)
+        assert factory.loads.count(7) == 1
+        with db_pool.get_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM schedule_changes').fetchone()[0] == 0
+    finally:
+        owner.stop()
+        standby.stop()
+
+
+def test_changes_queued_without_a_scheduler_apply_on_takeover(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler_service, '_service', None)
+    scheduler_service.request_reload(3)
+
+    factory = FakeSchedulers()
+    service = make_service(tmp_path, factory).start()
+    try:
+        assert wait_for(lambda: 3 in factory.loads)
+    finally:
+        service.stop()
+
+
+def test_status_reports_jobs_and_next_fire_times(db, tmp_path):
+    service = make_service(tmp_path, FakeSchedulers()).start()
+    try:
+        status = get_scheduler_status(service.status_path, heartbeat_seconds=service.heartbeat_seconds)
+
+        assert status['running'] and status['healthy']
+        assert status['dose_count'] == 1
+        assert status['job_count'] == 1
+        assert [(event['time'], event['kind']) for event in status['next_fire_times']] == [
+            ('2025-06-01T09:00:00', 'reminder'),
+            ('2025-06-01T09:01:00', 'missed'),
+            ('2025-06-01T22:00:00', 'job'),
+        ]
+    finally:
+        service.stop()
+
+    assert not get_scheduler_status(service.status_path)['running']
+
+
+def test_stale_heartbeat_is_unhealthy(tmp_path):
+    path = tmp_path / 'status.json'
+    path.write_text(json.dumps({'running': True,
+                                'heartbeat_at': (datetime.now() - timedelta(minutes=5)).isoformat()}))
+
+    status = get_scheduler_status(str(path), heartbeat_seconds=30)
+
+    assert status['running'] and not status['healthy']
+    assert get_scheduler_status(str(tmp_path / 'missing.json')) == {'running': False, 'healthy': False}
@@ -0,0 +1,83 @@
+"""Tests for the stock depletion forecast behind refill alerts.
+
+Run with: python -m pytest -q test_stock_forecast.py
+"""
+from datetime import date, timedelta
+
+import pytest
+
+import config
+import db_pool
+import database
+
+TODAY = date(2025, 6, 1)
+
+
+@pytest.fixture(params=['text', 'integer'])
+def db(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(config, 'LOG_STORAGE', request.param)
+    db_pool.configure_pool(str(tmp_path / 'stock.db'), size=1)
+    database.init_database()
+    database.add_medication_with_type("Paracetamol", "500mg", 2, "09:00,21:00", 30, "Tablet")
+    database.add_medication_with_type("Metformin", "850mg", 1, "08:00", 60, "Tablet")
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = '2025-05-01'")
+    yield
+    db_pool.close_all_connections()
+
+
+def days_before(n):
+    return (TODAY - timedelta(days=n)).isoformat()
+
+
+def days_left():
+    return {f.medication_id: f.days_left for f in database.get_stock_forecast(TODAY)}
+
+
+def test_without_history_the_schedule_sets_the_rate(db):
+    forecast = database.get_stock_forecast(TODAY)
+
+    assert [(f.name, f.daily_use, f.days_left) for f in forecast] == [
+        ("Paracetamol", 2, 15.0),
+        ("Metformin", 1, 60.0),
+    ]
+
+
+def test_taken_history_sets_the_rate(db):
+    # Only the morning dose is actually taken; today's logs are left out of the window
+    database.log_medications_bulk([(1, "09:00", "Taken", days_before(n)) for n in range(15)])
+    database.log_medications_bulk([(1, "21:00", "Missed", days_before(n)) for n in range(1, 15)])
+
+    assert days_left()[1] == pytest.approx(30.0)
+
+
+def test_recently_added_medication_uses_days_since_added(db):
+    with db_pool.get_connection() as conn:
+        conn.execute("UPDATE medications SET added_date = ? WHERE id = 2", (days_before(3),))
+    database.log_medications_bulk([(2, "08:00", "Taken", days_before(n)) for n in (1, 2, 3)] +
+                                  [(2, "Manual", "Taken", days_before(n)) for n in (1, 2, 3)])
+
+    assert days_left()[2] == pytest.approx(30.0)
+
+
+def test_refill_alerts_use_the_lead_time(db):
+    database.update_tablet_count(1, 5)
+
+    assert [(f.medication_id, f.days_left) for f in database.get_medications_to_refill(3, TODAY)] == [(1, 2.5)]
+    assert database.get_medications_to_refill(2, TODAY) == []
+
+
+def test_forecast_is_cached_until_stock_or_taken_counts_change(db):
+    first = database.get_stock_forecast(TODAY)
+    assert database.get_stock_forecast(TODAY) is first
+
+    database.log_medications_bulk([(1, "09:00", "Missed", days_before(1))])
+    assert database.get_stock_forecast(TODAY) is first
+
+    database.log_medications_bulk([(1, "09:00", "Taken", days_before(1))])
+    second = database.get_stock_forecast(TODAY)
+    assert second is not first
+
+    database.update_tablet_count(2, 10)
+    assert database.get_stock_forecast(TODAY) is not second
+    assert days_left()[2] == 10.0
@@ -0,0 +1,102 @@
+"""Tests for the prepared guardian message templates.
+
+Run with: python -m pytest -q test_templates.py
+"""
+import json
+
+import pytest
+
+from models import OutboxMessage
+from outbox_worker import missed_dose_digest
+from templates import (DailySummary, LowStock, MARKDOWN, PLAIN, MessageTemplate, MissedDose, MissedDoses,
+                       format_date, format_time, render)
+
+
+def test_english_missed_dose_alert_reads_as_before():
+    body = render('missed_dose', MissedDose("Asha", "Metformin (500mg)", '2025-06-01', "21:05"))
+
+    assert body == """🚨 *MEDICATION ALERT*
+
+Patient: Asha
+Medication: Metformin (500mg)
+Scheduled Time: 9:05 PM
+Status: ❌ MISSED
+
+This medication was not taken as scheduled. Please check on the patient.
+
+- DoseBuddy Alert System"""
+
+
+def test_daily_summary_verdicts_and_locale_date():
+    summary = DailySummary("Asha", '2025-06-01', 4, 1, 80.0)
+
+    assert "Date: June 01, 2025" in render('daily_summary', summary)
+    assert "✅ Good job!" in render('daily_summary', summary)
+    assert "🌟 Perfect day!" in render('daily_summary', DailySummary("Asha", '2025-06-01', 5, 0, 100))
+    assert "⚠️ Needs improvement" in render('daily_summary', DailySummary("Asha", '2025-06-01', 1, 4, 20.0))
+
+    spanish = render('daily_summary', summary, locale='es')
+    assert "Fecha: 1 de junio de 2025" in spanish
+    assert "✅ ¡Buen trabajo!" in spanish
+
+
+def test_guardian_time_format_overrides_the_locale():
+    dose = MissedDose("Asha", "Metformin", '2025-06-01', "07:30")
+
+    assert "Scheduled Time: 7:30 AM" in render('missed_dose', dose)
+    assert "Scheduled Time: 07:30" in render('missed_dose', dose, time_format='24h')
+    assert "Hora prevista: 07:30" in render('missed_dose', dose, locale='es')
+    assert "Hora prevista: 7:30 AM" in render('missed_dose', dose, locale='es', time_format='12h')
+
+
+def test_plain_markup_drops_asterisks_from_the_template_only():
+    body = render('low_stock', LowStock("Asha", "*Special* syrup", 3, 1.6), markup=PLAIN)
+
+    assert body.startswith("⚠️ LOW STOCK ALERT\n")
+    assert "Medication: *Special* syrup" in body
+    assert "Remaining: 3 doses\nRuns out in: about 2 day(s)" in body
+    assert "Runs out" not in render('low_stock', LowStock("Asha", "Syrup", 3))
+
+
+def test_missed_doses_lists_twenty_then_sums_up():
+    doses = [(f"Med {i}", '2025-06-01', "08:00") for i in range(23)]
+
+    body = render('missed_doses', MissedDoses("Asha", doses))
+
+    assert "Missed doses: 23" in body
+    assert "• Med 19 - 2025-06-01 8:00 AM\n• ...and 3 more" in body
+    assert "Med 20 " not in body
+
+
+def test_unknown_locale_falls_back_to_the_default():
+    assert render('low_stock', LowStock("Asha", "Syrup", 3), locale='xx') == render('low_stock',
+                                                                                   LowStock("Asha", "Syrup", 3))
+
+
+def test_template_keeps_literal_quotes_braces_and_backslashes():
+    template = MessageTemplate('Say "{greeting}" {{not a field}} \\ {count:03d}*', MARKDOWN)
+
+    assert template.fields == {'greeting', 'count'}
+    assert template.render({'greeting': "hi", 'count': 7}) == 'Say "hi" {not a field} \\ 007*'
+    assert MessageTemplate("*Static*", PLAIN).static == "Static"
+
+    for text in ("{payload.__class__}", "{values[0]}", "{name!r}", "{count:{width}}"):
+        with pytest.raises(ValueError):
+            MessageTemplate(text)
+
+
+def test_times_that_are_not_hh_mm_pass_through():
+    assert format_time("9:00 AM") == "9:00 AM"
+    assert format_time("00:15") == "12:15 AM"
+    assert format_date('2025-12-25', 'es') == "25 de diciembre de 2025"
+
+
+def test_digest_renders_in_the_guardians_locale_and_channel_markup():
+    def message(i, channel):
+        payload = dict(MissedDose("Asha", f"Med {i}", '2025-06-01', "20:00").to_dict(), locale='es', time_format=None)
+        return OutboxMessage(id=i, channel=channel, kind='missed_dose', payload=json.dumps(payload))
+
+    body = missed_dose_digest([message(1, 'sms'), message(2, 'sms')])
+
+    assert body.startswith("🚨 MEDICACIONES NO TOMADAS\n")
+    assert "• Med 1 - 2025-06-01 20:00\n• Med 2 - 2025-06-01 20:00" in body
@@ -1,80 +1,135 @@
 from twilio.rest import Client
-from datetime import datetime
-
-# ===== YOUR TWILIO CREDENTIALS =====
-TWILIO_ACCOUNT_SID = "AC5f53cf902cab3585403d9121ea1f4932"
-TWILIO_AUTH_TOKEN = "6e7e59714c1cfcbebee8dabb0dd4b7e1"
-TWILIO_WHATSAPP_NUMBER = "whatsapp:+14155238886"
-
-def send_whatsapp_alert(guardian_phone, patient_name, medication_name, scheduled_time):
-    """Send WhatsApp alert to guardian when medication is missed"""
+from twilio.http.http_client import TwilioHttpClient
+from requests.adapters import HTTPAdapter
+import threading
+
+import clock
+import config
+from templates import DailySummary, LowStock, MissedDose, MissedDoses, render
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def create_client(base_url=None):
+    """New Twilio client with its own keep-alive connection pool and request timeout"""
+    if not config.TWILIO_ACCOUNT_SID or not config.TWILIO_AUTH_TOKEN:
+        raise RuntimeError("Twilio credentials not configured (set TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)")
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=config.TWILIO_TIMEOUT_SECONDS)
+    # One host, so one pool with a connection per concurrent WhatsApp delivery
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.TWILIO_POOL_SIZE)
+    http_client.session.mount('https://', adapter)
+    http_client.session.mount('http://', adapter)
+
+    client = Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN, http_client=http_client)
+    base_url = base_url or config.TWILIO_API_BASE_URL
+    if base_url:
+        client.api.base_url = base_url
+    return client
+
+
+def get_client():
+    """Shared Twilio client, created on first use
+
+    Every message reuses its HTTPS connections instead of a new session,
+    TLS handshake and auth setup per message. Safe to share between the
+    dispatcher's delivery threads.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def reset_client():
+    """Drop the shared client, e.g. after changing credentials"""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def send_message(guardian_phone, body):
+    """Send one WhatsApp message; returns the message SID and raises on any error"""
+    message = get_client().messages.create(
+        from_=config.TWILIO_WHATSAPP_NUMBER,
+        body=body,
+        to=f"whatsapp:{guardian_phone}"
+    )
+    return message.sid
+
+def send_sms(phone, body):
+    """Send one SMS from config.TWILIO_SMS_NUMBER; returns the message SID and raises on any error"""
+    if not config.TWILIO_SMS_NUMBER:
+        raise RuntimeError("No SMS sender number configured (set TWILIO_SMS_NUMBER)")
+    
+    message = get_client().messages.create(
+        from_=config.TWILIO_SMS_NUMBER,
+        body=body.replace("*", ""),
+        to=phone
+    )
+    return message.sid
+
+def _send_logged(guardian_phone, body, label):
     try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        message_body = f"""🚨 *MEDICATION ALERT*
-
-Patient: {patient_name}
-Medication: {medication_name}
-Scheduled Time: {scheduled_time}
-Status: ❌ MISSED
-
-This medication was not taken as scheduled. Please check on the patient.
-
-- DoseBuddy Alert System"""
-
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            body=message_body,
-            to=f"whatsapp:{guardian_phone}"
-        )
-        
-        print(f"✅ WhatsApp alert sent! Message SID: {message.sid}")
+        sid = send_message(guardian_phone, body)
+        print(f"✅ {label} sent! Message SID: {sid}")
         return True
     
     except Exception as e:
         print(f"❌ Error sending WhatsApp: {e}")
         return False
 
-def send_low_stock_alert(guardian_phone, patient_name, medication_name, remaining_count):
-    """Send WhatsApp alert for low stock"""
-    try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        message_body = f"""⚠️ *LOW STOCK ALERT*
+# ===== MESSAGES =====
+# Bodies come from the prepared templates (templates.py), in the default locale
 
-Patient: {patient_name}
-Medication: {medication_name}
-Remaining: {remaining_count} doses
+def missed_dose_message(patient_name, medication_name, scheduled_time, date=None):
+    return render('missed_dose', MissedDose(patient_name, medication_name, date, scheduled_time))
 
-Please refill the medication soon!
+def missed_doses_summary_message(patient_name, missed_doses):
+    return render('missed_doses', MissedDoses(patient_name, missed_doses))
 
-- DoseBuddy Alert System"""
+def low_stock_message(patient_name, medication_name, remaining_count, days_left=None):
+    return render('low_stock', LowStock(patient_name, medication_name, remaining_count, days_left))
 
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            body=message_body,
-            to=f"whatsapp:{guardian_phone}"
-        )
-        
-        print(f"✅ Low stock alert sent! Message SID: {message.sid}")
-        return True
-    
-    except Exception as e:
-        print(f"❌ Error sending WhatsApp: {e}")
-        return False
+def daily_summary_message(patient_name, stats, date=None):
+    return render('daily_summary', DailySummary(
+        patient_name, (date or clock.now()).strftime('%Y-%m-%d'),
+        stats.get('taken', 0), stats.get('missed', 0), stats.get('adherence_rate', 0)
+    ))
+
+# ===== SENDING =====
+
+def send_whatsapp_alert(guardian_phone, patient_name, medication_name, scheduled_time):
+    """Send WhatsApp alert to guardian when medication is missed"""
+    return _send_logged(guardian_phone, missed_dose_message(patient_name, medication_name, scheduled_time),
+                        "WhatsApp alert")
+
+def send_missed_doses_summary(guardian_phone, patient_name, missed_doses):
+    """Send one WhatsApp alert listing several missed doses
+
+    missed_doses holds (medication_name, date, scheduled_time) tuples, e.g.
+    doses found by the catch-up after the scheduler was down.
+    """
+    return _send_logged(guardian_phone, missed_doses_summary_message(patient_name, missed_doses),
+                        "Missed doses alert")
+
+def send_low_stock_alert(guardian_phone, patient_name, medication_name, remaining_count, days_left=None):
+    """Send WhatsApp alert for low stock, with the forecast days left if known"""
+    return _send_logged(guardian_phone, low_stock_message(patient_name, medication_name, remaining_count, days_left),
+                        "Low stock alert")
 
 def test_whatsapp_connection(guardian_phone):
     """Test WhatsApp connection"""
     try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            body="✅ DoseBuddy WhatsApp notifications are now active! You will receive alerts when medications are missed or stock is low.",
-            to=f"whatsapp:{guardian_phone}"
+        sid = send_message(
+            guardian_phone,
+            "✅ DoseBuddy WhatsApp notifications are now active! You will receive alerts when medications are missed or stock is low."
         )
         
-        return True, f"Test message sent successfully! Message SID: {message.sid}"
+        return True, f"Test message sent successfully! Message SID: {sid}"
     
     except Exception as e:
         error_msg = str(e)
@@ -90,38 +145,4 @@ def test_whatsapp_connection(guardian_phone):
 
 def send_daily_summary(guardian_phone, patient_name, stats):
     """Send daily summary report"""
-    try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        adherence = stats.get('adherence_rate', 0)
-        taken = stats.get('taken', 0)
-        missed = stats.get('missed', 0)
-        
-        emoji = "🌟" if adherence == 100 else "✅" if adherence >= 80 else "⚠️"
-        feedback = "Perfect day!" if adherence == 100 else "Good job!" if adherence >= 80 else "Needs improvement"
-        
-        message_body = f"""📊 *DAILY SUMMARY*
-
-Patient: {patient_name}
-Date: {datetime.now().strftime('%B %d, %Y')}
-
-✅ Taken: {taken} dose(s)
-❌ Missed: {missed} dose(s)
-📈 Adherence: {adherence}%
-
-{emoji} {feedback}
-
-- DoseBuddy Daily Report"""
-
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            body=message_body,
-            to=f"whatsapp:{guardian_phone}"
-        )
-        
-        print(f"✅ Daily summary sent! Message SID: {message.sid}")
-        return True
-    
-    except Exception as e:
-        print(f"❌ Error sending daily summary: {e}")
-        return False
+    return _send_logged(guardian_phone, daily_summary_message(patient_name, stats), "Daily summary")